@@ -0,0 +1,93 @@
+"""
+Adaptive top_k retrieval with score-gap early termination.
+
+Instead of a fixed top_k, results are fetched progressively (a few at a
+time, doubling) and the number of chunks kept is chosen from the shape of
+the score curve:
+
+- a clear gap between consecutive scores means everything after it is a
+  different, weaker topic, so retrieval stops at the gap;
+- once enough chunks clear the confidence score, the question is answered
+  and nothing more is needed;
+- otherwise every result above the score floor is kept, up to max_k.
+"""
+
+import os
+import json
+import time
+
+INITIAL_K = 4
+MAX_K = 16
+MIN_SCORE = 0.6
+# Drop in similarity between consecutive results that counts as a clear gap
+SCORE_GAP = 0.04
+# This many chunks at or above CONFIDENCE_SCORE are enough to answer
+CONFIDENCE_SCORE = 0.75
+CONFIDENT_CHUNKS = 2
+
+# Set RETRIEVAL_LOG to a file path to append one JSON line per query
+RETRIEVAL_LOG = os.getenv("RETRIEVAL_LOG")
+
+def choose_k(scores, complete, min_k=1, min_score=MIN_SCORE, score_gap=SCORE_GAP,
+             confidence_score=CONFIDENCE_SCORE, confident_chunks=CONFIDENT_CHUNKS):
+    """
+    Decide how many of the (descending) scores to keep.
+    complete: True if no further results exist beyond these scores, so the
+        last position can be treated as final.
+    Returns (k, reason), or (None, 'need_more') if a decision needs more
+    results.
+    """
+    above_floor = sum(1 for score in scores if score >= min_score)
+
+    confident = sum(1 for score in scores if score >= confidence_score)
+    if confident >= confident_chunks:
+        return max(min_k, confident_chunks), 'confidence'
+
+    for i in range(max(min_k, 1), above_floor):
+        if scores[i - 1] - scores[i] >= score_gap:
+            return i, 'gap'
+
+    # Every fetched result is above the floor, so the next one might be too
+    if above_floor == len(scores) and not complete:
+        return None, 'need_more'
+    # Results below the floor are never kept, as with a fixed top_k
+    return above_floor, 'floor'
+
+def progressive_search(search, initial_k=INITIAL_K, max_k=MAX_K, min_k=1, **choose_kwargs):
+    """
+    search(k) must return up to k matches with a .score, best first.
+    Fetches initial_k, then doubles until choose_k can decide or max_k is
+    reached. Returns (matches[:k], info) where info describes the decision.
+    """
+    k = initial_k
+    fetches = 0
+    while True:
+        matches = search(k)
+        fetches += 1
+        scores = [match.score for match in matches]
+        complete = len(matches) < k or k >= max_k
+        chosen, reason = choose_k(scores, complete, min_k=min_k, **choose_kwargs)
+        if chosen is not None:
+            break
+        k = min(k * 2, max_k)
+
+    info = {
+        'k': chosen,
+        'reason': reason,
+        'fetched': len(matches),
+        'fetches': fetches,
+        'top_score': round(scores[0], 4) if scores else None,
+        'cut_score': round(scores[chosen - 1], 4) if chosen else None
+    }
+    return matches[:chosen], info
+
+def log_choice(query_text, info):
+    """Log the chosen k so thresholds can be tuned from real traffic."""
+    print(f"[retrieval] k={info['k']} ({info['reason']}, fetched {info['fetched']} in {info['fetches']} "
+          f"round(s), top {info['top_score']}, cut {info['cut_score']})")
+    if RETRIEVAL_LOG:
+        try:
+            with open(RETRIEVAL_LOG, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'time': time.time(), 'query': query_text, **info}) + '\n')
+        except OSError as e:
+            print(f"Error writing retrieval log: {e}")
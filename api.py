@@ -0,0 +1,164 @@
+"""
+HTTP JSON API for the Facts-Only Mutual Fund FAQ Assistant.
+
+Wraps query_rag in an ASGI app so the assistant can run behind a load
+balancer with several worker processes, independently of the Streamlit UI.
+
+Run with:
+    uvicorn api:app --host 0.0.0.0 --port 8000 --workers 4
+
+Endpoints:
+    POST /query     {"question": "...", "top_k": 5, "deadline_ms": 20000, "context": {...}}
+    GET  /healthz   liveness: the process is up
+    GET  /readyz    readiness: the RAG backend is loaded and accepting work
+
+The backend is loaded at startup. If that fails (e.g. Pinecone is
+unreachable), /readyz and /query retry the load, backing off up to
+BACKEND_RETRY_MAX_SECONDS between attempts, so a worker recovers without
+being restarted.
+
+Each worker runs at most RAG_API_MAX_INFLIGHT queries at once. When all
+slots are busy, new queries are rejected with 429 rather than queued.
+Answers carry a Server-Timing header with the time spent in each query
+stage (embed, search, hydrate, generate; see stage_timing.py). The
+deadline is passed on to query_rag, which answers from the top retrieved
+chunk ("degraded": true) when the model can't answer in time; queries that
+retrieve nothing before their deadline, or still run past it, get 504.
+
+The service is stateless: each answer includes a "context" object, which
+the client sends back with the next question so follow-ups like "and its
+exit load?" can be resolved (see conversation.py).
+"""
+
+import os
+import time
+import asyncio
+import functools
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+
+from deadlines import DeadlineExceeded
+from stage_timing import collect_stages
+
+MAX_INFLIGHT = int(os.getenv("RAG_API_MAX_INFLIGHT", "8"))
+DEFAULT_DEADLINE_MS = int(os.getenv("RAG_API_DEADLINE_MS", "30000"))
+MAX_DEADLINE_MS = 120000
+RETRY_AFTER_SECONDS = 1
+# query_rag's own deadline is this much shorter, so its fallback answer
+# arrives before the request times out
+DEADLINE_MARGIN_MS = 250
+# Backoff between attempts to load a backend that failed to load
+BACKEND_RETRY_SECONDS = 1
+BACKEND_RETRY_MAX_SECONDS = 60
+
+# query_rag is blocking, so queries run on a dedicated pool with one thread
+# per admission slot
+_executor = ThreadPoolExecutor(max_workers=MAX_INFLIGHT, thread_name_prefix="rag-query")
+_inflight = 0
+_state = {'ready': False, 'error': None, 'query_rag': None, 'failures': 0, 'retry_at': 0.0}
+_load_lock = asyncio.Lock()
+
+class QueryRequest(BaseModel):
+    question: str = Field(..., min_length=1, max_length=1000)
+    top_k: int = Field(5, ge=1, le=20)
+    deadline_ms: Optional[int] = Field(None, ge=100, le=MAX_DEADLINE_MS)
+    context: Optional[Dict[str, Any]] = None
+
+def _load_backend():
+    # Connecting to Pinecone happens once per worker at startup rather than
+    # on the first query, so /readyz reflects whether the index is reachable
+    from rag_query import query_rag
+    from main import get_index
+    get_index()
+    return query_rag
+
+async def ensure_backend():
+    """
+    Load the backend unless it is loaded, or a failed load is still backing
+    off. Returns whether it is ready. Concurrent callers share one attempt.
+    """
+    if _state['ready']:
+        return True
+    async with _load_lock:
+        if _state['ready'] or time.monotonic() < _state['retry_at']:
+            return _state['ready']
+        try:
+            _state['query_rag'] = await asyncio.get_running_loop().run_in_executor(_executor, _load_backend)
+            _state.update(ready=True, error=None, failures=0)
+            print("✓ RAG backend loaded")
+        except Exception as e:
+            delay = min(BACKEND_RETRY_MAX_SECONDS, BACKEND_RETRY_SECONDS * 2 ** _state['failures'])
+            _state.update(error=str(e), failures=_state['failures'] + 1, retry_at=time.monotonic() + delay)
+            print(f"✗ Error loading RAG backend (attempt {_state['failures']}, retrying in {delay}s): {e}")
+        return _state['ready']
+
+@asynccontextmanager
+async def lifespan(app):
+    await ensure_backend()
+    yield
+    _state['ready'] = False
+    _executor.shutdown(wait=False, cancel_futures=True)
+
+app = FastAPI(title="Facts-Only MF Assistant API", lifespan=lifespan)
+
+@app.get("/healthz")
+async def healthz():
+    return {'status': 'ok'}
+
+@app.get("/readyz")
+async def readyz():
+    if not await ensure_backend():
+        return JSONResponse({'status': 'not ready', 'error': _state['error']}, status_code=503)
+    return {'status': 'ready', 'inflight': _inflight, 'capacity': MAX_INFLIGHT}
+
+def _run_query(query_rag, question, **kwargs):
+    """query_rag's response and the StageRecord of its stages."""
+    with collect_stages() as record:
+        response = query_rag(question, **kwargs)
+    return response, record
+
+def _release_slot(_future):
+    global _inflight
+    _inflight -= 1
+
+@app.post("/query")
+async def query(request: QueryRequest, http_response: Response):
+    global _inflight
+    if not await ensure_backend():
+        return JSONResponse({'error': 'Service is starting up'}, status_code=503)
+
+    # Backpressure: reject instead of queueing once every slot is taken.
+    # The counter is only touched on the event loop thread, so no lock is needed.
+    if _inflight >= MAX_INFLIGHT:
+        return JSONResponse({'error': 'Too many concurrent requests, please retry shortly'},
+                            status_code=429, headers={'Retry-After': str(RETRY_AFTER_SECONDS)})
+    _inflight += 1
+
+    loop = asyncio.get_running_loop()
+    deadline_ms = request.deadline_ms or DEFAULT_DEADLINE_MS
+    future = loop.run_in_executor(_executor, functools.partial(
+        _run_query, _state['query_rag'], request.question, top_k=request.top_k, context=request.context,
+        deadline_ms=max(deadline_ms - DEADLINE_MARGIN_MS, deadline_ms // 2)))
+    # The slot is held until the worker thread actually finishes, even if the
+    # caller has already been answered with a timeout
+    future.add_done_callback(_release_slot)
+
+    try:
+        response, record = await asyncio.wait_for(asyncio.shield(future), timeout=deadline_ms / 1000)
+    except (asyncio.TimeoutError, DeadlineExceeded):
+        return JSONResponse({'error': f'Query did not complete within {deadline_ms} ms'}, status_code=504)
+    except Exception as e:
+        print(f"Error processing query: {e}")
+        return JSONResponse({'error': 'Internal error while processing the query'}, status_code=500)
+    http_response.headers['Server-Timing'] = record.server_timing()
+    return response
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("api:app", host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("PORT", "8000")),
+                workers=int(os.getenv("RAG_API_WORKERS", "1")))
@@ -2,9 +2,145 @@
 Streamlit UI for Facts-Only Mutual Fund FAQ Assistant
 """
 
+import os
+import time
+import requests
 import streamlit as st
-from rag_query import query_rag
 from datetime import datetime
+from conversation import resolve_turn
+from deadlines import DeadlineExceeded
+
+# Streamlit re-executes this script on every interaction; time each rerun
+_rerun_started = time.perf_counter()
+
+# When set, questions are sent to the HTTP API (api.py) instead of running
+# the RAG pipeline inside the Streamlit process
+RAG_API_URL = os.getenv("RAG_API_URL", "").rstrip("/")
+RAG_API_TIMEOUT = 35
+
+# Answers to recent questions are reused across sessions for this long
+ANSWER_CACHE_TTL = 600
+# Messages kept per session, and how many are rendered by default
+MAX_HISTORY_MESSAGES = 40
+RECENT_MESSAGES_SHOWN = 6
+# The same question submitted again within this window is ignored
+DUPLICATE_WINDOW_SECONDS = 10
+
+class AssistantUnavailable(Exception):
+    """A transient failure, raised inside the cached call so it isn't cached."""
+
+class DegradedAnswer(Exception):
+    """A fallback answer quoted from a source; shown, but not cached."""
+
+    def __init__(self, response):
+        super().__init__(response.get('answer', ''))
+        self.response = response
+
+@st.cache_resource
+def get_http_session():
+    """One pooled HTTP session per server process."""
+    return requests.Session()
+
+@st.cache_resource
+def get_query_rag():
+    """Load the in-process RAG pipeline (and its API clients) once per server process."""
+    from rag_query import query_rag
+    return query_rag
+
+def fetch_answer(question, context=None):
+    """
+    Get an answer for a question, from the API service if RAG_API_URL is
+    configured, otherwise by calling query_rag in-process.
+    context: the previous answer's conversation context, for follow-ups
+    Raises AssistantUnavailable for errors worth retrying, and DegradedAnswer
+    for answers that shouldn't be reused.
+    """
+    if not RAG_API_URL:
+        try:
+            response = get_query_rag()(question, context=context)
+        except DeadlineExceeded:
+            raise AssistantUnavailable("That question took too long to answer. Please try again or rephrase it.")
+    else:
+        try:
+            http_response = get_http_session().post(f"{RAG_API_URL}/query",
+                                                    json={"question": question, "context": context},
+                                                    timeout=RAG_API_TIMEOUT)
+        except requests.RequestException as e:
+            print(f"Error calling RAG API: {e}")
+            raise AssistantUnavailable("I'm having trouble reaching the assistant service. Please try again in a moment.")
+
+        if http_response.status_code == 429:
+            raise AssistantUnavailable("The assistant is handling a lot of questions right now. Please try again in a few seconds.")
+        if http_response.status_code == 504:
+            raise AssistantUnavailable("That question took too long to answer. Please try again or rephrase it.")
+        if not http_response.ok:
+            print(f"RAG API error {http_response.status_code}: {http_response.text[:200]}")
+            raise AssistantUnavailable("I encountered an unexpected error while processing your request. Please try again later.")
+        response = http_response.json()
+
+    if response.get('error'):
+        raise AssistantUnavailable(response.get('answer', ''))
+    if response.get('degraded'):
+        raise DegradedAnswer(response)
+    return response
+
+@st.cache_data(ttl=ANSWER_CACHE_TTL, max_entries=256, show_spinner=False)
+def cached_answer(question, context=None):
+    return fetch_answer(question, context)
+
+def ask_assistant(question, context=None):
+    """
+    Answer a question, reusing a recent answer to the same question.
+    context: the previous answer's conversation context. It is only sent
+    (and only becomes part of the cache key) when the question is a
+    follow-up, so standalone questions still share cached answers.
+    """
+    question = " ".join(question.split())
+    if not resolve_turn(question, context)['follow_up']:
+        context = None
+    try:
+        return cached_answer(question, context)
+    except DegradedAnswer as e:
+        return e.response
+    except AssistantUnavailable as e:
+        return {
+            'answer': str(e),
+            'citation': None,
+            'timestamp': datetime.now().strftime("%Y-%m-%d")
+        }
+
+def submit_question(question):
+    """Queue a question to be answered on the next run of the script."""
+    st.session_state.pending_question = question
+
+def submit_typed_question():
+    question = st.session_state.question_input.strip()
+    # Clear the field so a later rerun can't submit the same text again
+    st.session_state.question_input = ""
+    if question:
+        submit_question(question)
+
+def is_duplicate_submission(question):
+    """True if this session asked the same question moments ago."""
+    last = st.session_state.get('last_submission')
+    now = time.time()
+    st.session_state.last_submission = (question, now)
+    return last is not None and last[0] == question and now - last[1] < DUPLICATE_WINDOW_SECONDS
+
+def format_message_footer(citation, timestamp):
+    """Citation and timestamp HTML, built once when the message is added."""
+    footer = ""
+    if citation:
+        footer += f'<p class="citation">📎 Source: <a href="{citation}" target="_blank">{citation}</a></p>'
+    if timestamp:
+        footer += f'<p class="timestamp">Last updated from sources: {timestamp}</p>'
+    return footer
+
+def render_message(message):
+    with st.chat_message(message["role"]):
+        st.markdown(message["content"])
+        if message.get("footer_html"):
+            st.markdown(message["footer_html"], unsafe_allow_html=True)
 
 # Page configuration
 st.set_page_config(
@@ -133,71 +269,69 @@ example_questions = [
 col1, col2, col3 = st.columns(3)
 for idx, question in enumerate(example_questions[:3]):
     with [col1, col2, col3][idx]:
-        if st.button(question, key=f"example_{idx}", use_container_width=True):
-            st.session_state.user_input = question
+        st.button(question, key=f"example_{idx}", use_container_width=True,
+                  on_click=submit_question, args=(question,))
 
 # Chat interface
 st.markdown("---")
 st.markdown("### 💬 Ask a Question")
 
-# User input
-user_input = st.text_input(
+# User input; submitting queues the question and clears the field, so a
+# rerun triggered by any other widget never re-asks it
+st.text_input(
     "Enter your question about mutual fund schemes:",
-    value=st.session_state.get('user_input', ''),
-    key="user_input_field",
+    key="question_input",
+    on_change=submit_typed_question,
     placeholder="e.g., What is the expense ratio of Groww Value Fund?"
 )
 
-if 'user_input' in st.session_state:
-    user_input = st.session_state.user_input
-    del st.session_state.user_input
+user_input = st.session_state.pop('pending_question', None)
+if user_input and is_duplicate_submission(user_input):
+    user_input = None
 
-# Display chat history
-if st.session_state.messages:
+# Display chat history; older messages are only rendered on request
+messages = st.session_state.messages
+if messages:
     st.markdown("### 📜 Chat History")
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
-            if "citation" in message and message["citation"]:
-                st.markdown(f'<p class="citation">📎 Source: <a href="{message["citation"]}" target="_blank">{message["citation"]}</a></p>', unsafe_allow_html=True)
-            if "timestamp" in message:
-                st.markdown(f'<p class="timestamp">Last updated from sources: {message["timestamp"]}</p>', unsafe_allow_html=True)
+    earlier = messages[:-RECENT_MESSAGES_SHOWN]
+    if earlier and st.toggle(f"Show {len(earlier)} earlier messages", key="show_earlier_messages"):
+        for message in earlier:
+            render_message(message)
+    for message in messages[-RECENT_MESSAGES_SHOWN:]:
+        render_message(message)
 
 # Process query
+query_ms = 0.0
 if user_input:
-    # Add user message to history
-    st.session_state.messages.append({"role": "user", "content": user_input})
-    
-    # Show user message
-    with st.chat_message("user"):
-        st.markdown(user_input)
+    user_message = {"role": "user", "content": user_input}
+    render_message(user_message)
     
     # Get response
-    with st.chat_message("assistant"):
-        with st.spinner("Searching for factual information..."):
-            response = query_rag(user_input)
-        
-        # Display answer
-        answer = response.get('answer', '')
-        st.markdown(answer)
-        
-        # Display citation if available
-        citation = response.get('citation')
-        if citation:
-            st.markdown(f'<p class="citation">📎 Source: <a href="{citation}" target="_blank">{citation}</a></p>', unsafe_allow_html=True)
-        
-        # Display timestamp
-        timestamp = response.get('timestamp', datetime.now().strftime("%Y-%m-%d"))
-        st.markdown(f'<p class="timestamp">Last updated from sources: {timestamp}</p>', unsafe_allow_html=True)
-        
-        # Add assistant message to history
-        st.session_state.messages.append({
-            "role": "assistant",
-            "content": answer,
-            "citation": citation,
-            "timestamp": timestamp,
-            "refused": response.get('refused', False)
-        })
+    query_started = time.perf_counter()
+    with st.spinner("Searching for factual information..."):
+        response = ask_assistant(user_input, st.session_state.get('conversation_context'))
+    # Refusals and errors carry no context; the conversation stays on the
+    # previous topic
+    if response.get('context'):
+        st.session_state.conversation_context = response['context']
+    query_ms = (time.perf_counter() - query_started) * 1000
+    
+    answer = response.get('answer', '')
+    citation = response.get('citation')
+    timestamp = response.get('timestamp', datetime.now().strftime("%Y-%m-%d"))
+    assistant_message = {
+        "role": "assistant",
+        "content": answer,
+        "citation": citation,
+        "timestamp": timestamp,
+        "refused": response.get('refused', False),
+        "footer_html": format_message_footer(citation, timestamp)
+    }
+    render_message(assistant_message)
+    
+    # Add both messages to history, keeping only the most recent ones
+    messages.extend([user_message, assistant_message])
+    del messages[:-MAX_HISTORY_MESSAGES]
 
 # Footer
 st.markdown("---")
@@ -208,3 +342,14 @@ st.markdown("""
     </div>
 """, unsafe_allow_html=True)
 
+# Rerun metrics: time spent re-executing the script, excluding the query
+rerun_ms = (time.perf_counter() - _rerun_started) * 1000 - query_ms
+metrics = st.session_state.setdefault('rerun_metrics', {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+metrics['count'] += 1
+metrics['total_ms'] += rerun_ms
+metrics['max_ms'] = max(metrics['max_ms'], rerun_ms)
+st.sidebar.caption(
+    f"Script rerun: {rerun_ms:.0f} ms (avg {metrics['total_ms'] / metrics['count']:.0f} ms, "
+    f"max {metrics['max_ms']:.0f} ms over {metrics['count']} runs)"
+    + (f" · query: {query_ms:.0f} ms" if query_ms else "")
+)
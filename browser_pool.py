@@ -0,0 +1,136 @@
+"""
+Pool of reusable headless Chrome instances for JavaScript-rendered pages.
+
+Selenium and webdriver_manager are imported only when the first browser is
+started, so importing this module (or extractor.py) stays cheap when the
+fallback is never needed.
+"""
+
+import os
+import atexit
+import threading
+from contextlib import contextmanager
+from queue import Queue, Empty
+
+POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "2"))
+PAGE_LOAD_TIMEOUT = 30
+# Extra time for client-side rendering after the load event
+RENDER_WAIT_SECONDS = 3
+ACQUIRE_TIMEOUT = 120
+
+class BrowserPool:
+    """
+    Up to `size` headless browsers, started on demand and reused between
+    pages. A browser that errors is discarded and replaced on next use.
+    """
+
+    def __init__(self, size=POOL_SIZE, page_load_timeout=PAGE_LOAD_TIMEOUT):
+        self.size = size
+        self.page_load_timeout = page_load_timeout
+        self._idle = Queue()
+        self._lock = threading.Lock()
+        self._started = 0
+        self._closed = False
+
+    def _create_driver(self):
+        # Deferred: these imports are slow and only needed for the fallback
+        from selenium import webdriver
+        from selenium.webdriver.chrome.service import Service
+        from selenium.webdriver.chrome.options import Options
+        from webdriver_manager.chrome import ChromeDriverManager
+
+        options = Options()
+        options.add_argument('--headless=new')
+        options.add_argument('--no-sandbox')
+        options.add_argument('--disable-dev-shm-usage')
+        options.add_argument('--disable-gpu')
+        options.add_argument('--blink-settings=imagesEnabled=false')
+        return webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+
+    @contextmanager
+    def browser(self):
+        """Borrow a browser, starting a new one if the pool isn't full yet."""
+        if self._closed:
+            raise RuntimeError("Browser pool is closed")
+        driver = None
+        try:
+            driver = self._idle.get_nowait()
+        except Empty:
+            with self._lock:
+                can_start = self._started < self.size
+                if can_start:
+                    self._started += 1
+            if can_start:
+                try:
+                    driver = self._create_driver()
+                except Exception:
+                    with self._lock:
+                        self._started -= 1
+                    raise
+                try:
+                    driver.set_page_load_timeout(self.page_load_timeout)
+                except Exception:
+                    self._discard(driver)
+                    raise
+            else:
+                driver = self._idle.get(timeout=ACQUIRE_TIMEOUT)
+
+        healthy = True
+        try:
+            yield driver
+        except Exception:
+            healthy = False
+            raise
+        finally:
+            if healthy and not self._closed:
+                self._idle.put(driver)
+            else:
+                self._discard(driver)
+
+    def _discard(self, driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        with self._lock:
+            self._started -= 1
+
+    def render(self, url, wait_for=(), wait_seconds=RENDER_WAIT_SECONDS):
+        """
+        Load url in a pooled browser and return the rendered HTML.
+        wait_for: phrases whose appearance means the dynamic sections have
+            rendered; waits up to wait_seconds after page load for any of them.
+        """
+        with self.browser() as driver:
+            driver.get(url)
+            if wait_for and wait_seconds:
+                from selenium.webdriver.support.ui import WebDriverWait
+                from selenium.common.exceptions import TimeoutException
+                phrases = [phrase.lower() for phrase in wait_for]
+                try:
+                    WebDriverWait(driver, wait_seconds).until(
+                        lambda d: any(phrase in d.page_source.lower() for phrase in phrases))
+                except TimeoutException:
+                    pass
+            return driver.page_source
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except Empty:
+                break
+            self._discard(driver)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_browser_pool():
+    """The shared pool for this process, created on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool()
+            atexit.register(_pool.close)
+        return _pool
@@ -0,0 +1,154 @@
+"""
+Crash-safe progress journal for build_index.
+
+Every unit of work is appended to a file in the checkpoint directory (and
+flushed to disk) as soon as it completes, so a build that dies halfway can
+be continued with `python build_index.py --resume`:
+
+    state.json        snapshot hash the embeddings below belong to, and
+                      the embedding dimension
+    extracted.jsonl   one {'url', 'text'} line per extracted page
+    embeddings.f32    float32 embedding rows, appended per batch
+    embeddings.ids    chunk ID of each embedding row, one per line
+    upserted.ids      chunk IDs acknowledged by Pinecone, one per line
+
+Append-only files are read back up to their last complete record, so a
+crash in the middle of a write loses at most that one record.
+"""
+
+import os
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+CHECKPOINT_DIR = 'build_checkpoint'
+STATE_FILE = 'state.json'
+EXTRACTED_FILE = 'extracted.jsonl'
+EMBEDDINGS_FILE = 'embeddings.f32'
+EMBEDDING_IDS_FILE = 'embeddings.ids'
+UPSERTED_FILE = 'upserted.ids'
+
+class BuildCheckpoint:
+    """
+    Progress of one build. Unless resume is True, any progress left by a
+    previous build in the same directory is discarded. The directory is
+    created when the first progress is recorded.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = Path(path)
+        if not resume and self.path.exists():
+            shutil.rmtree(self.path)
+        self._repair()
+
+    def _repair(self):
+        """
+        Cut a record torn by a crash off the end of each file, so appends
+        made after resuming line up with what was read back.
+        """
+        for name in (EXTRACTED_FILE, EMBEDDING_IDS_FILE, UPSERTED_FILE):
+            path = self.path / name
+            if path.exists():
+                data = path.read_bytes()
+                complete = data.rfind(b'\n') + 1
+                if complete < len(data):
+                    with open(path, 'r+b') as f:
+                        f.truncate(complete)
+        dimension = self._read_state().get('dimension')
+        path = self.path / EMBEDDINGS_FILE
+        if dimension and path.exists():
+            rows = len(self._read_lines(EMBEDDING_IDS_FILE))
+            with open(path, 'r+b') as f:
+                f.truncate(rows * dimension * 4)
+
+    def _append(self, name, data):
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / name, 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _read_lines(self, name):
+        """Complete lines of an append-only file; a torn last line is ignored."""
+        try:
+            with open(self.path / name, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        return [line.decode('utf-8') for line in data.split(b'\n')[:-1]]
+
+    # Step 1: extraction
+
+    def record_extraction(self, doc):
+        self._append(EXTRACTED_FILE, (json.dumps({'url': doc['url'], 'text': doc['text']}) + '\n').encode('utf-8'))
+
+    def extracted_corpus(self):
+        """Documents extracted so far, in extraction order."""
+        corpus = {}
+        for line in self._read_lines(EXTRACTED_FILE):
+            doc = json.loads(line)
+            corpus[doc['url']] = doc
+        return list(corpus.values())
+
+    # Step 3: embeddings
+
+    def bind_snapshot(self, snapshot_hash):
+        """
+        Tie the embeddings and upserts to a corpus snapshot. If the corpus
+        has changed since they were recorded, they no longer match the
+        chunks and are discarded.
+        """
+        state = self._read_state()
+        if state.get('snapshot_hash') != snapshot_hash:
+            for name in (EMBEDDINGS_FILE, EMBEDDING_IDS_FILE, UPSERTED_FILE):
+                (self.path / name).unlink(missing_ok=True)
+            if state.get('snapshot_hash'):
+                print("  Corpus changed since the checkpoint; discarding saved embeddings")
+            self._write_state({'snapshot_hash': snapshot_hash})
+
+    def record_embeddings(self, ids, embeddings):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        state = self._read_state()
+        if 'dimension' not in state:
+            self._write_state({**state, 'dimension': vectors.shape[1]})
+        # Rows first, then IDs: an ID is only trusted once its row is on disk
+        self._append(EMBEDDINGS_FILE, vectors.tobytes())
+        self._append(EMBEDDING_IDS_FILE, ''.join(doc_id + '\n' for doc_id in ids).encode('utf-8'))
+
+    def embeddings(self):
+        """{chunk_id: embedding} for every embedding saved so far."""
+        ids = self._read_lines(EMBEDDING_IDS_FILE)
+        if not ids:
+            return {}
+        dimension = self._read_state()['dimension']
+        vectors = np.fromfile(self.path / EMBEDDINGS_FILE, dtype=np.float32)
+        vectors = vectors[:len(ids) * dimension].reshape(len(ids), dimension)
+        return {doc_id: vector.tolist() for doc_id, vector in zip(ids, vectors)}
+
+    # Step 4: upserts
+
+    def record_upserts(self, ids):
+        self._append(UPSERTED_FILE, ''.join(doc_id + '\n' for doc_id in ids).encode('utf-8'))
+
+    def upserted_ids(self):
+        return set(self._read_lines(UPSERTED_FILE))
+
+    def _read_state(self):
+        try:
+            with open(self.path / STATE_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write_state(self, state):
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.path / (STATE_FILE + '.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.path / STATE_FILE)
+
+    def clear(self):
+        """Remove the checkpoint once the build has completed."""
+        shutil.rmtree(self.path, ignore_errors=True)
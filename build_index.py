@@ -1,104 +1,380 @@
 """
 Build Pinecone index from URLs in groww.csv
 This script:
-1. Extracts text from URLs using extractor.py
+1. Extracts text from URLs using extractor.py (or loads a saved snapshot)
 2. Chunks the text using chunk.py
 3. Generates embeddings using main.py
-4. Stores vectors in Pinecone
+4. Stores vectors in Pinecone, each tagged with its scheme partition
+   (see scheme_router.py)
+
+Everything is written to a staging directory first. The served files in
+the project directory (corpus and chunk stores, scheme catalogue, local
+index and manifest) are only replaced once every vector has been uploaded,
+so queries never read chunk text that doesn't match the vectors.
+
+Usage:
+    python build_index.py                                  # crawl groww.csv
+    python build_index.py --from-snapshot corpus.mfcs      # no crawl
+    python build_index.py --from-snapshot parsed_data.json --chunks-only --output-dir chunking_test
+    python build_index.py --resume                         # continue a failed build
 """
 
+import os
 import sys
-import time
+import json
+import shutil
+import argparse
+from pathlib import Path
+from datetime import datetime
 
 try:
-    from extractor import extract_corpus_from_file, generate_json_output
-    from chunk import create_documents_from_corpus
-    from main import get_embedding, upsert_vectors
+    from extractor import extract_corpus_from_file, get_absolute_path
+    from chunk import chunk_corpus_store
+    from corpus_store import (
+        CORPUS_STORE_FILE, CHUNK_STORE_FILE, write_corpus_store, load_snapshot, open_store
+    )
+    from build_checkpoint import BuildCheckpoint, CHECKPOINT_DIR
+    from quantized_index import build_quantized_index, LOCAL_INDEX_DIR
+    from scheme_router import (
+        CATALOG_FILE, build_catalog, write_catalog, scheme_from_url
+    )
 except ImportError as e:
     print(f"Error importing required modules: {e}")
     print("Please make sure all dependencies are installed: pip install -r requirements.txt")
     sys.exit(1)
 
-def build_index(csv_file='groww.csv'):
+INDEX_MANIFEST_FILE = 'index_manifest.json'
+# Where builds into the project directory are prepared until they are published
+STAGING_DIR = 'build_staging'
+EMBEDDING_BATCH_SIZE = 64
+
+def write_index_manifest(snapshot_info, chunk_count, vector_count, path=None, extra=None):
+    """
+    Record which corpus snapshot the index was built from.
+    extra: additional fields to store, e.g. the namespace built into
+    """
+    if path is None:
+        path = get_absolute_path(INDEX_MANIFEST_FILE)
+    manifest = {
+        'index_name': 'mf-facts',
+        'built_at': datetime.now().isoformat(timespec='seconds'),
+        'snapshot': snapshot_info,
+        'chunks': chunk_count,
+        'vectors': vector_count,
+        **(extra or {})
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def build_index(csv_file='groww.csv', local_index_dir=LOCAL_INDEX_DIR, snapshot=None, chunks_only=False,
+                namespace="", output_dir=None, resume=False):
     """
     Complete pipeline to build the Pinecone index.
+
+    snapshot: path to a saved corpus (corpus store or JSON export such as
+        parsed_data.json). When given, the crawl is skipped entirely.
+    chunks_only: stop after writing the chunk store, without embedding or
+        uploading anything. Together with snapshot this needs no network.
+        Nothing is published, so the served files are left alone.
+    namespace: Pinecone namespace to upload into (see refresh_daemon.py).
+    output_dir: where to write the stores, local index and manifest. They
+        stay there, and the served files are left alone. Without it the
+        build is staged in STAGING_DIR and published to the project
+        directory only after every embedding and upload succeeded.
+    resume: continue from the checkpoint left by a build that failed or was
+        interrupted, skipping pages, embeddings and upserts already done.
+        Progress is always checkpointed; without resume an old checkpoint is
+        discarded.
+
+    Returns the index manifest, or None if the build stopped early.
     """
+    publish = output_dir is None
+    if publish:
+        output_dir = get_absolute_path(STAGING_DIR)
+
+    def output_path(name):
+        return Path(output_dir) / name
+
     print("=" * 60)
     print("Building Pinecone Index for Mutual Fund FAQ")
     print("=" * 60)
+
+    # Opened only by steps that record progress: the crawl, embeddings and
+    # uploads. A snapshot build stopping at --chunks-only never touches it
+    checkpoint = None if snapshot else BuildCheckpoint(output_path(CHECKPOINT_DIR), resume=resume)
     
-    # Step 1: Extract text from URLs
-    print("\n[Step 1/4] Extracting text from URLs...")
-    try:
-        corpus = extract_corpus_from_file(csv_file)
-    except FileNotFoundError:
-        print(f"Error: {csv_file} not found. Please create it with URLs (one per line).")
-        return
-    except Exception as e:
-        print(f"Error extracting text from URLs: {e}")
-        import traceback
-        traceback.print_exc()
-        return
-    
-    if not corpus:
-        print("Error: No corpus extracted. Please check:")
-        print("  1. groww.csv exists and has URLs (one per line)")
-        print("  2. URLs are accessible")
-        print("  3. Internet connection is working")
-        return
-    
-    print(f"✓ Extracted {len(corpus)} documents")
+    if snapshot:
+        print(f"\n[Step 1/4] Loading corpus snapshot from {snapshot}...")
+        try:
+            corpus, snapshot_info = load_snapshot(snapshot)
+        except FileNotFoundError:
+            print(f"Error: snapshot {snapshot} not found.")
+            return
+        except (ValueError, OSError) as e:
+            print(f"Error reading snapshot {snapshot}: {e}")
+            return
+        print(f"✓ Loaded {len(corpus)} documents (snapshot {snapshot_info['snapshot_hash'][:12]})")
+    else:
+        corpus, snapshot_info = _crawl_corpus(csv_file, output_path(CORPUS_STORE_FILE), checkpoint)
+        if not corpus:
+            return
 
-    # Generate JSON output
-    print("\n[Step 1.5/4] Generating JSON output of parsed data...")
-    generate_json_output(corpus)
-    print("✓ JSON output generated.")
+    # Save the corpus store
+    print("\n[Step 1.5/4] Saving corpus store...")
+    corpus_store_path = output_path(CORPUS_STORE_FILE)
+    write_corpus_store(corpus, corpus_store_path, meta={'source': str(snapshot or csv_file)})
+    # Duplicate URLs are stored once; the build is tied to what was stored
+    stored = open_store(corpus_store_path)
+    snapshot_info.update({'snapshot_hash': stored.meta['snapshot_hash'], 'documents': len(stored)})
+    print(f"✓ Corpus saved to {corpus_store_path}")
     
     # Step 2: Chunk the documents
     print("\n[Step 2/4] Chunking documents...")
-    documents = create_documents_from_corpus(corpus)
-    print(f"✓ Created {len(documents)} chunks from {len(corpus)} documents")
+    chunk_store_path = output_path(CHUNK_STORE_FILE)
+    documents = _load_chunks(chunk_store_path, snapshot_info['snapshot_hash']) if resume else None
+    if documents:
+        print(f"✓ Reusing {len(documents)} chunks from {chunk_store_path}")
+    else:
+        documents = chunk_corpus_store(corpus_store_path, chunk_store_path)
+        print(f"✓ Created {len(documents)} chunks from {len(corpus)} documents")
+        print(f"✓ Chunks saved to {chunk_store_path}")
+
+    # Each chunk is tagged with its scheme's partition, so a question naming
+    # a scheme is searched with a filter on that partition
+    for doc in documents:
+        doc['metadata']['partition'] = scheme_from_url(doc['metadata']['url'])[0]
+
+    if chunks_only:
+        print(f"\nStopping after chunking (--chunks-only). Output is in {output_dir}; "
+              f"the served files are unchanged.")
+        return None
+    if checkpoint is None:
+        checkpoint = BuildCheckpoint(output_path(CHECKPOINT_DIR), resume=resume)
+
+    # Imported here so that snapshot and chunk-only runs never connect to
+    # OpenAI or Pinecone
+    try:
+        from main import get_embeddings
+        from rate_limiter import PRIORITY_BACKGROUND
+    except ImportError as e:
+        print(f"Error importing required modules: {e}")
+        print("Please make sure all dependencies are installed: pip install -r requirements.txt")
+        return
     
     # Step 3: Generate embeddings
+    # Chunks are embedded in batches under the shared rate limiter, at
+    # background priority so that live user queries are served first
+    # Each batch is saved to the checkpoint as soon as it arrives
     print("\n[Step 3/4] Generating embeddings...")
-    documents_with_embeddings = []
+    checkpoint.bind_snapshot(snapshot_info['snapshot_hash'])
+    saved_embeddings = checkpoint.embeddings()
+    pending = []
+    for doc in documents:
+        if doc['id'] in saved_embeddings:
+            doc['embedding'] = saved_embeddings[doc['id']]
+        else:
+            pending.append(doc)
+    if saved_embeddings:
+        print(f"  Resuming: {len(documents) - len(pending)} embeddings loaded from the checkpoint")
     failed_count = 0
-    for idx, doc in enumerate(documents, 1):
+    for start in range(0, len(pending), EMBEDDING_BATCH_SIZE):
+        batch = pending[start:start + EMBEDDING_BATCH_SIZE]
+        end = start + len(batch)
         try:
-            print(f"  [{idx}/{len(documents)}] Generating embedding for: {doc['id'][:50]}...")
-            embedding = get_embedding(doc['text'])
-            if embedding:
+            print(f"  [{end}/{len(pending)}] Generating embeddings for chunks {start + 1}-{end}...")
+            embeddings = get_embeddings([doc['text'] for doc in batch], priority=PRIORITY_BACKGROUND)
+            checkpoint.record_embeddings([doc['id'] for doc in batch], embeddings)
+            for doc, embedding in zip(batch, embeddings):
                 doc['embedding'] = embedding
-                documents_with_embeddings.append(doc)
-            else:
-                print(f"    ✗ Failed to generate embedding")
-                failed_count += 1
-            # Small delay to avoid rate limits
-            time.sleep(0.1)
         except Exception as e:
-            print(f"    ✗ Error generating embedding: {e}")
-            failed_count += 1
+            print(f"    ✗ Error generating embeddings: {e}")
+            failed_count += len(batch)
+    documents_with_embeddings = [doc for doc in documents if doc.get('embedding')]
     
     if failed_count > 0:
         print(f"⚠ Warning: {failed_count} embeddings failed to generate")
     
     print(f"✓ Generated {len(documents_with_embeddings)} embeddings")
     
-    # Step 4: Upsert to Pinecone (with text in metadata)
+    # Step 4: Upsert to Pinecone (chunk text stays in the local chunk store)
     print("\n[Step 4/4] Uploading to Pinecone...")
-    # Add text to metadata for retrieval
+    # Tag each vector with the snapshot it was built from
     for doc in documents_with_embeddings:
-        doc['metadata']['text'] = doc['text'][:5000]  # Store first 5000 chars in metadata
-    upsert_vectors(documents_with_embeddings)
-    print(f"✓ Uploaded {len(documents_with_embeddings)} vectors to Pinecone")
+        doc['metadata']['snapshot'] = snapshot_info['snapshot_hash'][:12]
+    uploaded = _upload(documents_with_embeddings, namespace, checkpoint)
+    print(f"✓ Uploaded {uploaded} vectors to Pinecone")
+
+    # The catalogue is only written once the tagged vectors are in the index,
+    # so the router never filters on partitions an older index doesn't have
+    catalog = build_catalog([item['url'] for item in corpus])
+    catalog_path = write_catalog(catalog, output_path(CATALOG_FILE))
+    print(f"✓ Scheme catalogue with {len(catalog['partitions'])} partitions "
+          f"and {len(catalog['aliases'])} aliases saved to {catalog_path}")
+
+    # Keep a local quantized copy for offline search and recall checks
+    if local_index_dir:
+        local_index_dir = output_path(local_index_dir)
+    if local_index_dir and documents_with_embeddings:
+        local_index = build_quantized_index(
+            local_index_dir,
+            [doc['id'] for doc in documents_with_embeddings],
+            [doc['embedding'] for doc in documents_with_embeddings]
+        )
+        usage = local_index.memory_usage()
+        print(f"✓ Wrote local index to {local_index_dir} "
+              f"(int8 {usage['int8_compression']:.1f}x, binary {usage['binary_compression']:.1f}x smaller than float)")
     
     print("\n" + "=" * 60)
     print("Index build complete!")
     print("=" * 60)
     print(f"Total documents: {len(corpus)}")
     print(f"Total chunks: {len(documents_with_embeddings)}")
-    print(f"Index name: mf-facts")
+    print(f"Index name: mf-facts" + (f" (namespace {namespace})" if namespace else "")
+          + f", {len(catalog['partitions'])} partitions")
+    print(f"Snapshot: {snapshot_info['snapshot_hash'][:12]} ({snapshot_info['path']})")
     print("=" * 60)
 
+    failed_upserts = len(documents_with_embeddings) - uploaded
+    complete = not (failed_count or failed_upserts)
+    if complete:
+        checkpoint.clear()
+    else:
+        print("Some chunks were not embedded or uploaded; run again with --resume to retry only those.")
+        if publish:
+            print(f"The served files were not replaced; this build stays in {output_dir} until then.")
+
+    # The manifest records where the files will be served from
+    local_index_name = Path(local_index_dir).name if local_index_dir and Path(local_index_dir).exists() else None
+    served = {name: get_absolute_path(name) if publish and complete else output_path(name)
+              for name in (CORPUS_STORE_FILE, CHUNK_STORE_FILE, CATALOG_FILE, INDEX_MANIFEST_FILE, local_index_name)
+              if name}
+    if not snapshot:
+        snapshot_info['path'] = str(served[CORPUS_STORE_FILE])
+    manifest = write_index_manifest(snapshot_info, len(documents), uploaded, path=output_path(INDEX_MANIFEST_FILE), extra={
+        'namespace': namespace,
+        'chunk_store': str(served[CHUNK_STORE_FILE]),
+        'catalog': str(served[CATALOG_FILE]),
+        'local_index': str(served[local_index_name]) if local_index_name else None,
+        'partitions': len(catalog['partitions']),
+        'failed_embeddings': failed_count,
+        'failed_upserts': failed_upserts
+    })
+    if publish and complete:
+        names = [CORPUS_STORE_FILE, CHUNK_STORE_FILE, CATALOG_FILE, INDEX_MANIFEST_FILE]
+        if local_index_name:
+            names.insert(0, local_index_name)
+        _publish(Path(output_dir), names)
+        print(f"✓ Published the build to {get_absolute_path('.')}")
+    return manifest
+
+def _publish(staging_dir, names):
+    """
+    Move a finished build's files from staging_dir into the project
+    directory, replacing the served ones, then remove staging_dir.
+    Each file is swapped in atomically.
+    """
+    for name in names:
+        staged, target = staging_dir / name, get_absolute_path(name)
+        if staged.is_dir():
+            # Directories can't replace each other atomically; move the old one aside first
+            old = target.with_name(target.name + '.old')
+            shutil.rmtree(old, ignore_errors=True)
+            if target.exists():
+                os.replace(target, old)
+            os.replace(staged, target)
+            shutil.rmtree(old, ignore_errors=True)
+        else:
+            os.replace(staged, target)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+def _upload(documents, namespace, checkpoint):
+    """
+    Upsert documents, skipping those the checkpoint already has, and record
+    each acknowledged batch. Returns the vectors uploaded.
+    """
+    from main import upsert_vectors
+
+    acknowledged = checkpoint.upserted_ids() & {doc['id'] for doc in documents}
+    if acknowledged:
+        print(f"  Resuming: {len(acknowledged)} vectors were already uploaded")
+    summary = upsert_vectors([doc for doc in documents if doc['id'] not in acknowledged], namespace=namespace,
+                             on_success=checkpoint.record_upserts)
+    if summary and summary['failures']:
+        failed_ids = sum(len(failure['ids']) for failure in summary['failures'])
+        print(f"⚠ Warning: {len(summary['failures'])} batches ({failed_ids} vectors) failed to upload")
+        for failure in summary['failures']:
+            print(f"    ✗ Batch {failure['batch']}: {failure['error'][:200]}")
+    return len(acknowledged) + (summary['upserted'] if summary else 0)
+
+def _crawl_corpus(csv_file, corpus_store_path, checkpoint):
+    """
+    Step 1 of a full build: extract text from every URL in csv_file.
+    corpus_store_path: where the corpus will be saved, recorded as the snapshot
+    checkpoint: each page is saved to it as soon as it is extracted, and
+        pages it already has are not fetched again
+    Returns (corpus, snapshot_info), with an empty corpus on failure.
+    """
+    print("\n[Step 1/4] Extracting text from URLs...")
+    extracted = checkpoint.extracted_corpus()
+    if extracted:
+        print(f"Resuming: {len(extracted)} documents already extracted")
+    try:
+        corpus = extracted + extract_corpus_from_file(
+            csv_file,
+            skip_urls=[doc['url'] for doc in extracted],
+            on_document=checkpoint.record_extraction
+        )
+    except FileNotFoundError:
+        print(f"Error: {csv_file} not found. Please create it with URLs (one per line).")
+        return [], None
+    except Exception as e:
+        print(f"Error extracting text from URLs: {e}")
+        import traceback
+        traceback.print_exc()
+        return [], None
+    
+    if not corpus:
+        print("Error: No corpus extracted. Please check:")
+        print("  1. groww.csv exists and has URLs (one per line)")
+        print("  2. URLs are accessible")
+        print("  3. Internet connection is working")
+        return [], None
+    
+    print(f"✓ Extracted {len(corpus)} documents")
+    snapshot_info = {
+        'path': str(corpus_store_path),
+        'format': 'mfcs',
+        'documents': len(corpus)
+    }
+    return corpus, snapshot_info
+
+def _load_chunks(chunk_store_path, expected_hash):
+    """
+    Chunk documents from an existing chunk store, if it was built from the
+    same corpus snapshot; otherwise None.
+    """
+    store = open_store(chunk_store_path)
+    if store is None or store.meta.get('snapshot_hash') != expected_hash:
+        return None
+    documents = []
+    for record in store:
+        metadata = {key: value for key, value in record.items() if key not in ('id', 'text')}
+        documents.append({'id': record['id'], 'text': record['text'], 'metadata': metadata})
+    return documents
+
 if __name__ == "__main__":
-    build_index()
+    parser = argparse.ArgumentParser(description="Build the Pinecone index for the Mutual Fund FAQ.")
+    parser.add_argument('--csv', default='groww.csv', help="file with one URL per line to crawl")
+    parser.add_argument('--from-snapshot', dest='snapshot',
+                        help="build from a saved corpus (corpus.mfcs or parsed_data.json) instead of crawling")
+    parser.add_argument('--chunks-only', action='store_true',
+                        help="stop after writing the chunk store (no embeddings, no upload)")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue a failed or interrupted build from its checkpoint")
+    parser.add_argument('--output-dir',
+                        help="write the build here and leave the served files alone "
+                             f"(default: stage in {STAGING_DIR}/ and publish once the upload succeeds)")
+    args = parser.parse_args()
+    build_index(csv_file=args.csv, snapshot=args.snapshot, chunks_only=args.chunks_only, output_dir=args.output_dir,
+                resume=args.resume)
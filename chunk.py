@@ -1,3 +1,5 @@
+from corpus_store import CORPUS_STORE_FILE, CHUNK_STORE_FILE, CorpusStore, write_chunk_store
+
 def chunk_text(text, max_length=800):
     """
     Split text into chunks with special handling for exit load information.
@@ -135,3 +137,18 @@ def create_documents_from_corpus(corpus):
             })
     
     return documents
+
+def chunk_corpus_store(corpus_store_path=CORPUS_STORE_FILE, chunk_store_path=CHUNK_STORE_FILE):
+    """
+    Chunk every document in a corpus store and write the chunks to a chunk
+    store keyed by chunk ID.
+    Returns: list of dicts with 'id', 'text', and 'metadata' keys
+    """
+    store = CorpusStore(corpus_store_path)
+    try:
+        documents = create_documents_from_corpus(store)
+        snapshot = store.meta.get('snapshot_hash')
+    finally:
+        store.close()
+    write_chunk_store(documents, chunk_store_path, meta={'snapshot_hash': snapshot})
+    return documents
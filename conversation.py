@@ -0,0 +1,114 @@
+"""
+Follow-up question handling.
+
+Each answer carries a small conversation context (the resolved question,
+the schemes and facts it was about, and the IDs of the chunks retrieved
+for it). A follow-up such as "and its exit load?" or "what about Groww
+Liquid Fund?" is rewritten locally into a standalone question using that
+context, and when it asks about the same scheme the previous turn's chunks
+are reused, skipping the embedding and vector search round trips.
+
+No model calls are made here, so resolving a turn is cheap enough to run
+in the UI before deciding whether an answer can come from the cache.
+"""
+
+import re
+
+from scheme_router import get_router
+
+# Facts a question can ask about, with the phrases that identify them
+FACT_INTENTS = {
+    'exit load': ('exit load', 'exitload', 'redemption charge'),
+    'expense ratio': ('expense ratio', 'ter'),
+    'minimum SIP amount': ('sip', 'systematic investment plan', 'minimum investment'),
+    'NAV': ('nav', 'net asset value'),
+    'AUM': ('aum', 'assets under management', 'fund size'),
+    'riskometer rating': ('riskometer', 'risk level', 'risk rating'),
+    'benchmark': ('benchmark',),
+    'lock-in period': ('lock-in', 'lock in'),
+    'fund manager': ('fund manager', 'managed by', 'manages'),
+    'returns': ('returns', 'performance')
+}
+
+_INTENT_PATTERNS = {
+    intent: re.compile(r'\b(?:' + '|'.join(re.escape(phrase) for phrase in phrases) + r')\b', re.IGNORECASE)
+    for intent, phrases in FACT_INTENTS.items()
+}
+_FOLLOW_UP_START = re.compile(r'^\s*(?:and|also|what about|how about|same for|what of|then)\b', re.IGNORECASE)
+_REFERENCE = re.compile(r'\b(?:this fund|that fund|this scheme|that scheme|the fund|the scheme|its|it)\b',
+                        re.IGNORECASE)
+# Very short questions without a scheme are treated as follow-ups
+MAX_ELLIPTICAL_WORDS = 5
+# Chunk IDs kept in the context for reuse by the next turn
+MAX_CONTEXT_CHUNKS = 20
+
+def detect_schemes(text):
+    """Names of the schemes text mentions, by name or alias (see scheme_router.py)."""
+    return get_router().scheme_names_in(text)
+
+def detect_intents(text):
+    """Facts (keys of FACT_INTENTS) that text asks about or mentions."""
+    return [intent for intent, pattern in _INTENT_PATTERNS.items() if pattern.search(text)]
+
+def mentions_intents(texts, intents):
+    """True if every intent is mentioned in at least one of texts."""
+    return all(any(_INTENT_PATTERNS[intent].search(text) for text in texts) for intent in intents)
+
+def resolve_turn(question, context=None):
+    """
+    Work out what a question is asking in light of the previous turn.
+    context: the 'context' of the previous answer, or None
+    Returns {'query', 'schemes', 'intents', 'follow_up', 'reuse_chunks'}, where
+    query is the question rewritten to stand on its own, and reuse_chunks
+    means the previous turn's chunks may answer it.
+    """
+    schemes = detect_schemes(question)
+    intents = detect_intents(question)
+    turn = {'query': question, 'schemes': schemes, 'intents': intents, 'follow_up': False, 'reuse_chunks': False}
+    if not context:
+        return turn
+
+    previous_schemes = context.get('schemes') or []
+    previous_intents = context.get('intents') or []
+    continues = bool(_FOLLOW_UP_START.search(question))
+    reuse_chunks = False
+
+    refers_back = _REFERENCE.search(question)
+
+    if not schemes and previous_schemes and not intents and refers_back:
+        # "who manages it?": a fact we have no template for, so only the
+        # reference is replaced with the scheme name
+        name = ' and '.join(previous_schemes)
+        query = _REFERENCE.sub(lambda m: name + "'s" if m.group(0).lower() == 'its' else name, question, count=1)
+        turn.update(query=query, schemes=previous_schemes, follow_up=True)
+        return turn
+    elif not schemes and previous_schemes and intents and (
+            continues or refers_back or len(question.split()) <= MAX_ELLIPTICAL_WORDS):
+        # "and its exit load?": same scheme, another fact
+        schemes = previous_schemes
+        reuse_chunks = bool(context.get('chunk_ids'))
+    elif schemes and not intents and previous_intents and continues:
+        # "what about Groww Liquid Fund?": same fact, another scheme
+        intents = previous_intents
+    else:
+        return turn
+
+    turn.update(
+        query=f"What is the {' and '.join(intents)} of {' and '.join(schemes)}?",
+        schemes=schemes,
+        intents=intents,
+        follow_up=True,
+        reuse_chunks=reuse_chunks
+    )
+    return turn
+
+def make_context(turn, chunks):
+    """The conversation context to return with an answer to `turn`."""
+    chunks = chunks[:MAX_CONTEXT_CHUNKS]
+    return {
+        'query': turn['query'],
+        'schemes': turn['schemes'],
+        'intents': turn['intents'],
+        'chunk_ids': [chunk.id for chunk in chunks],
+        'scores': [round(chunk.score, 4) for chunk in chunks]
+    }
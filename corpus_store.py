@@ -0,0 +1,308 @@
+"""
+Compact, random-access record store for the extracted corpus and its chunks.
+
+Each record is a JSON object compressed with zlib. An offset index at the end
+of the file maps record IDs to their position, so a single document or chunk
+can be read without decompressing anything else.
+
+File layout (format version 1):
+    header   b'MFCS' + uint16 format version
+    records  zlib-compressed JSON, back to back
+    index    zlib-compressed JSON {'meta': {...}, 'offsets': {id: [offset, length]}}
+    footer   uint64 index offset + uint32 index length + b'MFCS'
+"""
+
+import sys
+import json
+import zlib
+import hashlib
+import struct
+import threading
+from pathlib import Path
+
+MAGIC = b'MFCS'
+FORMAT_VERSION = 1
+
+CORPUS_STORE_FILE = 'corpus.mfcs'
+CHUNK_STORE_FILE = 'chunks.mfcs'
+
+_HEADER = struct.Struct('<4sH')
+_FOOTER = struct.Struct('<QI4s')
+
+class CorpusStoreWriter:
+    """
+    Write records to a new store. Use as a context manager, or call close()
+    to write the offset index; the file is not readable until then.
+    """
+
+    def __init__(self, path, meta=None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.meta = dict(meta or {})
+        self._offsets = {}
+        # Write to a temporary file so readers never see a half-written store
+        self._tmp_path = self.path.with_name(self.path.name + '.tmp')
+        self._file = open(self._tmp_path, 'wb')
+        self._file.write(_HEADER.pack(MAGIC, FORMAT_VERSION))
+
+    def add(self, record_id, record):
+        """Append a JSON-serialisable record under record_id."""
+        if record_id in self._offsets:
+            raise ValueError(f"Duplicate record id: {record_id}")
+        payload = zlib.compress(json.dumps(record, ensure_ascii=False).encode('utf-8'))
+        self._offsets[record_id] = [self._file.tell(), len(payload)]
+        self._file.write(payload)
+
+    def __contains__(self, record_id):
+        return record_id in self._offsets
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.meta.setdefault('count', len(self._offsets))
+        index = zlib.compress(json.dumps({'meta': self.meta, 'offsets': self._offsets}).encode('utf-8'))
+        index_offset = self._file.tell()
+        self._file.write(index)
+        self._file.write(_FOOTER.pack(index_offset, len(index), MAGIC))
+        self._file.close()
+        self._tmp_path.replace(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            self._tmp_path.unlink(missing_ok=True)
+
+class CorpusStore:
+    """
+    Read-only access to a store written by CorpusStoreWriter.
+    Only the offset index is loaded up front; records are read on demand.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._file = open(self.path, 'rb')
+
+        magic, version = _HEADER.unpack(self._file.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a corpus store")
+        if version > FORMAT_VERSION:
+            raise ValueError(f"{self.path} uses store format {version}, newer than supported ({FORMAT_VERSION})")
+        self.version = version
+
+        self._file.seek(-_FOOTER.size, 2)
+        index_offset, index_length, magic = _FOOTER.unpack(self._file.read(_FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is truncated or was not closed properly")
+        self._file.seek(index_offset)
+        index = json.loads(zlib.decompress(self._file.read(index_length)))
+        self.meta = index['meta']
+        self._offsets = index['offsets']
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __contains__(self, record_id):
+        return record_id in self._offsets
+
+    def ids(self):
+        return list(self._offsets)
+
+    def get(self, record_id, default=None):
+        """Read and decode a single record by ID."""
+        location = self._offsets.get(record_id)
+        if location is None:
+            return default
+        offset, length = location
+        with self._lock:
+            self._file.seek(offset)
+            payload = self._file.read(length)
+        return json.loads(zlib.decompress(payload))
+
+    def __iter__(self):
+        for record_id in self._offsets:
+            yield self.get(record_id)
+
+    def close(self):
+        self._file.close()
+
+    def __del__(self):
+        file = getattr(self, '_file', None)
+        if file is not None:
+            file.close()
+
+_open_stores = {}
+_open_stores_lock = threading.Lock()
+
+def open_store(path):
+    """
+    Return a shared CorpusStore for path, or None if it doesn't exist.
+    The store is reopened if the file has been replaced since it was opened.
+    A replaced store is only dropped from the cache: a query that fetched it
+    before the cutover keeps reading from it, and its file is closed once
+    the last such caller lets go of it.
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+    mtime = path.stat().st_mtime_ns
+    with _open_stores_lock:
+        cached = _open_stores.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        store = CorpusStore(path)
+        _open_stores[path] = (mtime, store)
+        return store
+
+def snapshot_hash(corpus):
+    """
+    Content hash of a corpus, independent of document order and of the
+    format it was stored in. Used to tie an index to the snapshot it was
+    built from.
+    """
+    digest = hashlib.sha256()
+    for doc in sorted(corpus, key=lambda d: d.get('url', '')):
+        _hash_document(digest, doc)
+    return digest.hexdigest()
+
+def _hash_document(digest, doc):
+    digest.update(doc.get('url', '').encode('utf-8') + b'\0')
+    digest.update(doc.get('text', '').encode('utf-8') + b'\0')
+
+def write_corpus_store(corpus, path=CORPUS_STORE_FILE, meta=None):
+    """
+    Write extracted documents (dicts with 'url' and 'text') keyed by URL.
+    Text is stored in full, and the snapshot hash is recorded in the store
+    metadata. Returns the path written.
+    """
+    records = {}
+    for doc in corpus:
+        if doc.get('url') and doc['url'] not in records:
+            records[doc['url']] = {'url': doc['url'], 'text': doc.get('text', '')}
+    # Hash what is stored, so the recorded hash matches the stored snapshot
+    meta = {'kind': 'corpus', 'snapshot_hash': snapshot_hash(records.values()), **(meta or {})}
+    with CorpusStoreWriter(path, meta=meta) as writer:
+        for url, record in records.items():
+            writer.add(url, record)
+    return str(path)
+
+def write_chunk_store(documents, path=CHUNK_STORE_FILE, meta=None):
+    """
+    Write chunk documents (dicts with 'id', 'text' and 'metadata') keyed by
+    chunk ID. Returns the path written.
+    """
+    with CorpusStoreWriter(path, meta={'kind': 'chunks', **(meta or {})}) as writer:
+        for doc in documents:
+            writer.add(doc['id'], {'id': doc['id'], 'text': doc['text'], **doc.get('metadata', {})})
+    return str(path)
+
+def merge_stores(paths, path, meta=None):
+    """
+    Combine several stores of the same kind into one, e.g. the per-shard
+    stores of a sharded build. Records are copied one at a time in ID order,
+    so no store is ever fully loaded; the first copy of a duplicate ID wins.
+    For corpus stores the snapshot hash of the combined corpus is recorded,
+    equal to snapshot_hash() of all the documents. Returns the new metadata.
+    """
+    stores = [CorpusStore(p) for p in paths]
+    try:
+        owners = {}
+        for store in stores:
+            for record_id in store.ids():
+                owners.setdefault(record_id, store)
+        kind = stores[0].meta.get('kind') if stores else None
+        # Corpus records are keyed by URL, so ID order is snapshot_hash order
+        digest = hashlib.sha256() if kind == 'corpus' else None
+        with CorpusStoreWriter(path, meta={'kind': kind, **(meta or {})}) as writer:
+            for record_id in sorted(owners):
+                record = owners[record_id].get(record_id)
+                writer.add(record_id, record)
+                if digest is not None:
+                    _hash_document(digest, record)
+            if digest is not None:
+                writer.meta['snapshot_hash'] = digest.hexdigest()
+        return writer.meta
+    finally:
+        for store in stores:
+            store.close()
+
+def load_corpus(path):
+    """
+    Load a corpus as a list of {'url', 'text'} dicts from either a corpus
+    store or a legacy JSON export such as parsed_data.json, whose records
+    use 'extracted_text' (older exports used 'text').
+    """
+    return load_snapshot(path)[0]
+
+def load_snapshot(path):
+    """
+    Load a corpus snapshot (corpus store or legacy JSON export).
+    Returns (corpus, info) where info records the snapshot path, format,
+    format version, document count and content hash.
+    """
+    path = Path(path)
+    with open(path, 'rb') as f:
+        is_store = f.read(len(MAGIC)) == MAGIC
+
+    if is_store:
+        store = CorpusStore(path)
+        try:
+            corpus = list(store)
+            info = {'format': 'mfcs', 'format_version': store.version,
+                    'snapshot_hash': store.meta.get('snapshot_hash')}
+        finally:
+            store.close()
+    else:
+        corpus = _load_json_corpus(path)
+        info = {'format': 'json', 'format_version': None, 'snapshot_hash': None}
+
+    # Stores written before snapshot hashes were recorded are hashed on load
+    if not info['snapshot_hash']:
+        info['snapshot_hash'] = snapshot_hash(corpus)
+    info.update({'path': str(path), 'documents': len(corpus)})
+    return corpus, info
+
+def _load_json_corpus(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        records = json.load(f)
+    corpus = []
+    for record in records:
+        text = record.get('text') or record.get('extracted_text') or ''
+        if record.get('url') and text:
+            corpus.append({'url': record['url'], 'text': text})
+    return corpus
+
+if __name__ == "__main__":
+    usage = ("Usage:\n"
+             "  python corpus_store.py convert <parsed_data.json> [corpus.mfcs]\n"
+             "  python corpus_store.py info <store>\n"
+             "  python corpus_store.py get <store> <id>")
+    if len(sys.argv) < 3:
+        print(usage)
+        sys.exit(1)
+
+    command, source = sys.argv[1], sys.argv[2]
+    if command == 'convert':
+        target = sys.argv[3] if len(sys.argv) > 3 else CORPUS_STORE_FILE
+        corpus = load_corpus(source)
+        write_corpus_store(corpus, target, meta={'source': str(source)})
+        print(f"✓ Wrote {len(corpus)} documents to {target} ({Path(target).stat().st_size / 1024:.1f} KB)")
+    elif command == 'info':
+        store = CorpusStore(source)
+        print(f"Format version: {store.version}")
+        print(f"Records: {len(store)}")
+        print(f"Meta: {json.dumps(store.meta, indent=2)}")
+    elif command == 'get' and len(sys.argv) > 3:
+        record = CorpusStore(source).get(sys.argv[3])
+        if record is None:
+            print(f"No record with id: {sys.argv[3]}")
+            sys.exit(1)
+        print(json.dumps(record, indent=2, ensure_ascii=False))
+    else:
+        print(usage)
+        sys.exit(1)
@@ -0,0 +1,142 @@
+"""
+End-to-end query deadlines and hedged model calls.
+
+Each query gets a Deadline when it starts. Stages that can be cut short
+check how much time is left. hedged_call() runs a slow call, such as a chat
+completion, with a backup: if the first request hasn't answered by the
+hedge delay (by default the recent p95 latency of that call), an identical
+second request is sent and whichever finishes first wins. A request that
+fails early is replaced at once while time remains. When the deadline is
+reached, DeadlineExceeded is raised so the caller can fall back to a
+cheaper answer. Requests still running are left to finish on their own,
+bounded by the timeout passed to them, which also covers their retries.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from retry_policy import is_retryable
+
+# Default end-to-end budget for a query when the caller doesn't set one
+QUERY_DEADLINE_MS = int(os.getenv("QUERY_DEADLINE_MS", "20000"))
+# Hedge a call once it has run longer than this percentile of recent calls,
+# or after a fixed LLM_HEDGE_AFTER_MS when that is set
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+HEDGE_AFTER_MS = os.getenv("LLM_HEDGE_AFTER_MS")
+# Used until enough latencies have been observed
+DEFAULT_HEDGE_AFTER_MS = 3000
+MIN_HEDGE_AFTER_MS = 300
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 20
+# At most this many requests per call (the first one plus hedges and
+# replacements for requests that failed)
+MAX_ATTEMPTS = 3
+HEDGE_WORKERS = 32
+
+_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='hedge')
+
+class DeadlineExceeded(Exception):
+    """The query's deadline passed before the call returned."""
+
+class Deadline:
+    """A point in time by which a query must be answered."""
+
+    def __init__(self, ms=None):
+        self.ms = ms or QUERY_DEADLINE_MS
+        self.expires_at = time.monotonic() + self.ms / 1000
+
+    def remaining(self):
+        """Seconds left, never negative."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def __repr__(self):
+        return f"Deadline({self.remaining() * 1000:.0f} ms left of {self.ms} ms)"
+
+class LatencyTracker:
+    """Recent latencies of one kind of call, for choosing the hedge delay."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def hedge_after(self):
+        """Seconds to wait before sending a hedged request."""
+        if HEDGE_AFTER_MS:
+            return int(HEDGE_AFTER_MS) / 1000
+        with self._lock:
+            if len(self._latencies) < MIN_LATENCY_SAMPLES:
+                return DEFAULT_HEDGE_AFTER_MS / 1000
+            delay = float(np.percentile(self._latencies, HEDGE_PERCENTILE))
+        return max(MIN_HEDGE_AFTER_MS / 1000, delay)
+
+def _timed(call, timeout):
+    start = time.monotonic()
+    result = call(timeout)
+    return result, time.monotonic() - start
+
+def hedged_call(call, deadline, tracker, reserve=0.0, name='call'):
+    """
+    Run call(timeout) with hedging, and return the first successful result.
+    call: makes one request; timeout is the seconds it may take, including
+        any retries (see RateLimiter.run's stop_at)
+    deadline: the query's Deadline
+    tracker: LatencyTracker for this kind of call; updated with successes
+    reserve: seconds of the deadline to leave for the caller's fallback
+    Raises DeadlineExceeded when no request succeeds in time, or the last
+    request's error when every attempt failed before then.
+    """
+    def budget():
+        return deadline.remaining() - reserve
+
+    if budget() <= 0:
+        raise DeadlineExceeded(f"no time left for {name}")
+    hedge_at = time.monotonic() + tracker.hedge_after()
+    pending = {_pool.submit(_timed, call, budget())}
+    attempts = 1
+    last_error = None
+    while pending:
+        # Wake up for the hedge if nothing has finished by then
+        timeout = budget()
+        if attempts < MAX_ATTEMPTS:
+            timeout = min(timeout, max(0.0, hedge_at - time.monotonic()))
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                result, seconds = future.result()
+            except Exception as e:
+                last_error = e
+                if not is_retryable(e):
+                    # e.g. a bad API key: other requests would fail the same way
+                    raise
+                continue
+            tracker.record(seconds)
+            if attempts > 1:
+                print(f"[deadline] {name} answered after {attempts} requests")
+            return result
+        if budget() <= 0:
+            break
+        hedge_due = time.monotonic() >= hedge_at and len(pending) < 2
+        if attempts < MAX_ATTEMPTS and (hedge_due or not pending):
+            if pending:
+                print(f"[deadline] {name} slower than {tracker.hedge_after() * 1000:.0f} ms; sending a hedged request")
+                hedge_at = float('inf')
+            else:
+                print(f"[deadline] {name} failed ({last_error}); retrying with {budget():.1f}s left")
+                hedge_at = time.monotonic() + tracker.hedge_after()
+            pending.add(_pool.submit(_timed, call, budget()))
+            attempts += 1
+    if last_error is not None and not pending:
+        raise last_error
+    raise DeadlineExceeded(f"{name} did not answer within the deadline ({deadline.ms} ms)")
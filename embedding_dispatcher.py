@@ -0,0 +1,111 @@
+"""
+Micro-batching, single-flight dispatcher for embedding requests.
+
+Concurrent callers submit texts one at a time; the dispatcher collects every
+request that arrives within a short window into a single batched embeddings
+call and hands each caller its own vector. A text that is already waiting or
+being embedded is not sent again: later callers share the in-flight result.
+
+The window only forms batches. Each batch is sent from a small pool, so
+several can be in flight at once and a slow or rate-limited call doesn't
+hold up the requests queued behind it.
+"""
+
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+DEFAULT_WINDOW_MS = 5
+DEFAULT_MAX_BATCH = 64
+DEFAULT_MAX_INFLIGHT = 4
+
+class EmbeddingDispatcher:
+    """
+    embed_batch: function taking a list of texts and returning one vector per
+        text, in order (e.g. a single embeddings.create call)
+    window_ms: how long to wait after the first request for others to join
+    max_batch: send immediately once this many distinct texts are waiting
+    max_inflight: batches that may be sent at the same time; while all are
+        busy, new requests keep joining the next batch
+    """
+
+    def __init__(self, embed_batch, window_ms=DEFAULT_WINDOW_MS, max_batch=DEFAULT_MAX_BATCH,
+                 max_inflight=DEFAULT_MAX_INFLIGHT):
+        self.embed_batch = embed_batch
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._slots = threading.BoundedSemaphore(max_inflight)
+        self._senders = ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix='embedding-batch')
+        self._condition = threading.Condition()
+        self._pending = []
+        self._inflight = {}
+        self._thread = None
+        self.stats = {'requests': 0, 'coalesced': 0, 'batches': 0, 'texts_sent': 0}
+
+    def submit(self, text):
+        """Queue a text for embedding. Returns a Future for its vector."""
+        with self._condition:
+            self.stats['requests'] += 1
+            future = self._inflight.get(text)
+            if future is not None:
+                self.stats['coalesced'] += 1
+                return future
+
+            future = Future()
+            self._inflight[text] = future
+            self._pending.append(text)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='embedding-dispatcher', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+            return future
+
+    def embed(self, text, timeout=None):
+        """Embed a single text, blocking until its batch has been sent."""
+        return self.submit(text).result(timeout=timeout)
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            # Let other requests join until the window closes or the batch is full
+            window_end = time.monotonic() + self.window
+            while len(self._pending) < self.max_batch:
+                remaining = window_end - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            return batch
+
+    def _run(self):
+        while True:
+            # Wait for a free sender before forming the batch, so requests
+            # arriving meanwhile join it instead of queueing as small batches
+            self._slots.acquire()
+            batch = self._next_batch()
+            self._senders.submit(self._send, batch)
+
+    def _send(self, batch):
+        try:
+            vectors = self.embed_batch(batch)
+            if len(vectors) != len(batch):
+                raise ValueError(f"Expected {len(batch)} embeddings, got {len(vectors)}")
+            error = None
+        except Exception as e:
+            vectors, error = None, e
+        finally:
+            self._slots.release()
+
+        with self._condition:
+            self.stats['batches'] += 1
+            self.stats['texts_sent'] += len(batch)
+            futures = [self._inflight.pop(text) for text in batch]
+
+        # Resolve outside the lock so callbacks can submit new work
+        for i, future in enumerate(futures):
+            if error is None:
+                future.set_result(vectors[i])
+            else:
+                future.set_exception(error)
@@ -4,11 +4,19 @@ import time
 import json
 from pathlib import Path
 import requests
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
+from corpus_store import CORPUS_STORE_FILE, write_corpus_store
+from browser_pool import get_browser_pool
+from fact_harvester import harvest
+
+# Facts every scheme page should yield; if static extraction misses any of
+# them, the page is rendered in a headless browser instead
+KEY_FACT_TERMS = {
+    'expense ratio': ['expense ratio'],
+    'exit load': ['exit load', 'exitload']
+}
+# Only these sites render scheme facts client-side, so other pages (e.g.
+# SEBI listings) are never sent to the browser
+BROWSER_FALLBACK_DOMAINS = ('groww.in',)
 
 def get_absolute_path(relative_path):
     """Convert relative path to absolute path based on the script's location."""
@@ -19,10 +27,47 @@ def get_absolute_path(relative_path):
         base_path = Path(__file__).parent
     return (base_path / relative_path).resolve()
 
-def extract_text_from_url(url):
+def missing_key_facts(text):
+    """
+    Return the names of KEY_FACT_TERMS that don't appear in the text.
+    """
+    text_lower = (text or '').lower().replace(' ', '')
+    return [
+        fact for fact, terms in KEY_FACT_TERMS.items()
+        if not any(term.replace(' ', '') in text_lower for term in terms)
+    ]
+
+def needs_browser_fallback(url, text):
+    """
+    True if the page is on a site known to render facts client-side and the
+    static text lacks at least one key fact.
+    """
+    return any(domain in url for domain in BROWSER_FALLBACK_DOMAINS) and bool(missing_key_facts(text))
+
+def extract_text_from_html(html):
+    """
+    Extract text content from an HTML page, with the blocks holding facts
+    such as the exit load and expense ratio first (see fact_harvester.py).
+    """
+    return harvest(html)['text']
+
+def render_text_from_url(url):
+    """
+    Render a page in a pooled headless browser and extract its text.
+    Returns None if rendering fails.
+    """
+    try:
+        html = get_browser_pool().render(url, wait_for=[terms[0] for terms in KEY_FACT_TERMS.values()])
+    except Exception as e:
+        print(f"Error rendering {url} in browser: {e}")
+        return None
+    return extract_text_from_html(html)
+
+def extract_text_from_url(url, use_browser_fallback=True):
     """
     Extract text content from a URL, with special handling for dynamic Groww pages.
-    Special handling for exit load information extraction.
+    Static HTML is tried first; the headless browser is only used when the
+    static text lacks key facts such as the expense ratio or exit load.
     """
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
@@ -32,62 +77,28 @@ def extract_text_from_url(url):
         # First, try fetching with requests for static content
         response = requests.get(url, headers=headers, timeout=30)
         response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # First, try to extract exit load information specifically
-        exit_load_info = []
-        
-        # Common patterns for exit load information
-        exit_load_selectors = [
-            "div[data-testid*='exitLoad']",
-            "div:contains('Exit Load')",
-            "table:contains('Exit Load')",
-            "p:contains('exit load')",
-            "div:contains('exit load')",
-            "div.fund-attributes",
-            "div.fund-details",
-            "div.key-information"
-        ]
-        
-        for selector in exit_load_selectors:
-            try:
-                elements = soup.select(selector)
-                for element in elements:
-                    text = element.get_text(' ', strip=True)
-                    if 'exit load' in text.lower() or 'exitload' in text.lower().replace(' ', ''):
-                        if element.name == 'table':
-                            # Format table data
-                            rows = element.find_all('tr')
-                            table_data = []
-                            for row in rows:
-                                cols = row.find_all('td')
-                                if cols:
-                                    table_data.append(' | '.join(col.get_text(strip=True) for col in cols))
-                            if table_data:
-                                exit_load_info.append("Exit Load Details:\n" + "\n".join(table_data))
-                        else:
-                            exit_load_info.append(text)
-            except Exception as e:
-                continue
-        
-        # If we found exit load info, prepend it to the main content
-        if exit_load_info:
-            exit_load_text = "\n\n".join(exit_load_info)
-            main_content = soup.get_text(' ', strip=True)
-            return f"{exit_load_text}\n\n{main_content}"
-        
-        # If no exit load info found, proceed with normal extraction
-        main_content = soup.get_text(' ', strip=True)
-        return main_content
-
+        page = harvest(response.text)
+        text = page['text']
+        print(f"  Parsed {len(response.content) / 1024:.0f} KB in {page['cpu_ms']:.1f} ms CPU "
+              f"(facts: {', '.join(page['facts']) or 'none'})")
     except requests.RequestException as e:
         print(f"Error fetching {url}: {e}")
-        return None
+        text = None
 
-def extract_corpus_from_file(csv_file=None):
+    if use_browser_fallback and needs_browser_fallback(url, text):
+        print(f"  Static page is missing {', '.join(missing_key_facts(text))}; rendering in browser...")
+        rendered = render_text_from_url(url)
+        # Keep whichever version has more of the key facts
+        if rendered and len(missing_key_facts(rendered)) < len(missing_key_facts(text)):
+            return rendered
+    return text
+
+def extract_corpus_from_file(csv_file=None, skip_urls=(), on_document=None):
     """
     Extract text corpus from URLs listed in a CSV file.
     Returns a list of dictionaries with 'url' and 'text' keys.
+    skip_urls: URLs already extracted (e.g. by an interrupted build) to leave out
+    on_document: called with each document as soon as it has been extracted
     """
     if csv_file is None:
         csv_file = get_absolute_path('groww.csv')
@@ -110,16 +121,24 @@ def extract_corpus_from_file(csv_file=None):
         return corpus
 
     print(f"Found {len(urls)} URLs to process")
+    skip_urls = set(skip_urls)
+    if skip_urls:
+        print(f"Skipping {sum(1 for url in urls if url in skip_urls)} URLs that were already extracted")
     
     for i, url in enumerate(urls, 1):
+        if url in skip_urls:
+            continue
         try:
             print(f"\n[{i}/{len(urls)}] Processing: {url}")
             text = extract_text_from_url(url)
             if text:
-                corpus.append({
+                doc = {
                     'url': url,
                     'text': text
-                })
+                }
+                corpus.append(doc)
+                if on_document:
+                    on_document(doc)
                 print("✓ Successfully extracted text")
             else:
                 print("⚠ No text extracted from URL")
@@ -132,7 +151,8 @@ def extract_corpus_from_file(csv_file=None):
 
 def generate_json_output(corpus, output_file=None):
     """
-    Generates a JSON file from the extracted corpus.
+    Generates a human-readable JSON export of the extracted corpus.
+    The corpus store written by write_corpus_store is the canonical copy.
     """
     if output_file is None:
         output_file = get_absolute_path('parsed_data.json')
@@ -142,13 +162,14 @@ def generate_json_output(corpus, output_file=None):
     output_dir = output_file.parent
     output_dir.mkdir(parents=True, exist_ok=True)
     
-    # Convert the corpus to a serializable format
+    # Convert the corpus to a serializable format, using the same keys as
+    # parsed_data.json so exports can be reloaded with corpus_store.load_corpus
     serializable_corpus = []
     for doc in corpus:
         try:
             serializable_corpus.append({
                 'url': doc['url'],
-                'text': doc['text'][:10000]  # Limit text length for JSON serialization
+                'extracted_text': doc['text']
             })
         except (KeyError, TypeError):
             continue
@@ -166,7 +187,7 @@ if __name__ == "__main__":
     try:
         corpus = extract_corpus_from_file()
         if corpus:
-            output_file = generate_json_output(corpus)
+            output_file = write_corpus_store(corpus, get_absolute_path(CORPUS_STORE_FILE))
             if output_file:
                 print(f"\n✅ Success! Data extracted and saved to: {output_file}")
             else:
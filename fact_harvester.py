@@ -0,0 +1,308 @@
+"""
+Parse-once text and fact extraction for scheme pages.
+
+Pages are parsed once with lxml's C parser and walked once. The same walk
+collects the page text and the smallest block (div, p, li, table, ...)
+around each fact label such as "Exit Load" or "Expense Ratio". A block that
+is little more than the label is widened to its enclosing block, so the
+value next to the label is kept. When there is no enclosing block, or it is
+a whole page section, the smaller block or the label's own text is kept
+instead. Tables are kept row by row. Script and
+style contents are skipped without being walked.
+
+Benchmark against the previous BeautifulSoup/html.parser extraction:
+
+    python fact_harvester.py bench                      # pages built from parsed_data.json
+    python fact_harvester.py bench --html-dir pages/    # saved .html pages
+"""
+
+import re
+import sys
+import time
+import json
+import argparse
+from pathlib import Path
+
+from lxml import etree, html as lxml_html
+
+# Facts whose blocks are collected, with the label patterns that find them
+FACT_LABELS = {
+    'Exit Load': r'exit\s*load',
+    'Expense Ratio': r'expense\s+ratio',
+    'Minimum SIP': r'min(?:imum)?\.?\s+(?:sip|investment)',
+    'Fund Size': r'\baum\b|fund\s+size',
+    'Riskometer': r'riskometer|risk\s+level',
+    'Benchmark': r'\bbenchmark\b',
+    'Lock-in': r'lock[\s-]in',
+    'Fund Manager': r'fund\s+manager'
+}
+_FACT_PATTERN = re.compile('|'.join(f'(?P<f{i}>{pattern})' for i, pattern in enumerate(FACT_LABELS.values())),
+                           re.IGNORECASE)
+_FACT_NAMES = {f'f{i}': name for i, name in enumerate(FACT_LABELS)}
+
+# Elements whose text is a fact's block; table cells and inline tags are not
+BLOCK_TAGS = frozenset({'div', 'p', 'li', 'dl', 'table', 'section', 'article', 'aside', 'header', 'footer'})
+# Elements whose contents are never text
+SKIP_TAGS = frozenset({'script', 'style', 'noscript', 'template', 'svg'})
+# A block shorter than this is just the label; its parent block is used
+MIN_FACT_CHARS = 40
+# A block longer than this is a page section, not a fact
+MAX_FACT_CHARS = 1500
+MAX_BLOCKS_PER_FACT = 2
+
+def _parse(html):
+    if isinstance(html, str):
+        try:
+            return lxml_html.document_fromstring(html)
+        except ValueError:
+            # Unicode strings with an XML encoding declaration
+            html = html.encode('utf-8')
+    return lxml_html.document_fromstring(html)
+
+def harvest(html):
+    """
+    Extract text and fact blocks from an HTML page in one pass.
+    Returns {'text', 'facts', 'cpu_ms'}: text with the fact blocks first,
+    facts as {fact name: [block text, ...]}, and the CPU time spent.
+    """
+    started = time.thread_time()
+    try:
+        root = _parse(html)
+    except (etree.ParserError, ValueError):
+        return {'text': '', 'facts': {}, 'cpu_ms': (time.thread_time() - started) * 1000}
+
+    pieces = []
+    # One frame per open element: [first piece, tag, facts, table rows, row cells],
+    # with facts as {fact: text to keep if the block turns out too long}
+    stack = []
+    blocks = []
+
+    def add_text(text):
+        text = text.strip()
+        if not text:
+            return
+        pieces.append(text)
+        for match in _FACT_PATTERN.finditer(text):
+            fact = _FACT_NAMES[match.lastgroup]
+            if not _mark(fact, text):
+                # Text straight inside <body>: the text itself is the block
+                blocks.append(([fact], text))
+
+    def _mark(fact, fallback):
+        """Give fact to the innermost open block; False if there is none."""
+        for frame in reversed(stack):
+            if frame[1] in BLOCK_TAGS:
+                if frame[2] is None:
+                    frame[2] = {}
+                frame[2].setdefault(fact, fallback)
+                return True
+        return False
+
+    walker = etree.iterwalk(root, events=('start', 'end', 'comment', 'pi'))
+    for event, element in walker:
+        if event == 'start':
+            tag = element.tag
+            stack.append([len(pieces), tag, None, [] if tag == 'table' else None, [] if tag == 'tr' else None])
+            if tag in SKIP_TAGS:
+                walker.skip_subtree()
+            elif element.text:
+                add_text(element.text)
+            continue
+        if event == 'end':
+            start, tag, facts, rows, cells = stack.pop()
+            if tag in ('td', 'th') and stack and stack[-1][4] is not None:
+                stack[-1][4].append(' '.join(pieces[start:]))
+            elif tag == 'tr' and cells:
+                for frame in reversed(stack):
+                    if frame[3] is not None:
+                        frame[3].append(' | '.join(cells))
+                        break
+            if facts:
+                text = ' '.join(pieces[start:])
+                if len(text) < MIN_FACT_CHARS:
+                    # Widened to the enclosing block, unless there is none;
+                    # this block is kept if the enclosing one is too long
+                    names = [fact for fact in facts if not _mark(fact, text)]
+                    if names:
+                        blocks.append((names, text))
+                elif len(text) <= MAX_FACT_CHARS:
+                    if rows:
+                        text = f"{next(iter(facts))} Details:\n" + '\n'.join(rows)
+                    blocks.append((list(facts), text))
+                else:
+                    # A page section: keep the smaller text each fact came from
+                    for fact, fallback in facts.items():
+                        blocks.append(([fact], fallback))
+        # Text after an element (or comment) belongs to its parent
+        if element.tail:
+            add_text(element.tail)
+
+    facts = {}
+    seen = set()
+    for names, text in blocks:
+        if text in seen:
+            continue
+        kept = False
+        for name in names:
+            found = facts.setdefault(name, [])
+            if len(found) < MAX_BLOCKS_PER_FACT:
+                found.append(text)
+                kept = True
+        if kept:
+            seen.add(text)
+    main_content = ' '.join(pieces)
+    text = '\n\n'.join(list(dict.fromkeys(text for texts in facts.values() for text in texts)) + [main_content])
+    return {'text': text, 'facts': facts, 'cpu_ms': (time.thread_time() - started) * 1000}
+
+def legacy_extract_text(html):
+    """The previous extraction (html.parser and eight selector passes), kept for benchmarks."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    exit_load_info = []
+    exit_load_selectors = [
+        "div[data-testid*='exitLoad']",
+        "div:contains('Exit Load')",
+        "table:contains('Exit Load')",
+        "p:contains('exit load')",
+        "div:contains('exit load')",
+        "div.fund-attributes",
+        "div.fund-details",
+        "div.key-information"
+    ]
+    for selector in exit_load_selectors:
+        try:
+            elements = soup.select(selector)
+            for element in elements:
+                text = element.get_text(' ', strip=True)
+                if 'exit load' in text.lower() or 'exitload' in text.lower().replace(' ', ''):
+                    if element.name == 'table':
+                        rows = element.find_all('tr')
+                        table_data = []
+                        for row in rows:
+                            cols = row.find_all('td')
+                            if cols:
+                                table_data.append(' | '.join(col.get_text(strip=True) for col in cols))
+                        if table_data:
+                            exit_load_info.append("Exit Load Details:\n" + "\n".join(table_data))
+                    else:
+                        exit_load_info.append(text)
+        except Exception:
+            continue
+    main_content = soup.get_text(' ', strip=True)
+    if exit_load_info:
+        return "\n\n".join(exit_load_info) + "\n\n" + main_content
+    return main_content
+
+def synthesize_page(url, text, target_bytes=600_000):
+    """
+    A scheme page of about target_bytes for benchmarks, when no saved HTML
+    is available: the page text laid out in nested blocks with a facts
+    table and related-fund cards, padded with an embedded JSON payload the
+    way Groww pages are.
+    """
+    # Exports made by the previous extraction start with copies of the
+    # blocks it found; the page text is the last part
+    text = text.split('\n\n')[-1]
+    sentences = [s.strip() for s in re.split(r'(?<=[.:])\s+', text) if s.strip()]
+    escape = lambda s: s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    parts = [
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title>Scheme</title>',
+        '<style>' + '.c{margin:0}' * 200 + '</style></head><body><div id="__next"><div class="layout">',
+        '<header><nav>' + ''.join(f'<a href="/s/{i}">Link {i}</a>' for i in range(60)) + '</nav></header>',
+        '<main><div class="container"><div class="fund-details">'
+    ]
+    for i, sentence in enumerate(sentences):
+        parts.append(f'<div class="row r{i % 7}"><div class="col"><span class="t">{escape(sentence)}</span></div></div>')
+    parts.append('<div class="key-information"><table><tr><th>Fact</th><th>Value</th></tr>'
+                 '<tr><td>Exit Load</td><td>1% if redeemed within 1 year</td></tr>'
+                 '<tr><td>Expense Ratio</td><td>0.85%</td></tr></table></div>'
+                 '<div class="fund-attributes"><div><span>Min. SIP</span></div><div><span>Rs. 500</span></div></div>')
+    card = ('<div class="card"><div class="card-head"><a href="/mutual-funds/x"><img src="x.png" alt=""/>'
+            '<span class="name">Related fund</span></a></div><div class="card-body"><span>3Y returns</span>'
+            '<span class="v">12.4%</span><span>Rating</span><span class="v">4</span></div></div>')
+    parts.append('</div><section class="similar">' + card * 150 + '</section></div></main>'
+                 '<footer><p>Mutual fund investments are subject to market risks.</p></footer></div>')
+    size = sum(len(part) for part in parts)
+    record = json.dumps({'url': url, 'nav': 12.34, 'holdings': [{'name': 'Company', 'weight': 1.2}] * 20})
+    payload = '[' + ','.join([record] * max(1, (target_bytes - size) // (len(record) + 1))) + ']'
+    parts.append(f'<script id="__NEXT_DATA__" type="application/json">{payload}</script></div></body></html>')
+    return ''.join(parts)
+
+# Small pages for layouts the synthesized ones don't have; bench always runs them
+EDGE_CASE_PAGES = [
+    ('edge: label in a <p> directly in body', '<html><body><p>Min. SIP Rs 500</p></body></html>'),
+    ('edge: label in body text', '<html><body>Exit load 1% if redeemed within a year<div>NAV 12.3</div></body></html>'),
+    ('edge: label and value in sibling blocks',
+     '<html><body><div><p>Exit Load</p><p>1% if redeemed within 365 days</p></div></body></html>')
+]
+
+def load_bench_pages(html_dir=None, snapshot='parsed_data.json'):
+    """[(name, html)] from saved pages, or pages synthesized from a snapshot."""
+    if html_dir:
+        return [(path.name, path.read_text(encoding='utf-8', errors='replace'))
+                for path in sorted(Path(html_dir).glob('*.htm*'))]
+    with open(snapshot, 'r', encoding='utf-8') as f:
+        documents = json.load(f)
+    return [(doc['url'].rstrip('/').rsplit('/', 1)[-1][:48], synthesize_page(doc['url'], doc['extracted_text']))
+            for doc in documents]
+
+def _cpu_ms(extract, page, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.thread_time()
+        result = extract(page)
+        elapsed = (time.thread_time() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def bench(pages, repeat=3):
+    """
+    Print per-page CPU time of the legacy and parse-once extraction, and
+    check the two agree: the same page text, and a fact block for every
+    fact label in it.
+    """
+    print(f"{'page':<50} {'KB':>6} {'legacy ms':>10} {'harvest ms':>11} {'speedup':>8}  text")
+    total_legacy = total_new = 0.0
+    for name, page in pages:
+        legacy_ms, legacy_text = _cpu_ms(legacy_extract_text, page, repeat)
+        new_ms, result = _cpu_ms(harvest, page, repeat)
+        total_legacy += legacy_ms
+        total_new += new_ms
+        # The page text (after any fact blocks) should be the same words
+        page_text = legacy_text.split('\n\n')[-1]
+        same = page_text.split() == result['text'].split('\n\n')[-1].split()
+        labels = dict.fromkeys(_FACT_NAMES[match.lastgroup] for match in _FACT_PATTERN.finditer(page_text))
+        missed = [fact for fact in labels if fact not in result['facts']]
+        print(f"{name:<50} {len(page) / 1024:>6.0f} {legacy_ms:>10.1f} {new_ms:>11.1f} "
+              f"{legacy_ms / max(new_ms, 1e-9):>7.1f}x  {'same' if same else 'differs'}"
+              f" ({', '.join(result['facts']) or 'no facts'}"
+              f"{'; missed ' + ', '.join(missed) if missed else ''})")
+    if pages:
+        print(f"{'total':<50} {'':>6} {total_legacy:>10.1f} {total_new:>11.1f} "
+              f"{total_legacy / max(total_new, 1e-9):>7.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parse-once HTML text and fact extraction.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench_parser = subparsers.add_parser('bench', help="compare CPU time with the previous extraction")
+    bench_parser.add_argument('--html-dir', help="directory of saved .html pages")
+    bench_parser.add_argument('--snapshot', default='parsed_data.json',
+                              help="corpus export to synthesize pages from when no --html-dir is given")
+    bench_parser.add_argument('--repeat', type=int, default=3, help="runs per page (best is reported)")
+    harvest_parser = subparsers.add_parser('harvest', help="print the facts found in a saved page")
+    harvest_parser.add_argument('file')
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        pages = load_bench_pages(args.html_dir, args.snapshot)
+        if not pages:
+            print("No pages to benchmark")
+            sys.exit(1)
+        bench(pages + EDGE_CASE_PAGES, repeat=args.repeat)
+    else:
+        result = harvest(Path(args.file).read_bytes())
+        print(f"Parsed in {result['cpu_ms']:.1f} ms CPU")
+        for fact, texts in result['facts'].items():
+            for text in texts:
+                print(f"\n[{fact}]\n{text}")
@@ -0,0 +1,91 @@
+"""
+Blue/green index versions for zero-downtime refreshes.
+
+Each refresh builds into its own Pinecone namespace with its own chunk store
+under versions/<namespace>/. The query path follows a small pointer file,
+active_index.json, which is replaced atomically to cut over to a new version
+only once it has been fully built and validated.
+"""
+
+import os
+import json
+import threading
+from pathlib import Path
+from datetime import datetime
+
+BASE_DIR = Path(__file__).parent
+VERSIONS_DIR = BASE_DIR / 'versions'
+ACTIVE_POINTER_FILE = BASE_DIR / 'active_index.json'
+
+_cache_lock = threading.Lock()
+_cache = {'mtime': None, 'version': None}
+
+def new_version_name():
+    """Namespace name for a new build, sortable by build time."""
+    return 'v' + datetime.now().strftime('%Y%m%dT%H%M%S')
+
+def version_dir(namespace):
+    return VERSIONS_DIR / namespace
+
+def read_active_version(pointer_file=ACTIVE_POINTER_FILE):
+    """
+    Return the active version record ({'namespace', 'chunk_store', ...}), or
+    None if no version has been activated (queries then use the default
+    namespace and chunks.mfcs). The file is re-read only when it changes.
+    """
+    try:
+        mtime = os.stat(pointer_file).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _cache_lock:
+        if _cache['mtime'] != mtime:
+            with open(pointer_file, 'r', encoding='utf-8') as f:
+                pointer = json.load(f)
+            _cache.update(mtime=mtime, version=pointer.get('active'))
+        return _cache['version']
+
+def activate_version(version, pointer_file=ACTIVE_POINTER_FILE):
+    """
+    Atomically make `version` the one served to queries. The previously
+    active versions are kept in the pointer's history, newest first.
+    """
+    pointer_file = Path(pointer_file)
+    history = []
+    if pointer_file.exists():
+        with open(pointer_file, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        if previous.get('active'):
+            history = [previous['active']] + previous.get('history', [])
+
+    pointer = {
+        'active': {**version, 'activated_at': datetime.now().isoformat(timespec='seconds')},
+        'history': [v for v in history if v.get('namespace') != version['namespace']]
+    }
+    _write_pointer(pointer, pointer_file)
+    return pointer
+
+def read_pointer(pointer_file=ACTIVE_POINTER_FILE):
+    """The full pointer file ({'active', 'history'}), or an empty one."""
+    try:
+        with open(pointer_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'active': None, 'history': []}
+
+def retire_versions(namespaces, pointer_file=ACTIVE_POINTER_FILE):
+    """Drop garbage-collected versions from the pointer's history."""
+    pointer = read_pointer(pointer_file)
+    if not pointer.get('active'):
+        return
+    pointer['history'] = [v for v in pointer.get('history', []) if v.get('namespace') not in namespaces]
+    _write_pointer(pointer, pointer_file)
+
+def _write_pointer(pointer, pointer_file):
+    pointer_file = Path(pointer_file)
+    tmp_file = pointer_file.with_name(pointer_file.name + '.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(pointer, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    # os.replace is atomic, so readers see either the old or the new pointer
+    os.replace(tmp_file, pointer_file)
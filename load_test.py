@@ -0,0 +1,379 @@
+"""
+Load generator for the query path.
+
+Replays a question mix at a fixed arrival rate (open loop, so a slow
+backend doesn't slow the arrivals down) against query_rag in-process or
+against the HTTP service (api.py), and reports p50/p95/p99 latency,
+throughput and error rate, per stage where it can see them.
+
+With --standin, OpenAI and Pinecone are replaced by local stand-ins with
+configurable latency distributions, so the rest of the pipeline (dispatcher,
+rate limiters, chunk store, MMR, prompt building) can be tested for
+saturation without credentials or cost.
+
+Usage:
+    python load_test.py --standin --rate 5 --duration 60
+    python load_test.py --standin --latency chat=lognormal:800:3000 --rates 2,4,8,16
+    python load_test.py --url http://localhost:8000 --rate 2 --duration 120
+    python load_test.py --questions questions.jsonl --rate 1 --duration 30
+
+Latency specs (milliseconds): fixed:MS, uniform:LOW:HIGH, lognormal:MEDIAN:P95
+"""
+
+import os
+import re
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+STAGES = ('embed', 'search', 'hydrate', 'generate')
+DEFAULT_LATENCIES = {
+    'embed': 'lognormal:60:200',
+    'search': 'lognormal:40:120',
+    'chat': 'lognormal:1200:3500'
+}
+DEFAULT_DURATION = 30
+MAX_INFLIGHT = 256
+# A rate counts as saturated once p95 latency or the error rate exceeds these
+DEFAULT_SLO_MS = 5000
+DEFAULT_MAX_ERROR_RATE = 0.01
+
+_QUESTION_LINE = re.compile(r'^(?:#+\s*)?Q\d+:\s*(.+?)\s*$')
+
+def load_questions(path):
+    """
+    Questions from a JSONL file (one {"question": ...} object or string per
+    line) or from a Markdown file with lines like "Q1: ..." (sample_qa.md).
+    """
+    questions = []
+    with open(path, 'r', encoding='utf-8') as f:
+        if str(path).endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    questions.append(record['question'] if isinstance(record, dict) else record)
+        else:
+            for line in f:
+                match = _QUESTION_LINE.match(line.strip())
+                if match:
+                    questions.append(match.group(1))
+    if not questions:
+        raise ValueError(f"No questions found in {path}")
+    return questions
+
+def parse_latency(spec):
+    """Return a function that samples a latency in seconds from a spec string."""
+    kind, *params = spec.split(':')
+    params = [float(p) / 1000 for p in params]
+    if kind == 'fixed' and len(params) == 1:
+        return lambda: params[0]
+    if kind == 'uniform' and len(params) == 2:
+        return lambda: random.uniform(*params)
+    if kind == 'lognormal' and len(params) == 2:
+        median, p95 = params
+        # p95 of a lognormal is median * exp(1.645 * sigma)
+        sigma = math.log(p95 / median) / 1.645 if p95 > median else 0.0
+        return lambda: random.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"Invalid latency spec: {spec}")
+
+# Stand-in backends
+
+class StandInError(Exception):
+    status_code = 500
+
+class _Object:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+class _RawResponse:
+    """Mimics the OpenAI client's with_raw_response wrapper."""
+
+    def __init__(self, parsed):
+        self._parsed = parsed
+        self.headers = {}
+
+    def parse(self):
+        return self._parsed
+
+def _fake_vector(key, dimension):
+    seed = int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:8], 16)
+    vector = np.random.default_rng(seed).standard_normal(dimension)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+class _Backend:
+    def __init__(self, latency, error_rate):
+        self.latency = latency
+        self.error_rate = error_rate
+
+    def _call(self):
+        time.sleep(self.latency())
+        if self.error_rate and random.random() < self.error_rate:
+            raise StandInError("stand-in backend error")
+
+class StandInOpenAI:
+    """Enough of the OpenAI client for main.get_embeddings and rag_query."""
+
+    def __init__(self, embed_latency, chat_latency, error_rate=0.0, dimension=1536):
+        embed = _Backend(embed_latency, error_rate)
+        chat = _Backend(chat_latency, error_rate)
+
+        def create_embeddings(input, model):
+            embed._call()
+            data = [_Object(index=i, embedding=_fake_vector(text, dimension)) for i, text in enumerate(input)]
+            return _RawResponse(_Object(data=data))
+
+        def create_completion(model, messages, **kwargs):
+            chat._call()
+            message = _Object(content="Stand-in answer based on the provided context.")
+            return _RawResponse(_Object(choices=[_Object(message=message)]))
+
+        self.embeddings = _Object(with_raw_response=_Object(create=create_embeddings))
+        self.chat = _Object(completions=_Object(with_raw_response=_Object(create=create_completion)))
+
+class StandInIndex(_Backend):
+    """
+    Enough of a Pinecone index for main.query_pinecone. Matches are real chunk
+    IDs from the chunk store when one is available, so hydration and prompt
+    building do their normal work; otherwise synthetic chunks are returned.
+    """
+
+    def __init__(self, latency, error_rate=0.0, chunk_ids=None, dimension=1536):
+        super().__init__(latency, error_rate)
+        self.chunk_ids = chunk_ids or [f"standin_chunk{i}" for i in range(500)]
+        self.dimension = dimension
+
+    def query(self, vector, top_k, include_metadata=False, include_values=False, namespace="", filter=None):
+        self._call()
+        rng = random.Random(hash(tuple(vector[:8])))
+        ids = rng.sample(self.chunk_ids, min(top_k, len(self.chunk_ids)))
+        score = rng.uniform(0.7, 0.9)
+        matches = []
+        for chunk_id in ids:
+            metadata = {'text': f"Stand-in chunk {chunk_id}: exit load 1%, expense ratio 0.5%.",
+                        'url': 'https://example.com/standin'} if include_metadata else {}
+            values = _fake_vector(chunk_id, self.dimension) if include_values else None
+            matches.append(_Object(id=chunk_id, score=score, metadata=metadata, values=values))
+            score -= rng.uniform(0.0, 0.03)
+        return _Object(matches=matches)
+
+def install_standins(latencies, error_rate=0.0):
+    """Point main and rag_query at the stand-ins. Needs no credentials."""
+    # The real clients are still constructed at import (without any network
+    # access), and need a key to be constructed
+    os.environ.setdefault("OPENAI_API_KEY", "standin")
+    os.environ.setdefault("PINECONE_API_KEY", "standin")
+    import main
+    import rag_query
+
+    openai_standin = StandInOpenAI(parse_latency(latencies['embed']), parse_latency(latencies['chat']), error_rate)
+    main.openai_client = openai_standin
+    rag_query.client = openai_standin
+    store = main.get_chunk_store()
+    main.set_index(StandInIndex(parse_latency(latencies['search']), error_rate,
+                                chunk_ids=store.ids() if store is not None else None))
+
+# Targets
+
+def query_in_process(question):
+    """Run query_rag; returns (ok, error, StageRecord)."""
+    from rag_query import query_rag
+    from stage_timing import collect_stages
+
+    with collect_stages() as record:
+        try:
+            response = query_rag(question)
+        except Exception as e:
+            return False, type(e).__name__, record
+    if response.get('error'):
+        return False, 'error response', record
+    return True, None, record
+
+def make_http_target(url, timeout=60):
+    import requests
+    from stage_timing import StageRecord
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=MAX_INFLIGHT, pool_maxsize=MAX_INFLIGHT)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    def query_http(question):
+        try:
+            response = session.post(f"{url.rstrip('/')}/query", json={'question': question}, timeout=timeout)
+        except requests.RequestException as e:
+            return False, type(e).__name__, None
+        if response.status_code != 200:
+            return False, f"HTTP {response.status_code}", None
+        # The API reports the time spent in each stage (see api.py)
+        record = StageRecord.from_server_timing(response.headers.get('Server-Timing'))
+        if response.json().get('error'):
+            return False, 'error response', record
+        return True, None, record
+
+    return query_http
+
+# Load generation
+
+def run_load(target, questions, rate, duration, poisson=True, max_inflight=MAX_INFLIGHT, seed=None):
+    """
+    Send questions at `rate` per second for `duration` seconds.
+    Returns a list of per-request results. Latency is measured from the
+    scheduled arrival time, so time spent waiting for a free client slot
+    counts against the backend instead of hiding it.
+    """
+    rng = random.Random(seed)
+    results = []
+    lock = threading.Lock()
+    inflight = [0]
+
+    def send(question, scheduled):
+        try:
+            ok, error, record = target(question)
+        except Exception as e:
+            ok, error, record = False, type(e).__name__, None
+        finished = time.perf_counter()
+        with lock:
+            inflight[0] -= 1
+            results.append({
+                'question': question,
+                'ok': ok,
+                'error': error,
+                'total': finished - scheduled,
+                'stages': record.durations if record else {},
+                'failed_stages': sorted(record.failed) if record else []
+            })
+
+    dropped = 0
+    with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        start = time.perf_counter()
+        next_arrival = start
+        while next_arrival < start + duration:
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            with lock:
+                saturated = inflight[0] >= max_inflight
+                if not saturated:
+                    inflight[0] += 1
+            if saturated:
+                # The client itself is out of slots; count it, don't queue it
+                dropped += 1
+            else:
+                pool.submit(send, rng.choice(questions), next_arrival)
+            next_arrival += rng.expovariate(rate) if poisson else 1 / rate
+    elapsed = time.perf_counter() - start
+
+    for _ in range(dropped):
+        results.append({'question': None, 'ok': False, 'error': 'dropped (client saturated)',
+                        'total': None, 'stages': {}, 'failed_stages': []})
+    return results, elapsed
+
+def _percentiles(values):
+    if not values:
+        return {'p50': None, 'p95': None, 'p99': None, 'mean': None}
+    values = np.asarray(values) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50': round(p50, 1), 'p95': round(p95, 1), 'p99': round(p99, 1), 'mean': round(values.mean(), 1)}
+
+def summarize(results, elapsed, rate):
+    """Latency percentiles (ms), throughput and error rates for one run."""
+    completed = [r for r in results if r['total'] is not None]
+    succeeded = [r for r in results if r['ok']]
+    errors = {}
+    for r in results:
+        if not r['ok']:
+            errors[r['error']] = errors.get(r['error'], 0) + 1
+
+    stages = {}
+    for name in STAGES:
+        timed = [r for r in completed if name in r['stages']]
+        if timed:
+            failed = sum(1 for r in timed if name in r['failed_stages'])
+            stages[name] = {'count': len(timed), 'error_rate': round(failed / len(timed), 4),
+                            **_percentiles([r['stages'][name] for r in timed])}
+    stages['total'] = {'count': len(results),
+                       'error_rate': round(1 - len(succeeded) / len(results), 4) if results else 0.0,
+                       **_percentiles([r['total'] for r in completed])}
+
+    return {
+        'target_rate': rate,
+        'elapsed': round(elapsed, 1),
+        'requests': len(results),
+        # Includes draining the requests still in flight when arrivals stop
+        'throughput': round(len(succeeded) / elapsed, 2) if elapsed else 0.0,
+        'stages': stages,
+        'errors': errors
+    }
+
+def print_summary(summary):
+    print(f"\nRate {summary['target_rate']}/s for {summary['elapsed']}s: {summary['requests']} requests, "
+          f"{summary['throughput']} successful/s")
+    print(f"  {'stage':<10}{'count':>7}{'errors':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for name, stats in summary['stages'].items():
+        print(f"  {name:<10}{stats['count']:>7}{stats['error_rate']:>9.1%}"
+              + ''.join(f"{stats[key] if stats[key] is not None else '-':>10}" for key in ('p50', 'p95', 'p99', 'mean')))
+    for error, count in sorted(summary['errors'].items(), key=lambda item: -item[1]):
+        print(f"  ✗ {count} × {error}")
+
+def is_saturated(summary, slo_ms=DEFAULT_SLO_MS, max_error_rate=DEFAULT_MAX_ERROR_RATE):
+    total = summary['stages']['total']
+    return total['p95'] is None or total['p95'] > slo_ms or total['error_rate'] > max_error_rate
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the query path.")
+    parser.add_argument('--questions', default='sample_qa.md', help="sample_qa.md-style Markdown or a .jsonl file")
+    parser.add_argument('--url', help="base URL of the API service (default: call query_rag in-process)")
+    parser.add_argument('--standin', action='store_true', help="replace OpenAI and Pinecone with local stand-ins")
+    parser.add_argument('--latency', action='append', default=[], metavar='BACKEND=SPEC',
+                        help="stand-in latency for embed, search or chat, e.g. chat=lognormal:800:3000")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of stand-in calls that fail")
+    parser.add_argument('--rate', type=float, default=1.0, help="arrivals per second")
+    parser.add_argument('--rates', help="comma-separated rates to step through, to find the saturation point")
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help="seconds per rate")
+    parser.add_argument('--constant', action='store_true', help="evenly spaced arrivals instead of Poisson")
+    parser.add_argument('--slo-ms', type=float, default=DEFAULT_SLO_MS, help="p95 latency that counts as saturated")
+    parser.add_argument('--max-error-rate', type=float, default=DEFAULT_MAX_ERROR_RATE,
+                        help="error rate that counts as saturated")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--output', help="write the summaries to this JSON file")
+    args = parser.parse_args()
+
+    if args.url and args.standin:
+        parser.error("--standin applies to in-process runs; start api.py against stand-ins separately")
+
+    questions = load_questions(args.questions)
+    if args.standin:
+        latencies = dict(DEFAULT_LATENCIES)
+        for item in args.latency:
+            backend, _, spec = item.partition('=')
+            if backend not in latencies:
+                parser.error(f"unknown backend '{backend}' (expected embed, search or chat)")
+            parse_latency(spec)
+            latencies[backend] = spec
+        install_standins(latencies, args.error_rate)
+        print("Using stand-in backends: " + ", ".join(f"{k}={v}" for k, v in latencies.items()))
+    target = make_http_target(args.url) if args.url else query_in_process
+
+    rates = [float(rate) for rate in args.rates.split(',')] if args.rates else [args.rate]
+    print(f"Replaying {len(questions)} questions against {args.url or 'query_rag (in-process)'}")
+    summaries = []
+    for rate in rates:
+        results, elapsed = run_load(target, questions, rate, args.duration, poisson=not args.constant, seed=args.seed)
+        summary = summarize(results, elapsed, rate)
+        summaries.append(summary)
+        print_summary(summary)
+        if len(rates) > 1 and is_saturated(summary, args.slo_ms, args.max_error_rate):
+            print(f"\nSaturated at {rate}/s (p95 over {args.slo_ms:.0f} ms or error rate over "
+                  f"{args.max_error_rate:.1%}); stopping.")
+            break
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summaries, f, indent=2)
+        print(f"\nSummaries written to {args.output}")
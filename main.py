@@ -1,85 +1,270 @@
 from dotenv import load_dotenv
 import os
 import time
+import inspect
+import threading
+from pathlib import Path
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from openai import OpenAI
 from pinecone import Pinecone, ServerlessSpec
 import streamlit as st
+from corpus_store import CHUNK_STORE_FILE, open_store
+from quantized_index import LOCAL_INDEX_DIR, open_index
+from upsert_engine import upsert_in_parallel
+from embedding_dispatcher import EmbeddingDispatcher
+from rate_limiter import embedding_limiter, estimate_tokens, PRIORITY_USER
+from index_versions import read_active_version
+from adaptive_k import progressive_search, log_choice
+from stage_timing import stage
+from scheme_router import get_router
+from deadlines import DeadlineExceeded
 
-# load_dotenv()  # Load environment variables from .env
+load_dotenv()  # Load environment variables from .env
 
-# # Load keys
-# OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-# PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
+def get_secret(name):
+    """
+    Read a key from Streamlit secrets, falling back to the environment so
+    that the API service and build scripts can run outside Streamlit.
+    """
+    try:
+        return st.secrets[name]
+    except Exception:
+        return os.getenv(name)
+
+OPENAI_API_KEY = get_secret("OPENAI_API_KEY")
+PINECONE_API_KEY = get_secret("PINECONE_API_KEY")
+
+# Initialize OpenAI client. Retries are left to the rate limiter, which
+# needs to see every 429 to adapt
+openai_client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
 
-OPENAI_API_KEY = st.secrets["OPENAI_API_KEY"]
-PINECONE_API_KEY = st.secrets["PINECONE_API_KEY"]
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+def get_embeddings(texts, model=EMBEDDING_MODEL, priority=PRIORITY_USER):
+    """
+    Generate embeddings for a list of texts in a single API call, under the
+    shared rate limiter. Index builds should pass PRIORITY_BACKGROUND so that
+    user queries go first.
+    Returns one embedding per text, in order. Raises on API errors.
+    """
+    raw_response = embedding_limiter.run(
+        lambda: openai_client.embeddings.with_raw_response.create(
+            input=texts,
+            model=model
+        ),
+        tokens=sum(estimate_tokens(text) for text in texts),
+        priority=priority
+    )
+    response = raw_response.parse()
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
 
-# Initialize OpenAI client
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+# Concurrent query embeddings are batched into one request, and identical
+# texts already in flight (e.g. the example question buttons) are shared
+embedding_dispatcher = EmbeddingDispatcher(get_embeddings)
 
-def get_embedding(text, model="text-embedding-3-small"):
+def get_embedding(text, model=EMBEDDING_MODEL, timeout=None):
     """
     Generate embedding for text using OpenAI's embedding model.
+    Requests for the default model go through the micro-batching dispatcher.
+    timeout: seconds to wait for the default model's embedding, e.g. what
+        is left of a query's deadline; returns None if it isn't ready by then
     """
     try:
-        response = openai_client.embeddings.create(
-            input=text,
-            model=model
-        )
-        return response.data[0].embedding
+        with stage('embed'):
+            if model == EMBEDDING_MODEL:
+                return embedding_dispatcher.embed(text, timeout=timeout)
+            return get_embeddings([text], model=model)[0]
+    except FutureTimeoutError:
+        print(f"Embedding not ready within {timeout:.2f}s")
+        return None
     except Exception as e:
         print(f"Error generating embedding: {e}")
         return None
 
-# Initialize Pinecone client (modern API)
-pc = Pinecone(api_key=PINECONE_API_KEY)
 index_name = "mf-facts"
 
-# Create index if it doesn't exist, or recreate if dimension mismatch
-existing_indexes = [idx.name for idx in pc.list_indexes()]
-index_exists = index_name in existing_indexes
+def _connect_index():
+    # Initialize Pinecone client (modern API)
+    pc = Pinecone(api_key=PINECONE_API_KEY)
 
-# Check if index exists and has correct dimension
-if index_exists:
-    try:
-        index_info = pc.describe_index(index_name)
-        if index_info.dimension != 1536:
-            print(f"Warning: Existing index has dimension {index_info.dimension}, but we need 1536.")
-            print(f"Deleting old index '{index_name}' to recreate with correct dimension...")
-            pc.delete_index(index_name)
-            # Wait for deletion to complete
-            time.sleep(5)
-            index_exists = False
-    except Exception as e:
-        print(f"Error checking index: {e}")
-        index_exists = False
-
-# Create index if it doesn't exist
-if not index_exists:
-    print(f"Creating index '{index_name}' with dimension 1536...")
-    pc.create_index(
-        name=index_name,
-        dimension=1536,
-        metric="cosine",
-        spec=ServerlessSpec(
-            cloud="aws",
-            region="us-east-1"
+    # Create index if it doesn't exist
+    existing_indexes = [idx.name for idx in pc.list_indexes()]
+    index_exists = index_name in existing_indexes
+
+    # Check if index exists and has correct dimension
+    if index_exists:
+        try:
+            index_info = pc.describe_index(index_name)
+        except Exception as e:
+            print(f"Error checking index: {e}")
+            index_info = None
+        # Never delete a live index from here: queries may be running against it.
+        # A dimension change needs a new index name and a full rebuild instead.
+        if index_info is not None and index_info.dimension != 1536:
+            raise RuntimeError(
+                f"Existing index '{index_name}' has dimension {index_info.dimension}, but we need 1536. "
+                "Delete it manually or use a different index name, then rebuild."
+            )
+
+    # Create index if it doesn't exist
+    if not index_exists:
+        print(f"Creating index '{index_name}' with dimension 1536...")
+        pc.create_index(
+            name=index_name,
+            dimension=1536,
+            metric="cosine",
+            spec=ServerlessSpec(
+                cloud="aws",
+                region="us-east-1"
+            )
         )
-    )
-    print(f"Created index: {index_name}")
-    # Wait a moment for index to be ready (serverless indexes are usually ready quickly)
-    time.sleep(5)
+        print(f"Created index: {index_name}")
+        # Wait a moment for index to be ready (serverless indexes are usually ready quickly)
+        time.sleep(5)
+
+    return pc.Index(index_name)
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index():
+    """
+    The Pinecone index, connected (and created if missing) on first use, so
+    importing this module needs no network access.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = _connect_index()
+        return _index
+
+def set_index(index):
+    """Use another object with the Pinecone index API, e.g. a load-test stand-in."""
+    global _index
+    with _index_lock:
+        _index = index
+
+CHUNK_STORE_PATH = Path(__file__).parent / CHUNK_STORE_FILE
+LOCAL_INDEX_PATH = Path(__file__).parent / LOCAL_INDEX_DIR
+
+def get_active_namespace():
+    """
+    Pinecone namespace of the version currently served to queries. Builds
+    made without the refresh daemon use the default namespace.
+    """
+    version = read_active_version()
+    return version['namespace'] if version else ""
+
+def get_chunk_store():
+    """The chunk store that matches the active index version, or None."""
+    version = read_active_version()
+    return open_store(version['chunk_store'] if version else CHUNK_STORE_PATH)
+
+def get_local_index(version):
+    """
+    The local float vectors (see quantized_index.py) built with an index
+    version, or with the default namespace when version is None. None if
+    there are none, e.g. for versions activated before they were recorded.
+    """
+    if version is None:
+        return open_index(LOCAL_INDEX_PATH)
+    return open_index(version['local_index']) if version.get('local_index') else None
+
+class RetrievedChunk:
+    """
+    A search match joined with its chunk record from the local chunk store.
+    Has the same id / score / metadata attributes as a Pinecone match, with
+    the chunk text available as metadata['text'], and the embedding as
+    values when it was requested from the index or read from the local one.
+    """
+
+    def __init__(self, id, score, metadata, values=None):
+        self.id = id
+        self.score = score
+        self.metadata = metadata
+        self.values = values
+
+    def __repr__(self):
+        return f"RetrievedChunk(id={self.id!r}, score={self.score:.3f})"
+
+def get_chunk_record(match):
+    """
+    Look up the stored chunk record for a Pinecone match (or dict with 'id').
+    Returns None if the chunk store is missing or doesn't have the chunk.
+    """
+    match_id = match.id if hasattr(match, 'id') else match.get('id')
+    store = get_chunk_store()
+    if store is None or match_id is None:
+        return None
+    return store.get(match_id)
 
-# Get the index
-index = pc.Index(index_name)
+def get_chunk_text(match):
+    """
+    Return the text of a retrieved chunk.
+    Uses the text already attached to the match, otherwise reads it from the
+    local chunk store.
+    """
+    metadata = match.metadata if hasattr(match, 'metadata') else match.get('metadata', {})
+    text = (metadata or {}).get('text')
+    if text:
+        return text
+    record = get_chunk_record(match)
+    return record.get('text', '') if record else ''
 
-def upsert_vectors(documents):
+def hydrate_matches(matches, store=None, local_index=None):
+    """
+    Attach chunk text and metadata from the chunk store to search matches.
+    Matches whose text can't be found are dropped.
+    store: chunk store to read from (defaults to the active version's)
+    local_index: QuantizedIndex to read the match embeddings from, for
+        searches that didn't return them
+    """
+    if store is None:
+        store = get_chunk_store()
+    chunks = []
+    for match in matches:
+        metadata = dict(match.metadata or {})
+        record = store.get(match.id) if store is not None else None
+        if record is not None:
+            metadata.update(record)
+        if not metadata.get('text'):
+            continue
+        values = getattr(match, 'values', None) or None
+        if values is None and local_index is not None:
+            values = local_index.get_vector(match.id)
+        chunks.append(RetrievedChunk(match.id, match.score, metadata, values))
+    return chunks
+
+def get_chunks_by_id(ids, scores=None):
+    """
+    Load chunks by ID from the active chunk store, e.g. to reuse the chunks
+    retrieved for the previous question. Returns RetrievedChunk objects in
+    the given order, or None if any of them is missing (for example after
+    the index has been refreshed).
+    """
+    store = get_chunk_store()
+    if store is None or not ids:
+        return None
+    scores = scores or [0.0] * len(ids)
+    chunks = []
+    for chunk_id, score in zip(ids, scores):
+        record = store.get(chunk_id)
+        if record is None:
+            return None
+        chunks.append(RetrievedChunk(chunk_id, score, dict(record)))
+    return chunks
+
+def upsert_vectors(documents, namespace="", on_success=None):
     """
     Upsert document vectors to Pinecone index.
     documents: list of dicts with 'id', 'embedding', and 'metadata' keys
+    namespace: index version to write to (default namespace if empty)
+    on_success: called with the ids of each batch once Pinecone acknowledges it
+    Returns a summary dict from upsert_engine.upsert_in_parallel, including
+    the ids of any batches that failed after retries.
     """
     if not documents:
-        return
+        return None
     
     # Prepare vectors in Pinecone format
     vectors = []
@@ -93,25 +278,67 @@ def upsert_vectors(documents):
     
     if not vectors:
         print("No valid vectors to upsert")
-        return
+        return None
     
-    # Upsert in batches
-    batch_size = 50
-    for i in range(0, len(vectors), batch_size):
-        batch = vectors[i:i+batch_size]
-        try:
-            index.upsert(vectors=batch)
-            print(f"Upserted batch {i//batch_size + 1} ({len(batch)} vectors)")
-        except Exception as e:
-            print(f"Error upserting batch: {e}")
+    # Batches are sized by payload bytes and sent concurrently with retries
+    index = get_index()
+    summary = upsert_in_parallel(lambda batch: index.upsert(vectors=batch, namespace=namespace), vectors,
+                                 on_success=on_success)
+    print(f"Upserted {summary['upserted']}/{summary['vectors']} vectors in {summary['batches']} batches "
+          f"({summary['elapsed']:.1f}s, {summary['retries']} retries)")
+    return summary
+
+def search_index(index, namespace, vector, top_k, include_metadata=False, include_values=False,
+                 metadata_filter=None, timeout=None):
+    """
+    The top_k matches in a namespace, best first.
+    metadata_filter: Pinecone filter, e.g. to the partitions a question is
+        routed to (see SchemeRouter.search_filter)
+    timeout: seconds the search may take, e.g. what is left of a query's
+        deadline
+    """
+    return index.query(
+        vector=vector,
+        top_k=top_k,
+        include_metadata=include_metadata,
+        include_values=include_values,
+        namespace=namespace,
+        filter=metadata_filter,
+        **_timeout_option(index.query, timeout)
+    ).matches
 
-def query_pinecone(query_text, top_k=5):
+def _timeout_option(method, timeout):
+    """
+    Keyword argument that limits a Pinecone request to `timeout` seconds.
+    Newer clients take `timeout`. The older REST clients (3.x-7.x) take
+    `_request_timeout` through **kwargs and would send any other keyword in
+    the request body. Empty when there is no timeout.
+    """
+    if timeout is None:
+        return {}
+    parameters = inspect.signature(method).parameters
+    if 'timeout' in parameters:
+        return {'timeout': timeout}
+    if any(p.kind is inspect.Parameter.VAR_KEYWORD for p in parameters.values()):
+        return {'_request_timeout': timeout}
+    return {}
+
+def query_pinecone(query_text, top_k=5, query_embedding=None, include_values=True, adaptive=False, deadline=None):
     """
     Query Pinecone index with a text query.
-    Returns list of matches with metadata.
+    Returns list of RetrievedChunk with metadata, including the chunk text.
+    query_embedding: reuse an embedding the caller already computed
+    include_values: return match embeddings, used for MMR selection. They
+        are read from the version's local index, and only requested from
+        Pinecone when there is none
+    adaptive: for simple questions, fetch results progressively and stop at
+        the first clear score gap (see adaptive_k.py) instead of using top_k
+    deadline: the query's Deadline; the embedding and every search are cut
+        off when it passes, and nothing is returned
     """
     # Get embedding for the query
-    query_embedding = get_embedding(query_text)
+    if query_embedding is None and not (deadline and deadline.expired()):
+        query_embedding = get_embedding(query_text, timeout=deadline.remaining() if deadline else None)
     if not query_embedding:
         return []
     
@@ -129,49 +356,81 @@ def query_pinecone(query_text, top_k=5):
         # Check for multi-faceted queries (asking for multiple pieces of information)
         is_multi_faceted = sum(1 for term in specific_terms if term in query_lower) > 1
         
+        # Chunk text lives in the local chunk store, so the search only needs
+        # ids and scores. Builds from before the chunk store kept the text in
+        # vector metadata, so fall back to requesting it when there's no store.
+        # Resolve the active version once so the search and the text lookups
+        # agree even if a refresh cuts over mid-query
+        version = read_active_version()
+        namespace = version['namespace'] if version else ""
+        chunk_store = open_store(version['chunk_store'] if version else CHUNK_STORE_PATH)
+        include_metadata = chunk_store is None
+        # Match embeddings come from the memory-mapped local index rather than
+        # the search response, where they add about 250 KB of JSON per search
+        local_index = get_local_index(version) if include_values else None
+        fetch_values = include_values and local_index is None
+        index = get_index()
+
+        # Only the partitions of the schemes the question names are searched;
+        # generic questions search every vector of the version
+        router = get_router(version)
+        metadata_filter = router.search_filter(router.route(query_text))
+
+        def search(k):
+            if deadline is not None and deadline.expired():
+                raise DeadlineExceeded("no time left to search")
+            with stage('search'):
+                return search_index(index, namespace, query_embedding, k, include_metadata=include_metadata,
+                                    include_values=fetch_values, metadata_filter=metadata_filter,
+                                    timeout=deadline.remaining() if deadline else None)
+
+        # Comparisons and multi-faceted questions need chunks about several
+        # schemes or facts, which a score gap would cut off
+        if adaptive and not (is_comparison or is_multi_faceted):
+            matches, info = progressive_search(search)
+            log_choice(query_text, info)
+            with stage('hydrate'):
+                return hydrate_matches(matches, store=chunk_store, local_index=local_index)
+        
         if has_specific_term or is_comparison or is_multi_faceted:
             # For specific financial queries, comparisons, or multi-faceted queries, increase top_k
-            results = index.query(
-                vector=query_embedding,
-                top_k=top_k * 4,  # Get more results for better filtering
-                include_metadata=True
-            )
-            
-            # For multi-faceted queries, we want to ensure we get all relevant information
-            if is_multi_faceted:
-                # Sort matches to prioritize chunks that contain multiple relevant terms
-                results.matches.sort(
-                    key=lambda x: sum(
-                        1 for term in specific_terms 
-                        if term in x.metadata.get('text', '').lower()
-                    ),
-                    reverse=True
-                )
-            # For comparison queries, prioritize documents that mention multiple schemes
-            elif is_comparison:
-                schemes = ['Groww Value Fund', 'Groww Large Cap Fund', 'Groww Aggressive Hybrid Fund', 'Groww Liquid Fund']
-                results.matches.sort(
-                    key=lambda x: sum(
-                        1 for scheme in schemes 
-                        if scheme.lower() in x.metadata.get('text', '').lower()
-                    ),
-                    reverse=True
-                )
+            matches = search(top_k * 4)  # Get more results for better filtering
         else:
             # Regular query for general questions
-            results = index.query(
-                vector=query_embedding,
-                top_k=top_k,
-                include_metadata=True
-            )
+            matches = search(top_k)
         
         # Filter out low-scoring results, but be more lenient for comparisons or multi-faceted queries
         min_score = 0.5 if (is_comparison or is_multi_faceted) else 0.6
-        filtered_matches = [match for match in results.matches if match.score >= min_score]
+        filtered_matches = [match for match in matches if match.score >= min_score]
+        
+        # Only the chunks that survive filtering are read from the chunk store
+        with stage('hydrate'):
+            chunks = hydrate_matches(filtered_matches, store=chunk_store, local_index=local_index)
+        
+        # For multi-faceted queries, we want to ensure we get all relevant information
+        if is_multi_faceted:
+            # Sort matches to prioritize chunks that contain multiple relevant terms
+            chunks.sort(
+                key=lambda x: sum(
+                    1 for term in specific_terms 
+                    if term in x.metadata['text'].lower()
+                ),
+                reverse=True
+            )
+        # For comparison queries, prioritize documents that mention multiple schemes
+        elif is_comparison:
+            schemes = router.scheme_names_in(query_text) or router.scheme_names
+            chunks.sort(
+                key=lambda x: sum(
+                    1 for scheme in schemes 
+                    if scheme.lower() in x.metadata['text'].lower()
+                ),
+                reverse=True
+            )
         
         # Return more results for better context, especially for complex queries
         max_results = top_k * 3 if (is_comparison or is_multi_faceted) else top_k * 2
-        return filtered_matches[:max_results]
+        return chunks[:max_results]
         
     except Exception as e:
         print(f"Error querying Pinecone: {e}")
@@ -0,0 +1,63 @@
+"""
+Maximal marginal relevance (MMR) selection for retrieved chunks.
+
+All pairwise similarities are computed as a single NumPy matrix product, and
+the greedy selection only updates one "closest selected" vector per pick, so
+no Python loops run over pairs of chunks.
+"""
+
+import numpy as np
+
+# Trade-off between relevance to the query (1.0) and diversity (0.0)
+DEFAULT_LAMBDA = 0.7
+
+# Candidates at least this similar to an already selected chunk are treated
+# as duplicates and never selected, even if slots remain
+DUPLICATE_SIMILARITY = 0.97
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def mmr_select(query_embedding, candidate_embeddings, k, lambda_mult=DEFAULT_LAMBDA,
+               relevance=None, duplicate_similarity=DUPLICATE_SIMILARITY):
+    """
+    Pick up to k diverse, relevant candidates.
+
+    query_embedding: vector of the query
+    candidate_embeddings: one vector per candidate, in the same space
+    relevance: optional per-candidate relevance scores to use instead of the
+        cosine similarity to the query (e.g. boosted by keyword matches)
+
+    Returns the indices of the selected candidates, in selection order.
+    """
+    candidates = _normalize(candidate_embeddings)
+    n = len(candidates)
+    if n == 0 or k <= 0:
+        return []
+
+    if relevance is None:
+        relevance = candidates @ _normalize(query_embedding)
+    else:
+        relevance = np.asarray(relevance, dtype=np.float32)
+
+    similarity = candidates @ candidates.T
+    # Highest similarity of each candidate to anything selected so far
+    closest = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+
+    selected = []
+    for _ in range(min(k, n)):
+        redundancy = np.where(np.isfinite(closest), closest, 0.0)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        if not np.isfinite(scores[best]):
+            break
+        selected.append(best)
+        available[best] = False
+        closest = np.maximum(closest, similarity[best])
+        available &= closest < duplicate_similarity
+    return selected
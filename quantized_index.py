@@ -0,0 +1,277 @@
+"""
+Local quantized vector index for the Mutual Fund FAQ corpus.
+
+Full-precision vectors are kept on disk and memory-mapped; only a compact
+int8 or binary copy is held in RAM for the first pass. The top candidates
+from that pass are re-scored exactly against the float vectors.
+
+Index directory layout:
+    meta.json     ids, dimension and int8 scales
+    vectors.f32   float32 vectors (n x dim), L2-normalised, memory-mapped
+    codes.i8      int8 scalar-quantized vectors (n x dim)
+    bits.u8       sign bits packed 8 per byte (n x dim/8)
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from pathlib import Path
+
+import numpy as np
+
+LOCAL_INDEX_DIR = 'local_index'
+META_FILE = 'meta.json'
+FLOAT_FILE = 'vectors.f32'
+INT8_FILE = 'codes.i8'
+BINARY_FILE = 'bits.u8'
+
+QUANTIZATION_MODES = ('float', 'int8', 'binary')
+
+# Candidates fetched per requested result before float re-scoring; binary
+# codes are much coarser than int8 so they need a wider first pass
+DEFAULT_OVERSAMPLE = {'int8': 4, 'binary': 10}
+
+# The first pass scores this many rows at a time, so converting codes for
+# scoring never needs more than one block's worth of extra memory
+FIRST_PASS_BLOCK_ROWS = 1024
+
+# Number of set bits for every byte value, used for Hamming distances
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def _normalize(vectors):
+    """L2-normalise rows so that dot products are cosine similarities."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def build_quantized_index(path, ids, embeddings):
+    """
+    Write a quantized index for the given ids and embeddings to `path`.
+    Returns the loaded QuantizedIndex.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    vectors = _normalize(embeddings)
+    if vectors.ndim != 2 or len(vectors) != len(ids):
+        raise ValueError("embeddings must be a 2-D array with one row per id")
+
+    # Symmetric per-dimension scale so each dimension uses the full int8 range
+    scales = np.abs(vectors).max(axis=0)
+    scales[scales == 0] = 1.0
+    scales = (scales / 127.0).astype(np.float32)
+    codes = np.clip(np.rint(vectors / scales), -127, 127).astype(np.int8)
+    bits = np.packbits(vectors > 0, axis=1)
+
+    vectors.tofile(path / FLOAT_FILE)
+    codes.tofile(path / INT8_FILE)
+    bits.tofile(path / BINARY_FILE)
+    with open(path / META_FILE, 'w', encoding='utf-8') as f:
+        json.dump({
+            'ids': list(ids),
+            'dimension': int(vectors.shape[1]),
+            'count': int(vectors.shape[0]),
+            'int8_scales': scales.tolist()
+        }, f)
+
+    return QuantizedIndex(path)
+
+class QuantizedIndex:
+    """
+    Read-only view over an index directory written by build_quantized_index.
+    Quantized codes are loaded on first use of their mode; float vectors are
+    only ever accessed through a memory map.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / META_FILE, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.ids = meta['ids']
+        self.dimension = meta['dimension']
+        self.count = meta['count']
+        self.scales = np.asarray(meta['int8_scales'], dtype=np.float32)
+        self._id_positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        self._vectors = None
+        self._codes = None
+        self._bits = None
+
+    @property
+    def vectors(self):
+        if self._vectors is None:
+            self._vectors = np.memmap(self.path / FLOAT_FILE, dtype=np.float32, mode='r',
+                                      shape=(self.count, self.dimension))
+        return self._vectors
+
+    @property
+    def codes(self):
+        if self._codes is None:
+            self._codes = np.fromfile(self.path / INT8_FILE, dtype=np.int8).reshape(self.count, self.dimension)
+        return self._codes
+
+    @property
+    def bits(self):
+        if self._bits is None:
+            self._bits = np.fromfile(self.path / BINARY_FILE, dtype=np.uint8).reshape(self.count, -1)
+        return self._bits
+
+    def get_vector(self, doc_id):
+        """Return the full-precision vector for a document id, or None."""
+        position = self._id_positions.get(doc_id)
+        if position is None:
+            return None
+        return np.array(self.vectors[position])
+
+    def _first_pass(self, query, mode, n_candidates):
+        """Return candidate row positions ranked by the approximate score."""
+        if mode == 'int8':
+            rows = self.codes
+            # codes * scales . q == codes . (q * scales), so fold the scales into the query
+            folded = query * self.scales
+        elif mode == 'binary':
+            rows = self.bits
+            query_bits = np.packbits(query > 0)
+        else:
+            rows = self.vectors
+        scores = np.empty(self.count, dtype=np.float32)
+        for start in range(0, self.count, FIRST_PASS_BLOCK_ROWS):
+            block = rows[start:start + FIRST_PASS_BLOCK_ROWS]
+            if mode == 'int8':
+                block_scores = block.astype(np.float32) @ folded
+            elif mode == 'binary':
+                block_scores = -_POPCOUNT[np.bitwise_xor(block, query_bits)].sum(axis=1, dtype=np.int32)
+            else:
+                block_scores = block @ query
+            scores[start:start + len(block)] = block_scores
+        n_candidates = min(n_candidates, self.count)
+        candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+        return candidates
+
+    def search(self, query_vector, top_k=5, mode='int8', oversample=None):
+        """
+        Search the index.
+        mode: 'float' for exact search, or 'int8' / 'binary' for a quantized
+        first pass over top_k * oversample candidates followed by exact
+        float re-scoring (oversample defaults to DEFAULT_OVERSAMPLE[mode]).
+        Returns a list of (id, score) tuples, best first.
+        """
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode: {mode}")
+        if self.count == 0 or top_k <= 0:
+            return []
+
+        query = _normalize(query_vector)
+        if mode == 'float':
+            n_candidates = top_k
+        else:
+            n_candidates = top_k * (oversample or DEFAULT_OVERSAMPLE[mode])
+        candidates = np.sort(self._first_pass(query, mode, n_candidates))
+
+        # Exact re-scoring reads only the candidate rows from the memory map
+        exact_scores = self.vectors[candidates] @ query
+        order = np.argsort(-exact_scores)[:top_k]
+        return [(self.ids[candidates[i]], float(exact_scores[i])) for i in order]
+
+    def memory_usage(self):
+        """
+        Report the bytes used by each representation. Only the quantized
+        codes of the mode in use are held in RAM; float vectors are mapped.
+        """
+        float_bytes = self.count * self.dimension * 4
+        int8_bytes = self.count * self.dimension + self.scales.nbytes
+        binary_bytes = self.count * ((self.dimension + 7) // 8)
+        return {
+            'vectors': self.count,
+            'dimension': self.dimension,
+            'float_bytes': float_bytes,
+            'int8_bytes': int8_bytes,
+            'binary_bytes': binary_bytes,
+            'int8_compression': float_bytes / int8_bytes if int8_bytes else 0.0,
+            'binary_compression': float_bytes / binary_bytes if binary_bytes else 0.0
+        }
+
+_open_indexes = {}
+_open_indexes_lock = threading.Lock()
+
+def open_index(path):
+    """
+    Return a shared QuantizedIndex for the directory at path, or None if
+    there is no index there. It is reopened once the index has been rewritten.
+    """
+    meta_path = Path(path) / META_FILE
+    try:
+        mtime = meta_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _open_indexes_lock:
+        cached = _open_indexes.get(meta_path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, QuantizedIndex(path))
+            _open_indexes[meta_path] = cached
+        return cached[1]
+
+def evaluate_recall(index, queries, top_k=5, oversample=None, held_out_ids=None):
+    """
+    Measure recall@top_k of each quantized mode against exact float search.
+    held_out_ids: for queries taken from the index itself, the id of each
+        query's own vector. It is left out of every result, since a vector
+        always finds itself and would inflate recall.
+    Returns a dict keyed by mode with 'recall' and 'avg_ms' per query.
+    """
+    queries = _normalize(queries)
+    if held_out_ids is None:
+        held_out_ids = [None] * len(queries)
+    # One extra result makes up for the held-out vector
+    fetch = top_k + 1 if any(doc_id is not None for doc_id in held_out_ids) else top_k
+
+    def top_ids(q, held_out, mode):
+        results = index.search(q, top_k=fetch, mode=mode, oversample=oversample)
+        return set([doc_id for doc_id, _ in results if doc_id != held_out][:top_k])
+
+    baseline = [top_ids(q, held_out, 'float') for q, held_out in zip(queries, held_out_ids)]
+
+    report = {}
+    for mode in ('int8', 'binary'):
+        hits = 0
+        start = time.perf_counter()
+        for q, held_out, expected in zip(queries, held_out_ids, baseline):
+            hits += len(top_ids(q, held_out, mode) & expected)
+        elapsed = time.perf_counter() - start
+        total = sum(len(expected) for expected in baseline)
+        report[mode] = {
+            'recall': hits / total if total else 0.0,
+            'avg_ms': elapsed * 1000 / len(queries) if len(queries) else 0.0
+        }
+    return report
+
+def _format_bytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+if __name__ == "__main__":
+    index_dir = sys.argv[1] if len(sys.argv) > 1 else LOCAL_INDEX_DIR
+    if not os.path.exists(os.path.join(index_dir, META_FILE)):
+        print(f"No local index found at {index_dir}. Run build_index.py first.")
+        sys.exit(1)
+
+    index = QuantizedIndex(index_dir)
+    usage = index.memory_usage()
+    print(f"Vectors: {usage['vectors']} x {usage['dimension']}")
+    print(f"  float32: {_format_bytes(usage['float_bytes'])} (memory-mapped)")
+    print(f"  int8:    {_format_bytes(usage['int8_bytes'])} ({usage['int8_compression']:.1f}x smaller)")
+    print(f"  binary:  {_format_bytes(usage['binary_bytes'])} ({usage['binary_compression']:.1f}x smaller)")
+
+    # Without a query log, use a sample of the corpus vectors as queries,
+    # each held out of its own results
+    rng = np.random.default_rng(0)
+    sample = np.sort(rng.choice(index.count, size=min(200, index.count), replace=False))
+    queries = np.array(index.vectors[sample])
+    held_out_ids = [index.ids[i] for i in sample]
+    for mode, result in evaluate_recall(index, queries, top_k=5, held_out_ids=held_out_ids).items():
+        print(f"  {mode:7s} recall@5: {result['recall']:.3f}  ({result['avg_ms']:.2f} ms/query)")
@@ -3,10 +3,18 @@ RAG Query System for Mutual Fund FAQ
 Handles query processing, retrieval, and response generation with citations.
 """
 
-from main import get_embedding, query_pinecone
+from main import get_embedding, query_pinecone, get_chunk_text, get_chunks_by_id
+from conversation import resolve_turn, make_context, mentions_intents, detect_intents
+from scheme_router import get_router
+from mmr import mmr_select
+from rate_limiter import chat_limiter, estimate_tokens, PRIORITY_USER
+from stage_timing import stage
+from deadlines import Deadline, DeadlineExceeded, LatencyTracker, hedged_call
+from subqueries import plan_subqueries, run_subqueries, merge_results
 from datetime import datetime
 import re
 import os
+import time
 from dotenv import load_dotenv
 from openai import OpenAI, APIError, AuthenticationError, RateLimitError, APITimeoutError
 
@@ -17,14 +25,16 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 
-# Initialize the appropriate client and model
+# Initialize the appropriate client and model. Retries are left to the
+# rate limiter, which needs to see every 429 to adapt
 if OPENAI_API_KEY:
-    client = OpenAI(api_key=OPENAI_API_KEY)
+    client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
     model = "gpt-3.5-turbo"  # or "gpt-4" if you have access
 elif OPENROUTER_API_KEY:
     client = OpenAI(
         base_url="https://openrouter.ai/api/v1",
-        api_key=OPENROUTER_API_KEY
+        api_key=OPENROUTER_API_KEY,
+        max_retries=0
     )
     model = "openai/gpt-3.5-turbo"  # OpenRouter format
 else:
@@ -41,6 +51,25 @@ ADVICE_KEYWORDS = [
 
 EDUCATIONAL_LINK = "https://www.amfiindia.com/investor-corner/knowledge-center"
 
+# How much each keyword relevance point adds to a chunk's similarity score
+# when ranking chunks for MMR selection
+KEYWORD_RELEVANCE_WEIGHT = 0.02
+
+# Choose the number of chunks per query from the score curve instead of a
+# fixed top_k (set ADAPTIVE_TOP_K=0 to turn off)
+ADAPTIVE_TOP_K = os.getenv("ADAPTIVE_TOP_K", "1") != "0"
+
+# Chat completions are hedged after their recent p95 latency (see deadlines.py)
+chat_latency = LatencyTracker()
+# Time kept back from the deadline to build the extractive fallback
+FALLBACK_RESERVE_MS = 200
+# Sentences quoted from the top chunk when the model can't answer in time
+EXTRACTIVE_SENTENCES = 2
+MAX_EXTRACTIVE_CHARS = 400
+# Completion length for decomposed questions: a line per sub-query
+STRUCTURED_BASE_TOKENS = 40
+STRUCTURED_TOKENS_PER_PART = 60
+
 def is_investment_advice_query(query):
     """
     Check if the query is asking for investment advice.
@@ -69,11 +98,54 @@ def format_citation(url):
     """
     return f"[Source]({url})"
 
-def get_facts_only_response(query, retrieved_chunks, model=model):
+def select_diverse_chunks(chunks, query_embedding, max_chunks):
+    """
+    Choose up to max_chunks chunks using maximal marginal relevance, so that
+    near-identical chunks (e.g. from pages sharing a template) don't fill the
+    context. Relevance is the search score boosted by keyword relevance.
+    Falls back to the first max_chunks when embeddings aren't available.
+    """
+    if query_embedding is None or any(getattr(chunk, 'values', None) is None for chunk in chunks):
+        return chunks[:max_chunks]
+    relevance = [
+        getattr(chunk, 'score', 0.0) + KEYWORD_RELEVANCE_WEIGHT * getattr(chunk, 'relevance_score', 0)
+        for chunk in chunks
+    ]
+    selected = mmr_select(query_embedding, [chunk.values for chunk in chunks], max_chunks, relevance=relevance)
+    return [chunks[i] for i in selected]
+
+def extractive_answer(query, chunk):
+    """
+    A degraded answer quoted from the top chunk, for when the model can't
+    answer before the deadline. Sentences mentioning the facts asked about
+    are preferred; otherwise the chunk's first sentences are used.
+    """
+    text = get_chunk_text(chunk)
+    metadata = chunk.metadata if hasattr(chunk, 'metadata') else chunk.get('metadata', {})
+    sentences = [sentence.strip() for sentence in re.split(r'(?<=[.!?])\s+', text) if sentence.strip()]
+    intents = detect_intents(query)
+    matching = [sentence for sentence in sentences
+                if any(mentions_intents([sentence], [intent]) for intent in intents)]
+    quote = ' '.join((matching or sentences)[:EXTRACTIVE_SENTENCES])
+    if len(quote) > MAX_EXTRACTIVE_CHARS:
+        quote = quote[:MAX_EXTRACTIVE_CHARS].rsplit(' ', 1)[0] + '…'
+    return {
+        'answer': "I couldn't put together a full answer in time. The most relevant passage from the source says:\n\n"
+                  f"> {quote}",
+        'citation': (metadata or {}).get('url'),
+        'degraded': True,
+        'timestamp': datetime.now().strftime("%Y-%m-%d")
+    }
+
+def get_facts_only_response(query, retrieved_chunks, model=model, query_embedding=None, deadline=None):
     """
     Generate a facts-only response using retrieved context.
     Max 3 sentences, includes citation.
     Special handling for different types of mutual fund queries.
+    query_embedding: when given, chunks are chosen with MMR for diversity.
+    deadline: the query's Deadline. A slow completion is hedged, and if none
+        answers in time (or the service fails) the answer is quoted from
+        the top chunk instead, marked 'degraded'.
     """
     if not retrieved_chunks:
         return {
@@ -96,21 +168,15 @@ def get_facts_only_response(query, retrieved_chunks, model=model):
     # Extract scheme names for comparison
     scheme_names = []
     if is_comparison:
-        # Look for common mutual fund scheme names in the query
-        schemes = ['Groww Value Fund', 'Groww Large Cap Fund', 'Groww Aggressive Hybrid Fund', 'Groww Liquid Fund']
-        scheme_names = [scheme for scheme in schemes if scheme.lower() in query_lower]
+        # Scheme names (or aliases) from the active index's scheme catalogue
+        scheme_names = get_router().scheme_names_in(query)
     
     # Reorder chunks based on relevance to the query
     relevant_chunks = []
     other_chunks = []
     
     for chunk in retrieved_chunks:
-        if hasattr(chunk, 'metadata'):
-            metadata = chunk.metadata
-        else:
-            metadata = chunk.get('metadata', {})
-        
-        chunk_text = metadata.get('text', '').lower()
+        chunk_text = get_chunk_text(chunk).lower()
         is_relevant = False
         relevance_score = 0
         
@@ -150,7 +216,7 @@ def get_facts_only_response(query, retrieved_chunks, model=model):
     # Get more chunks for multi-faceted queries
     is_multi_faceted = (is_exit_load + is_expense_ratio + is_sip + is_nav + is_aum) > 1
     max_chunks = 10 if is_multi_faceted else 5
-    top_chunks = retrieved_chunks[:max_chunks]
+    top_chunks = select_diverse_chunks(retrieved_chunks, query_embedding, max_chunks)
 
     # Build context from top chunks, removing duplicates
     context_parts = []
@@ -162,7 +228,7 @@ def get_facts_only_response(query, retrieved_chunks, model=model):
         else:
             metadata = chunk.get('metadata', {})
         
-        text = metadata.get('text', '')
+        text = get_chunk_text(chunk)
         url = metadata.get('url', '')
         
         # Only add unique text to avoid redundancy
@@ -278,16 +344,44 @@ Question: {query}
 
 Provide a factual answer based ONLY on the context above. If the context doesn't contain the answer, say that you couldn't find this information in the source documents."""
 
-    try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.1,
-            max_tokens=500 if is_comparison else 250  # Allow more tokens for comparison responses
+    max_tokens = 500 if is_comparison else 250  # Allow more tokens for comparison responses
+    return generate_answer(query, system_prompt, user_prompt, max_tokens, citation, top_chunks[0],
+                           model=model, deadline=deadline)
+
+def generate_answer(query, system_prompt, user_prompt, max_tokens, citation, top_chunk, model=model, deadline=None):
+    """
+    Make the chat completion for a prepared prompt, hedged under the query's
+    deadline. Falls back to quoting top_chunk (see extractive_answer) when
+    no answer arrives in time.
+    """
+    if deadline is None:
+        deadline = Deadline()
+
+    def complete(timeout):
+        # Retries inside the limiter share this request's timeout, so a hedged
+        # request never outlives the deadline
+        stop_at = time.monotonic() + timeout
+        return chat_limiter.run(
+            lambda: client.chat.completions.with_raw_response.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                temperature=0.1,
+                max_tokens=max_tokens,
+                timeout=max(0.0, stop_at - time.monotonic())
+            ),
+            tokens=estimate_tokens(system_prompt + user_prompt) + max_tokens,
+            priority=PRIORITY_USER,
+            stop_at=stop_at
         )
+
+    try:
+        with stage('generate'):
+            raw_response = hedged_call(complete, deadline, chat_latency, reserve=FALLBACK_RESERVE_MS / 1000,
+                                       name='chat completion')
+        response = raw_response.parse()
         
         # Check if we got a valid response
         if not response or not hasattr(response, 'choices') or not response.choices:
@@ -300,11 +394,15 @@ Provide a factual answer based ONLY on the context above. If the context doesn't
             'citation': citation,
             'timestamp': datetime.now().strftime("%Y-%m-%d")
         }
-    except (APIError, AuthenticationError, RateLimitError, APITimeoutError) as e:
+    except (DeadlineExceeded, TimeoutError, RateLimitError, APITimeoutError) as e:
+        print(f"[deadline] {e}; answering from the top chunk")
+        return extractive_answer(query, top_chunk)
+    except (APIError, AuthenticationError) as e:
         print(f"API error: {e}")
         return {
             'answer': f"I'm having trouble connecting to the AI service. Error: {str(e)[:200]}",
             'citation': None,
+            'error': True,
             'timestamp': datetime.now().strftime("%Y-%m-%d")
         }
     except Exception as e:
@@ -312,20 +410,63 @@ Provide a factual answer based ONLY on the context above. If the context doesn't
         return {
             'answer': "I encountered an unexpected error while processing your request. Please try rephrasing your question or try again later.",
             'citation': None,
+            'error': True,
             'timestamp': datetime.now().strftime("%Y-%m-%d")
         }
    
 
-def query_rag(user_query, top_k=5, model=model):
+def get_structured_response(query, plan, results, model=model, deadline=None):
+    """
+    Answer a decomposed question (see subqueries.py) from its merged,
+    per-scheme context in a single completion. Returns (response, chunks),
+    or (None, []) if no sub-query found anything.
+    """
+    context, chunks = merge_results(plan, results)
+    if not chunks:
+        return None, []
+    citations = list(dict.fromkeys(chunk.metadata['url'] for chunk in chunks if chunk.metadata.get('url')))
+
+    system_prompt = """You are a facts-only assistant for mutual fund information. The context is grouped by scheme, and each passage is labelled with the fact it was retrieved for.
+
+        Rules:
+        1. Answer every scheme and fact asked about, one line each, e.g. "Groww Value Fund - Exit load: 1% if redeemed within 1 year"
+        2. Only state facts from the context - no opinions, no advice, no judgement of which scheme is better
+        3. If a fact is missing for a scheme, say it wasn't found in the source documents
+        4. Be specific about values (percentages, amounts, periods)"""
+    user_prompt = f"""Context from source documents:
+{context}
+
+Question: {query}"""
+
+    max_tokens = STRUCTURED_BASE_TOKENS + STRUCTURED_TOKENS_PER_PART * len(plan)
+    response = generate_answer(query, system_prompt, user_prompt, max_tokens, next(iter(citations), None),
+                               chunks[0], model=model, deadline=deadline)
+    if not response.get('error'):
+        response['citations'] = citations
+    return response, chunks
+
+def query_rag(user_query, top_k=5, model=model, adaptive=ADAPTIVE_TOP_K, context=None, deadline_ms=None):
     """
     Main RAG query function.
-    Returns a dictionary with 'answer', 'citation', 'refused', and 'timestamp'.
+    Returns a dictionary with 'answer', 'citation', 'refused', and 'timestamp',
+    plus 'error': True when the answer is an error message, 'degraded': True
+    when it was quoted from a source because the model didn't answer in
+    time, and 'context' to pass back with the next question so that
+    follow-ups can be resolved.
     
     Args:
         user_query (str): The user's query
         top_k (int): Number of chunks to retrieve
         model (str): The model to use for generating responses
+        adaptive (bool): Let simple questions use fewer chunks (see adaptive_k.py)
+        context (dict): The 'context' of the previous answer in this conversation
+        deadline_ms (int): Time allowed for the whole query (QUERY_DEADLINE_MS
+            by default). It bounds the embedding, the searches and the
+            completion; when the model can't answer within it, the answer is
+            quoted from the top chunk and marked 'degraded'. Raises
+            DeadlineExceeded if it passes before anything was retrieved.
     """
+    deadline = Deadline(deadline_ms)
     # Check if this is an investment advice query
     if is_investment_advice_query(user_query):
         return {
@@ -335,19 +476,61 @@ def query_rag(user_query, top_k=5, model=model):
             'timestamp': datetime.now().strftime("%Y-%m-%d")
         }
     
-    # Get relevant chunks from Pinecone (retrieve more for better context)
-    retrieved_chunks = query_pinecone(user_query, top_k=top_k)
+    # Follow-ups ("and its exit load?") are rewritten into standalone questions
+    turn = resolve_turn(user_query, context)
+    query = turn['query']
+    if turn['follow_up']:
+        print(f"[conversation] Follow-up resolved as: {query}")
+
+    # A follow-up about the same scheme can often be answered from the chunks
+    # already retrieved for the previous question, skipping embedding and search
+    retrieved_chunks = None
+    query_embedding = None
+    if turn['reuse_chunks']:
+        retrieved_chunks = get_chunks_by_id(context['chunk_ids'], context.get('scores'))
+        if retrieved_chunks and not mentions_intents([get_chunk_text(chunk) for chunk in retrieved_chunks],
+                                                     turn['intents']):
+            retrieved_chunks = None
+        if retrieved_chunks:
+            print(f"[conversation] Reusing {len(retrieved_chunks)} chunks from the previous turn")
+
+    if not retrieved_chunks:
+        # Comparisons and multi-facet questions about named schemes are split
+        # into per-scheme, per-fact sub-queries retrieved in parallel
+        plan = plan_subqueries(query)
+        if plan:
+            print(f"[subqueries] {len(plan)} sub-queries: " + "; ".join(subquery['text'] for subquery in plan))
+            response, chunks = get_structured_response(query, plan, run_subqueries(plan, deadline), model=model,
+                                                       deadline=deadline)
+            if response:
+                response['refused'] = False
+                response['context'] = make_context(turn, chunks)
+                return response
+
+    if not retrieved_chunks:
+        # Get relevant chunks from Pinecone (retrieve more for better context).
+        # The query embedding is kept for MMR selection of the context.
+        if deadline.expired():
+            raise DeadlineExceeded("deadline passed before the search")
+        query_embedding = get_embedding(query, timeout=deadline.remaining())
+        retrieved_chunks = query_pinecone(query, top_k=top_k, query_embedding=query_embedding,
+                                          adaptive=adaptive, deadline=deadline)
     
     if not retrieved_chunks:
+        if deadline.expired():
+            raise DeadlineExceeded("deadline passed before any chunks were retrieved")
         return {
             'answer': "I couldn't find relevant information in the source documents. Please try rephrasing your question or check the official sources directly.",
             'citation': None,
             'refused': False,
-            'timestamp': datetime.now().strftime("%Y-%m-%d")
+            'timestamp': datetime.now().strftime("%Y-%m-%d"),
+            'context': make_context(turn, [])
         }
     
     # Generate response
-    response = get_facts_only_response(user_query, retrieved_chunks, model=model)
+    response = get_facts_only_response(query, retrieved_chunks, model=model, query_embedding=query_embedding,
+                                       deadline=deadline)
     response['refused'] = False
+    response['context'] = make_context(turn, retrieved_chunks)
     
     return response
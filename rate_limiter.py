@@ -0,0 +1,238 @@
+"""
+Process-wide adaptive rate limiting for OpenAI traffic.
+
+Each limiter combines two token buckets, one for requests per minute and one
+for tokens per minute, with a concurrency limit that adapts to the service:
+it shrinks sharply on a 429 and grows back one slot at a time while requests
+succeed. Bucket sizes follow the x-ratelimit-* response headers when they are
+present.
+
+Waiting callers are served strictly by priority, so interactive queries
+(PRIORITY_USER) always go ahead of index builds (PRIORITY_BACKGROUND).
+"""
+
+import os
+import re
+import time
+import heapq
+import itertools
+import threading
+
+from retry_policy import backoff_delay, error_status, is_retryable
+
+PRIORITY_USER = 0
+PRIORITY_BACKGROUND = 1
+
+MAX_RETRIES = 5
+MIN_CONCURRENCY = 1
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_UNITS = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+
+def parse_reset_duration(value):
+    """
+    Parse an OpenAI reset header such as '1s', '6m0s' or '20ms' into seconds.
+    Returns None if the value can't be parsed.
+    """
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(str(value))
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+def estimate_tokens(text):
+    """Rough token count for rate limiting (about 4 characters per token)."""
+    return max(1, len(text) // 4)
+
+class TokenBucket:
+    """
+    Holds up to `capacity` units and refills continuously so that the full
+    capacity is restored over `period` seconds.
+    """
+
+    def __init__(self, capacity, period=60.0):
+        self.capacity = float(capacity)
+        self.period = period
+        self.level = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / self.period)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` units are available (0 if they are now)."""
+        self._refill(now)
+        # Requests larger than the whole bucket are allowed once it is full
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * self.period / self.capacity
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def sync(self, limit=None, remaining=None):
+        """Align the bucket with limits reported by the server."""
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.level = min(self.level, float(remaining))
+
+    def pause(self, seconds, now):
+        """Empty the bucket so nothing is available for `seconds`."""
+        self._refill(now)
+        self.level = min(self.level, -seconds * self.capacity / self.period)
+
+class RateLimiter:
+    """
+    Request/token rate limiter with adaptive concurrency and priorities.
+
+    Use run() to make a call under the limiter:
+        raw = limiter.run(lambda: client.embeddings.with_raw_response.create(...),
+                          tokens=estimate_tokens(text), priority=PRIORITY_USER)
+    """
+
+    def __init__(self, name, rpm, tpm, max_concurrency=16):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.concurrency = max_concurrency
+        self.active = 0
+        self._condition = threading.Condition()
+        self._waiters = []
+        self._sequence = itertools.count()
+        self.stats = {'calls': 0, 'rate_limited': 0, 'waited_seconds': 0.0}
+
+    def acquire(self, tokens=1, priority=PRIORITY_USER, stop_at=None):
+        """
+        Block until this call may start. Must be paired with release().
+        stop_at: time.monotonic() after which to give up waiting, raising
+            TimeoutError
+        """
+        entry = (priority, next(self._sequence))
+        start = time.monotonic()
+        with self._condition:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if stop_at is not None and now >= stop_at:
+                        raise TimeoutError(f"no {self.name} request slot before the deadline")
+                    wait = None
+                    if self._waiters[0] == entry and self.active < self.concurrency:
+                        wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+                        if wait <= 0:
+                            self.requests.take(1)
+                            self.tokens.take(tokens)
+                            self.active += 1
+                            break
+                    if stop_at is not None:
+                        wait = stop_at - now if wait is None else min(wait, stop_at - now)
+                    self._condition.wait(wait)
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+            self.stats['waited_seconds'] += time.monotonic() - start
+
+    def release(self, headers=None, rate_limited=False, retry_after=None, succeeded=True):
+        """
+        Finish a call, adapting to the outcome: response headers re-sync the
+        buckets, a 429 halves concurrency and pauses new calls, and a success
+        lets concurrency grow by one slot.
+        """
+        with self._condition:
+            self.active -= 1
+            self.stats['calls'] += 1
+            now = time.monotonic()
+            if rate_limited:
+                self.stats['rate_limited'] += 1
+                self.concurrency = max(MIN_CONCURRENCY, self.concurrency // 2)
+                self.requests.pause(retry_after or 1.0, now)
+            elif succeeded:
+                if self.concurrency < self.max_concurrency:
+                    self.concurrency += 1
+                if headers:
+                    self._sync_headers(headers)
+            self._condition.notify_all()
+
+    def _sync_headers(self, headers):
+        def number(name):
+            try:
+                return float(headers.get(name))
+            except (TypeError, ValueError):
+                return None
+
+        self.requests.sync(number('x-ratelimit-limit-requests'), number('x-ratelimit-remaining-requests'))
+        self.tokens.sync(number('x-ratelimit-limit-tokens'), number('x-ratelimit-remaining-tokens'))
+
+    def run(self, call, tokens=1, priority=PRIORITY_USER, max_retries=MAX_RETRIES, stop_at=None):
+        """
+        Make `call()` under the limiter, retrying with backoff every error
+        retry_policy.is_retryable accepts: 429s (honouring Retry-After),
+        408, 409, 5xx, and connection errors and timeouts without a status.
+        The last error is raised once retries are exhausted. Returns
+        whatever `call()` returns.
+        Clients should be created with max_retries=0, so that every retry
+        is left to the limiter instead of happening inside the SDK.
+        stop_at: time.monotonic() by which the call must be over, e.g. a
+            query's deadline. No retry is started that would wait past it,
+            and waiting for a slot past it raises TimeoutError.
+        """
+        def out_of_time(delay):
+            return stop_at is not None and time.monotonic() + delay >= stop_at
+
+        attempt = 0
+        while True:
+            self.acquire(tokens, priority, stop_at)
+            try:
+                result = call()
+            except Exception as e:
+                if error_status(e) != 429:
+                    self.release(succeeded=False)
+                    if attempt >= max_retries or not is_retryable(e):
+                        raise
+                    delay = backoff_delay(attempt)
+                    if out_of_time(delay):
+                        raise
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                retry_after = _retry_after(e)
+                self.release(rate_limited=True, retry_after=retry_after)
+                if attempt >= max_retries:
+                    raise
+                # With a Retry-After the paused bucket already holds everyone back
+                delay = retry_after or backoff_delay(attempt)
+                if out_of_time(delay):
+                    raise
+                if not retry_after:
+                    time.sleep(delay)
+                attempt += 1
+                continue
+            self.release(headers=getattr(result, 'headers', None))
+            return result
+
+def _retry_after(error):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return parse_reset_duration(headers.get('x-ratelimit-reset-requests'))
+
+# Shared by every OpenAI call in the process. OpenAI applies limits per
+# model, so embeddings and chat completions get separate limiters.
+embedding_limiter = RateLimiter(
+    'embeddings',
+    rpm=int(os.getenv("OPENAI_EMBEDDING_RPM", "3000")),
+    tpm=int(os.getenv("OPENAI_EMBEDDING_TPM", "1000000"))
+)
+chat_limiter = RateLimiter(
+    'chat',
+    rpm=int(os.getenv("OPENAI_CHAT_RPM", "3500")),
+    tpm=int(os.getenv("OPENAI_CHAT_TPM", "200000"))
+)
@@ -0,0 +1,216 @@
+"""
+Background refresh daemon with blue/green index versions.
+
+On every interval this recrawls groww.csv and builds a complete new version
+into its own Pinecone namespace and versions/<namespace>/ directory, while
+queries keep using the active version. Only after the new version passes
+validation is active_index.json switched to it (an atomic file replace), so
+queries never see a half-built index. Older versions are then deleted,
+keeping the previous one for queries still in flight and for rollback.
+
+Usage:
+    python refresh_daemon.py                  # refresh every 24 hours
+    python refresh_daemon.py --interval 6     # refresh every 6 hours
+    python refresh_daemon.py --once           # single refresh, then exit
+"""
+
+import re
+import sys
+import time
+import shutil
+import argparse
+
+from build_index import build_index
+from build_checkpoint import CHECKPOINT_DIR
+from corpus_store import open_store
+from scheme_router import get_router
+from index_versions import (
+    VERSIONS_DIR, new_version_name, version_dir, read_pointer, activate_version, retire_versions
+)
+
+REFRESH_INTERVAL_HOURS = 24
+# Versions kept after a cutover: the active one and the one before it
+KEEP_VERSIONS = 2
+# A new version with far fewer vectors than the active one is rejected
+MIN_VECTOR_RATIO = 0.8
+# How long to wait for upserted vectors to become visible to queries
+VISIBILITY_TIMEOUT = 120
+# Namespaces of daemon-built versions (see new_version_name), and the
+# per-scheme namespaces that earlier builds split them into
+VERSION_NAMESPACE = re.compile(r'^v\d{8}T\d{6}(?:\.|$)')
+VALIDATION_QUERIES = [
+    "What is the expense ratio of Groww Value Fund?",
+    "What is the exit load for Groww Liquid Fund?"
+]
+
+def namespace_vector_count(index, namespace):
+    stats = index.describe_index_stats()
+    summary = (getattr(stats, 'namespaces', None) or {}).get(namespace)
+    return getattr(summary, 'vector_count', 0) if summary else 0
+
+def wait_for_vectors(index, namespace, expected, timeout=VISIBILITY_TIMEOUT):
+    """Poll until the namespace reports `expected` vectors. Returns the last count."""
+    deadline = time.monotonic() + timeout
+    count = namespace_vector_count(index, namespace)
+    while count < expected and time.monotonic() < deadline:
+        time.sleep(5)
+        count = namespace_vector_count(index, namespace)
+    return count
+
+def validate_version(manifest, active):
+    """
+    Check a freshly built version before it is served.
+    Returns a list of problems; an empty list means it can be activated.
+    """
+    from main import get_index, get_embedding, search_index
+
+    index = get_index()
+    problems = []
+    namespace = manifest['namespace']
+    if manifest['vectors'] == 0:
+        return ["no vectors were uploaded"]
+    if manifest['failed_embeddings'] or manifest['failed_upserts']:
+        problems.append(f"{manifest['failed_embeddings']} embeddings and "
+                        f"{manifest['failed_upserts']} upserts failed")
+    if active and active.get('vectors') and manifest['vectors'] < active['vectors'] * MIN_VECTOR_RATIO:
+        problems.append(f"only {manifest['vectors']} vectors, down from {active['vectors']} in {active['namespace']}")
+
+    visible = wait_for_vectors(index, namespace, manifest['vectors'])
+    if visible < manifest['vectors']:
+        problems.append(f"only {visible}/{manifest['vectors']} vectors visible after {VISIBILITY_TIMEOUT}s")
+
+    chunk_store = open_store(manifest['chunk_store'])
+    router = get_router(manifest)
+    for question in VALIDATION_QUERIES:
+        embedding = get_embedding(question)
+        if not embedding:
+            problems.append(f"could not embed validation query: {question}")
+            continue
+        # Searched the way queries will be: routed to the question's partitions
+        matches = search_index(index, namespace, embedding, 3,
+                               metadata_filter=router.search_filter(router.route(question)))
+        if not matches:
+            problems.append(f"no matches for: {question}")
+        elif chunk_store is None or any(match.id not in chunk_store for match in matches):
+            problems.append(f"matches for '{question}' are missing from the chunk store")
+    return problems
+
+def resumable_build(pointer=None):
+    """
+    Namespace of the newest build that was interrupted or left failures,
+    i.e. a version newer than the active one that still holds its build
+    checkpoint, or None. The next refresh resumes it.
+    """
+    if pointer is None:
+        pointer = read_pointer()
+    if not VERSIONS_DIR.exists():
+        return None
+    known = {version['namespace'] for version in [pointer.get('active')] + pointer.get('history', []) if version}
+    newest_known = max(known, default='')
+    candidates = [path.name for path in VERSIONS_DIR.iterdir()
+                  if path.is_dir() and VERSION_NAMESPACE.match(path.name) and path.name not in known
+                  and path.name > newest_known and (path / CHECKPOINT_DIR).is_dir()]
+    return max(candidates, default=None)
+
+def collect_garbage(keep=KEEP_VERSIONS):
+    """
+    Delete every version namespace and directory except the active one and
+    the most recent previous ones, including builds that failed validation.
+    The newest interrupted build is kept with its checkpoint, so it can be
+    resumed.
+    """
+    from main import get_index
+
+    index = get_index()
+    pointer = read_pointer()
+    versions = ([pointer['active']] if pointer.get('active') else []) + pointer.get('history', [])
+    kept = {version['namespace'] for version in versions[:keep]}
+    resumable = resumable_build(pointer)
+    if resumable:
+        kept.add(resumable)
+    retired = {version['namespace'] for version in versions[keep:]}
+
+    stats = index.describe_index_stats()
+    namespaces = set(getattr(stats, 'namespaces', None) or {})
+    # Only namespaces created by this daemon; the default namespace holds
+    # manually built indexes and is left alone
+    stale = {ns for ns in namespaces | retired if VERSION_NAMESPACE.match(ns) and ns not in kept}
+    for namespace in sorted(stale):
+        try:
+            index.delete(delete_all=True, namespace=namespace)
+            print(f"  ✓ Deleted namespace {namespace}")
+        except Exception as e:
+            print(f"  ✗ Error deleting namespace {namespace}: {e}")
+
+    if VERSIONS_DIR.exists():
+        for path in VERSIONS_DIR.iterdir():
+            if path.is_dir() and path.name not in kept:
+                shutil.rmtree(path, ignore_errors=True)
+
+    retire_versions(retired)
+
+def refresh_once(csv_file='groww.csv'):
+    """
+    Build, validate and activate one new index version, resuming the
+    newest interrupted build if there is one. Returns True if the new version is now being served.
+    """
+    namespace = resumable_build()
+    resume = namespace is not None
+    if resume:
+        print(f"\n[refresh] Resuming interrupted build of version {namespace}...")
+    else:
+        namespace = new_version_name()
+        print(f"\n[refresh] Building version {namespace}...")
+    active = read_pointer().get('active')
+
+    manifest = build_index(csv_file, namespace=namespace, output_dir=version_dir(namespace),
+                           resume=resume)
+    if manifest is None:
+        print(f"[refresh] Build of {namespace} failed; still serving "
+              f"{active['namespace'] if active else 'the default namespace'}")
+        collect_garbage()
+        return False
+
+    problems = validate_version(manifest, active)
+    if problems:
+        print(f"[refresh] Version {namespace} failed validation:")
+        for problem in problems:
+            print(f"  ✗ {problem}")
+        collect_garbage()
+        return False
+
+    activate_version({
+        'namespace': namespace,
+        'chunk_store': manifest['chunk_store'],
+        'catalog': manifest['catalog'],
+        'local_index': manifest.get('local_index'),
+        'snapshot_hash': manifest['snapshot']['snapshot_hash'],
+        'vectors': manifest['vectors'],
+        'built_at': manifest['built_at']
+    })
+    print(f"[refresh] ✓ Now serving {namespace} ({manifest['vectors']} vectors)")
+    collect_garbage()
+    return True
+
+def run(interval_hours=REFRESH_INTERVAL_HOURS, csv_file='groww.csv'):
+    """Refresh forever, one build every interval_hours."""
+    while True:
+        started = time.monotonic()
+        try:
+            refresh_once(csv_file)
+        except Exception as e:
+            # A failed refresh leaves the active version untouched; try again next interval
+            print(f"[refresh] Error during refresh: {e}")
+        elapsed = time.monotonic() - started
+        time.sleep(max(0, interval_hours * 3600 - elapsed))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Periodically rebuild the index with zero-downtime cutover.")
+    parser.add_argument('--interval', type=float, default=REFRESH_INTERVAL_HOURS, help="hours between refreshes")
+    parser.add_argument('--csv', default='groww.csv', help="file with one URL per line to crawl")
+    parser.add_argument('--once', action='store_true', help="run a single refresh and exit")
+    args = parser.parse_args()
+
+    if args.once:
+        sys.exit(0 if refresh_once(args.csv) else 1)
+    run(args.interval, args.csv)
@@ -0,0 +1,61 @@
+"""
+Retry rules shared by the index build and the query path.
+
+Which errors are worth retrying, and how long to back off between attempts.
+"""
+
+import random
+import importlib
+
+BASE_DELAY = 0.5
+MAX_DELAY = 30.0
+
+# Statuses a later attempt can succeed on (throttling, request timeouts,
+# conflicts); 5xx responses are retried as well
+RETRYABLE_STATUS = {408, 409, 429}
+# Errors for requests that got no response at all, from whichever clients
+# are installed: OpenAI's (including APITimeoutError), Pinecone's, and the
+# urllib3 and httpx transports under them
+TRANSPORT_ERRORS = [
+    ('openai', 'APIConnectionError'),
+    ('pinecone.errors', 'PineconeConnectionError'),
+    ('urllib3.exceptions', 'HTTPError'),
+    ('httpx', 'TransportError'),
+]
+
+_transport_errors = None
+
+def transport_errors():
+    """Exception types of connection failures and timeouts."""
+    global _transport_errors
+    if _transport_errors is None:
+        types = [ConnectionError, TimeoutError]
+        for module, name in TRANSPORT_ERRORS:
+            try:
+                types.append(getattr(importlib.import_module(module), name))
+            except (ImportError, AttributeError):
+                pass
+        _transport_errors = tuple(types)
+    return _transport_errors
+
+def error_status(error):
+    """HTTP status of an API error (Pinecone sets `status`, OpenAI `status_code`), or None."""
+    return getattr(error, 'status', None) or getattr(error, 'status_code', None)
+
+def is_retryable(error):
+    """
+    Whether another attempt may succeed: a retryable status or 5xx, or a
+    transport error without a response. Other client errors, and bugs such
+    as TypeError or ValueError, fail the same way every time.
+    """
+    status = error_status(error)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS or status >= 500
+    return isinstance(error, transport_errors())
+
+def backoff_delay(attempt, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    """
+    Full-jitter exponential backoff: a random delay in [0, base * 2^attempt],
+    capped at max_delay.
+    """
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
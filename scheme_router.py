@@ -0,0 +1,218 @@
+"""
+Scheme catalogue and query router for a partitioned index.
+
+Every build groups its pages into partitions, one per scheme (plus a
+"general" partition for pages that aren't about a single scheme), and tags
+each vector with its partition in the `partition` metadata field. All of a
+version's vectors stay in its one Pinecone namespace. Once they are
+uploaded, the build writes scheme_catalog.json, a dictionary of scheme
+names and aliases such as "groww value fund" and "groww value", each mapped
+to the partitions it names.
+
+At query time the router looks the question's word n-grams up in that
+dictionary, so routing costs the same however many schemes there are. A
+question naming schemes searches only their partitions, through a metadata
+filter. A question naming only a fund house searches that AMC's
+partitions. Anything else searches everything. Either way a query is a
+single search, however large the catalogue grows.
+"""
+
+import os
+import re
+import json
+import threading
+from pathlib import Path
+from urllib.parse import urlparse
+
+from index_versions import read_active_version
+
+BASE_DIR = Path(__file__).parent
+CATALOG_FILE = 'scheme_catalog.json'
+DEFAULT_URLS_FILE = BASE_DIR / 'groww.csv'
+GENERAL_PARTITION = 'general'
+# Vector metadata field holding the partition
+PARTITION_FIELD = 'partition'
+
+# Slug words that name a plan or option rather than the scheme
+PLAN_WORDS = {'direct', 'regular', 'growth', 'idcw', 'dividend', 'plan', 'option', 'payout', 'reinvestment', 'bonus'}
+# Short slug words that are not acronyms, e.g. not "SBI" or "PSU"
+LOWER_WORDS = {'and', 'of', 'the', 'cap', 'fof', 'tax', 'day'}
+# Fund houses as they begin scheme slugs; others are taken to be the first word
+AMC_PREFIXES = (
+    'aditya birla sun life', 'axis', 'bajaj finserv', 'bandhan', 'bank of india', 'baroda bnp paribas',
+    'canara robeco', 'franklin india', 'hdfc', 'hsbc', 'icici prudential', 'invesco india', 'jm financial',
+    'kotak', 'lic', 'mahindra manulife', 'mirae asset', 'motilal oswal', 'nippon india', 'old bridge',
+    'parag parikh', 'pgim india', 'quant', 'quantum', 'sbi', 'sundaram', 'tata', 'union', 'uti',
+    'whiteoak capital', '360 one'
+)
+# Words joined into one in common spellings, e.g. "largecap" for "large cap"
+_JOINABLE = re.compile(r'\b(large|mid|small|flexi|multi|micro) cap\b')
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+def normalize(text):
+    """Lower-case words separated by single spaces, for dictionary lookups."""
+    return _NON_WORD.sub(' ', text.lower()).strip()
+
+def scheme_from_url(url):
+    """
+    (partition, scheme name, AMC) for a scheme page URL such as
+    https://groww.in/mutual-funds/groww-value-fund-direct-growth, or
+    (GENERAL_PARTITION, None, None) for pages not about a single scheme.
+    """
+    slug = urlparse(url).path.rstrip('/').rsplit('/', 1)[-1].lower()
+    words = [word for word in slug.split('-') if word]
+    if 'fund' not in words:
+        return GENERAL_PARTITION, None, None
+    while words and words[-1] in PLAN_WORDS:
+        words.pop()
+    name = ' '.join(words)
+    amc = next((amc for amc in AMC_PREFIXES if name.startswith(amc + ' ')), words[0])
+    scheme = ' '.join(word.upper() if len(word) <= 3 and word not in LOWER_WORDS else word.capitalize()
+                      for word in words)
+    return '-'.join(words), scheme, amc
+
+def scheme_aliases(scheme, amc):
+    """
+    Ways a question might name a scheme: "groww value fund", "groww value",
+    "groww largecap fund". Every alias keeps the fund house, since names
+    like "value fund" or "liquid fund" alone are also generic questions.
+    """
+    name = normalize(scheme)
+    amc = normalize(amc)
+    candidates = {name}
+    if name.endswith(' fund'):
+        candidates.add(name[:-len(' fund')])
+    candidates |= {_JOINABLE.sub(r'\1cap', candidate) for candidate in candidates}
+    return sorted(alias for alias in candidates if alias.startswith(amc + ' ') or alias == name)
+
+def build_catalog(urls):
+    """
+    The scheme catalogue for a set of page URLs:
+    {'partitions': {partition: {'scheme', 'amc', 'urls'}},
+     'aliases': {alias: [partition, ...]}, 'amcs': {amc: [partition, ...]}}
+    """
+    partitions = {}
+    for url in urls:
+        partition, scheme, amc = scheme_from_url(url)
+        entry = partitions.setdefault(partition, {'scheme': scheme, 'amc': amc, 'urls': []})
+        entry['urls'].append(url)
+
+    aliases, amcs = {}, {}
+    for partition, entry in sorted(partitions.items()):
+        if not entry['scheme']:
+            continue
+        for alias in scheme_aliases(entry['scheme'], entry['amc']):
+            aliases.setdefault(alias, []).append(partition)
+        amcs.setdefault(normalize(entry['amc']), []).append(partition)
+    return {'partitioned': True, 'partitions': partitions, 'aliases': aliases, 'amcs': amcs}
+
+def write_catalog(catalog, path=CATALOG_FILE):
+    tmp_path = Path(path).with_name(Path(path).name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(catalog, f, indent=2)
+    os.replace(tmp_path, path)
+    return str(path)
+
+class SchemeRouter:
+    """Maps questions to the partitions of the index they need."""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.partitioned = catalog.get('partitioned', False)
+        self.partitions = catalog['partitions']
+        self.aliases = catalog['aliases']
+        self.amcs = catalog['amcs']
+        self._max_words = max([len(alias.split()) for alias in self.aliases] + [1])
+        self.scheme_names = [entry['scheme'] for _, entry in sorted(self.partitions.items()) if entry['scheme']]
+
+    def _match(self, words, dictionary):
+        """
+        Partitions named in words, in the order they are named. Longer
+        aliases are matched first, and each word belongs to one alias.
+        """
+        found, used = [], set()
+        for n in range(min(self._max_words, len(words)), 0, -1):
+            for start in range(len(words) - n + 1):
+                span = set(range(start, start + n))
+                if span & used:
+                    continue
+                partitions = dictionary.get(' '.join(words[start:start + n]))
+                if partitions:
+                    used |= span
+                    found.append((start, partitions))
+        matched = []
+        for _, partitions in sorted(found, key=lambda item: item[0]):
+            matched.extend(p for p in partitions if p not in matched)
+        return matched
+
+    def schemes(self, text):
+        """Partitions of the schemes named in text."""
+        return self._match(normalize(text).split(), self.aliases)
+
+    def scheme_names_in(self, text):
+        """Display names of the schemes named in text."""
+        return [self.partitions[partition]['scheme'] for partition in self.schemes(text)]
+
+    def route(self, text):
+        """
+        Partitions to search for a question: the schemes it names, else the
+        schemes of the fund house it names, else [] meaning all of them.
+        Routed questions also search the general partition, which holds
+        pages (regulator filings, help articles) not tied to one scheme.
+        """
+        words = normalize(text).split()
+        partitions = self._match(words, self.aliases) or self._match(words, self.amcs)
+        if partitions and GENERAL_PARTITION in self.partitions:
+            partitions.append(GENERAL_PARTITION)
+        return partitions
+
+    def search_filter(self, partitions=None):
+        """
+        Pinecone metadata filter that limits a search to the given
+        partitions, or None to search every vector (generic questions, and
+        indexes built before partitioning).
+        """
+        if not self.partitioned or not partitions:
+            return None
+        return {PARTITION_FIELD: {'$in': list(partitions)}}
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+def load_catalog(path):
+    """The catalogue at path, re-read when the file changes, or None if missing."""
+    path = str(path)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _catalogs_lock:
+        cached = _catalogs.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path, 'r', encoding='utf-8') as f:
+                cached = (mtime, SchemeRouter(json.load(f)))
+            _catalogs[path] = cached
+        return cached[1]
+
+def get_router(version=None):
+    """
+    The router for the active index version (or the given version record).
+    Indexes built before partitioning have no catalogue; their router knows
+    the schemes in groww.csv, for detection only, and searches one namespace.
+    """
+    if version is None:
+        version = read_active_version()
+    path = version.get('catalog') if version else BASE_DIR / CATALOG_FILE
+    router = load_catalog(path) if path else None
+    if router is None:
+        with _catalogs_lock:
+            router = _catalogs.get('default')
+            if router is None:
+                try:
+                    with open(DEFAULT_URLS_FILE, 'r', encoding='utf-8') as f:
+                        urls = [line.strip() for line in f if line.strip()]
+                except FileNotFoundError:
+                    urls = []
+                router = SchemeRouter({**build_catalog(urls), 'partitioned': False})
+                _catalogs['default'] = router
+    return router
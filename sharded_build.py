@@ -0,0 +1,323 @@
+"""
+Sharded, checkpointed index builds for large URL lists.
+
+The URL list is split into shards, each built independently by
+build_index.build_index into its own directory under the work directory
+(corpus store, chunk store, local index, scheme catalogue and manifest),
+uploading straight into the shared Pinecone namespace, each vector tagged
+with its scheme partition. A shard writes checkpoint.json only once it has finished
+without failures, so an interrupted build is re-run by simply running the
+same command again: finished shards are skipped.
+The merge step then combines the shard outputs into a single corpus store,
+chunk store, local index, scheme catalogue and manifest.
+
+Shards can run in a local process pool, or on several machines that share
+(or later copy back) the work directory:
+
+    python sharded_build.py plan --shards 16 --csv all_schemes.csv
+    python sharded_build.py run --workers 4          # all shards, locally
+    python sharded_build.py run --only 0-7           # this machine's shards
+    python sharded_build.py status
+    python sharded_build.py merge
+"""
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from build_index import build_index, write_index_manifest, LOCAL_INDEX_DIR, INDEX_MANIFEST_FILE
+from corpus_store import CORPUS_STORE_FILE, CHUNK_STORE_FILE, merge_stores
+from quantized_index import QuantizedIndex, build_quantized_index
+from extractor import get_absolute_path
+from scheme_router import CATALOG_FILE, build_catalog, write_catalog
+
+WORK_DIR = 'shards'
+PLAN_FILE = 'plan.json'
+SHARD_URLS_FILE = 'urls.csv'
+CHECKPOINT_FILE = 'checkpoint.json'
+DEFAULT_SHARDS = 8
+DEFAULT_WORKERS = 4
+
+def shard_of(url, num_shards):
+    """
+    Stable shard number for a URL. Hashing (rather than splitting the list
+    in order) means adding URLs only invalidates the shards they land in.
+    """
+    return int(hashlib.sha1(url.encode('utf-8')).hexdigest(), 16) % num_shards
+
+def shard_dir(work_dir, shard):
+    return Path(work_dir) / f"shard-{shard:04d}"
+
+def urls_hash(urls):
+    return hashlib.sha256('\n'.join(urls).encode('utf-8')).hexdigest()
+
+def plan_shards(csv_file='groww.csv', num_shards=DEFAULT_SHARDS, work_dir=WORK_DIR, namespace=""):
+    """
+    Split the URLs in csv_file into num_shards shard directories, each with
+    its own urls.csv, and record the plan in plan.json. Returns the plan.
+    """
+    with open(csv_file, 'r', encoding='utf-8') as f:
+        urls = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+    if not urls:
+        raise ValueError(f"No URLs found in {csv_file}")
+
+    shards = [[] for _ in range(num_shards)]
+    for url in urls:
+        shards[shard_of(url, num_shards)].append(url)
+
+    work_dir = Path(work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    for shard, shard_urls in enumerate(shards):
+        path = shard_dir(work_dir, shard)
+        path.mkdir(exist_ok=True)
+        with open(path / SHARD_URLS_FILE, 'w', encoding='utf-8') as f:
+            f.write(''.join(url + '\n' for url in shard_urls))
+
+    plan = {
+        'csv': str(csv_file),
+        'shards': num_shards,
+        'namespace': namespace,
+        'urls': len(urls),
+        'shard_sizes': [len(shard_urls) for shard_urls in shards],
+        'created_at': datetime.now().isoformat(timespec='seconds')
+    }
+    _write_json(work_dir / PLAN_FILE, plan)
+    return plan
+
+def read_plan(work_dir=WORK_DIR):
+    with open(Path(work_dir) / PLAN_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def read_checkpoint(work_dir, shard):
+    """
+    The checkpoint of a finished shard, or None if the shard still has to
+    be built (never run, failed, or its URL list has changed since).
+    """
+    path = shard_dir(work_dir, shard)
+    try:
+        with open(path / CHECKPOINT_FILE, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        with open(path / SHARD_URLS_FILE, 'r', encoding='utf-8') as f:
+            urls = [line.strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        return None
+    return checkpoint if checkpoint.get('urls_hash') == urls_hash(urls) else None
+
+def build_shard(work_dir, shard, force=False):
+    """
+    Build one shard unless it already has a valid checkpoint.
+    Returns (shard, status) with status 'skipped', 'done', 'empty' or 'failed'.
+    """
+    if not force and read_checkpoint(work_dir, shard):
+        return shard, 'skipped'
+
+    plan = read_plan(work_dir)
+    path = shard_dir(work_dir, shard)
+    with open(path / SHARD_URLS_FILE, 'r', encoding='utf-8') as f:
+        urls = [line.strip() for line in f if line.strip()]
+    if not urls:
+        _write_json(path / CHECKPOINT_FILE, {'shard': shard, 'urls_hash': urls_hash(urls), 'manifest': None})
+        return shard, 'empty'
+
+    print(f"\n[shard {shard}] Building {len(urls)} URLs into {path}")
+    # A shard that failed part-way resumes from its own build checkpoint
+    manifest = build_index(csv_file=path / SHARD_URLS_FILE, namespace=plan['namespace'], output_dir=path,
+                           resume=not force)
+    if manifest is None:
+        return shard, 'failed'
+    if manifest['failed_embeddings'] or manifest['failed_upserts']:
+        # Left without a checkpoint so the next run resumes it
+        print(f"[shard {shard}] {manifest['failed_embeddings']} embeddings and "
+              f"{manifest['failed_upserts']} upserts failed; shard will be resumed on the next run")
+        return shard, 'failed'
+
+    _write_json(path / CHECKPOINT_FILE, {
+        'shard': shard,
+        'urls_hash': urls_hash(urls),
+        'finished_at': datetime.now().isoformat(timespec='seconds'),
+        'manifest': manifest
+    })
+    return shard, 'done'
+
+def _init_worker(workers):
+    # Each process has its own rate limiter, so split the account's limits
+    # between them (the limiters still follow the API's rate-limit headers)
+    for name, default in (("OPENAI_EMBEDDING_RPM", 3000), ("OPENAI_EMBEDDING_TPM", 1000000)):
+        os.environ[name] = str(max(1, int(os.getenv(name, default)) // workers))
+
+def run_shards(work_dir=WORK_DIR, shards=None, workers=DEFAULT_WORKERS, force=False):
+    """
+    Build the given shards (all of them by default) in a pool of worker
+    processes. Returns {shard: status}.
+    """
+    plan = read_plan(work_dir)
+    if shards is None:
+        shards = range(plan['shards'])
+    shards = [shard for shard in shards if force or not read_checkpoint(work_dir, shard)]
+    if not shards:
+        print("All shards are already built.")
+        return {}
+
+    workers = max(1, min(workers, len(shards)))
+    print(f"Building {len(shards)} shards with {workers} workers...")
+    statuses = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(workers,)) as pool:
+        futures = [pool.submit(build_shard, work_dir, shard, force) for shard in shards]
+        for future in as_completed(futures):
+            try:
+                shard, status = future.result()
+            except Exception as e:
+                print(f"✗ Shard worker crashed: {e}")
+                continue
+            statuses[shard] = status
+            print(f"{'✓' if status != 'failed' else '✗'} Shard {shard}: {status} "
+                  f"({len(statuses)}/{len(shards)})")
+    return statuses
+
+def merge_shards(work_dir=WORK_DIR, output_dir=None):
+    """
+    Combine all finished shards into a single corpus store, chunk store,
+    local index, scheme catalogue and manifest in output_dir (the project directory by
+    default). Returns the manifest, or None if some shards aren't finished.
+    """
+    def output_path(name):
+        return Path(output_dir) / name if output_dir else get_absolute_path(name)
+
+    plan = read_plan(work_dir)
+    checkpoints = [read_checkpoint(work_dir, shard) for shard in range(plan['shards'])]
+    unfinished = [shard for shard, checkpoint in enumerate(checkpoints) if checkpoint is None]
+    if unfinished:
+        print(f"Error: {len(unfinished)} shards are not finished: {_format_ranges(unfinished)}")
+        return None
+    manifests = [checkpoint['manifest'] for checkpoint in checkpoints if checkpoint['manifest']]
+    if not manifests:
+        print("Error: no shard produced any documents")
+        return None
+    shard_dirs = [shard_dir(work_dir, checkpoint['shard']) for checkpoint in checkpoints if checkpoint['manifest']]
+
+    print(f"Merging {len(manifests)} shards...")
+    corpus_store_path = output_path(CORPUS_STORE_FILE)
+    corpus_meta = merge_stores([path / CORPUS_STORE_FILE for path in shard_dirs], corpus_store_path,
+                               meta={'source': plan['csv'], 'shards': plan['shards']})
+    print(f"✓ Corpus saved to {corpus_store_path} ({corpus_meta['count']} documents)")
+
+    chunk_store_path = output_path(CHUNK_STORE_FILE)
+    chunk_meta = merge_stores([path / CHUNK_STORE_FILE for path in shard_dirs], chunk_store_path,
+                              meta={'snapshot_hash': corpus_meta['snapshot_hash']})
+    print(f"✓ Chunks saved to {chunk_store_path} ({chunk_meta['count']} chunks)")
+
+    local_index_dir = None
+    ids, vectors = [], []
+    for path in shard_dirs:
+        if (path / LOCAL_INDEX_DIR).exists():
+            shard_index = QuantizedIndex(path / LOCAL_INDEX_DIR)
+            ids.extend(shard_index.ids)
+            vectors.append(shard_index.vectors)
+    if ids:
+        local_index_dir = output_path(LOCAL_INDEX_DIR)
+        build_quantized_index(local_index_dir, ids, np.concatenate(vectors))
+        print(f"✓ Wrote local index to {local_index_dir} ({len(ids)} vectors)")
+
+    urls = []
+    for path in shard_dirs:
+        with open(path / CATALOG_FILE, 'r', encoding='utf-8') as f:
+            urls.extend(url for entry in json.load(f)['partitions'].values() for url in entry['urls'])
+    catalog = build_catalog(urls)
+    catalog_path = write_catalog(catalog, output_path(CATALOG_FILE))
+    print(f"✓ Scheme catalogue saved to {catalog_path} ({len(catalog['partitions'])} partitions)")
+
+    snapshot_info = {
+        'path': str(corpus_store_path),
+        'format': 'mfcs',
+        'snapshot_hash': corpus_meta['snapshot_hash'],
+        'documents': corpus_meta['count']
+    }
+    manifest = write_index_manifest(
+        snapshot_info, chunk_meta['count'], sum(m['vectors'] for m in manifests),
+        path=output_path(INDEX_MANIFEST_FILE),
+        extra={
+            'namespace': plan['namespace'],
+            'chunk_store': str(chunk_store_path),
+            'catalog': catalog_path,
+            'local_index': str(local_index_dir) if local_index_dir else None,
+            'partitions': len(catalog['partitions']),
+            'failed_embeddings': sum(m['failed_embeddings'] for m in manifests),
+            'failed_upserts': sum(m['failed_upserts'] for m in manifests),
+            'shards': plan['shards']
+        })
+    print(f"✓ Index manifest written (snapshot {corpus_meta['snapshot_hash'][:12]})")
+    return manifest
+
+def print_status(work_dir=WORK_DIR):
+    plan = read_plan(work_dir)
+    finished = [shard for shard in range(plan['shards']) if read_checkpoint(work_dir, shard)]
+    remaining = sorted(set(range(plan['shards'])) - set(finished))
+    print(f"{len(finished)}/{plan['shards']} shards finished ({plan['urls']} URLs, "
+          f"namespace {plan['namespace'] or '(default)'})")
+    if remaining:
+        print(f"Remaining: {_format_ranges(remaining)}")
+
+def _parse_ranges(spec):
+    """'0-3,7' -> [0, 1, 2, 3, 7]"""
+    shards = []
+    for part in spec.split(','):
+        start, _, end = part.partition('-')
+        shards.extend(range(int(start), int(end or start) + 1))
+    return shards
+
+def _format_ranges(shards):
+    parts = []
+    for shard in shards:
+        if parts and parts[-1][1] == shard - 1:
+            parts[-1][1] = shard
+        else:
+            parts.append([shard, shard])
+    return ','.join(str(a) if a == b else f"{a}-{b}" for a, b in parts)
+
+def _write_json(path, data):
+    # Written to a temporary file first so a crash never leaves a partial checkpoint
+    tmp_path = Path(path).with_name(Path(path).name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded, checkpointed index builds.")
+    parser.add_argument('--work-dir', default=WORK_DIR, help="directory holding the plan and shard outputs")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    plan_parser = commands.add_parser('plan', help="split the URL list into shards")
+    plan_parser.add_argument('--csv', default='groww.csv', help="file with one URL per line")
+    plan_parser.add_argument('--shards', type=int, default=DEFAULT_SHARDS)
+    plan_parser.add_argument('--namespace', default="", help="Pinecone namespace to build into")
+
+    run_parser = commands.add_parser('run', help="build unfinished shards")
+    run_parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    run_parser.add_argument('--only', help="shards to build on this machine, e.g. 0-7 or 3,5")
+    run_parser.add_argument('--force', action='store_true', help="rebuild shards even if checkpointed")
+
+    commands.add_parser('status', help="show which shards are finished")
+
+    merge_parser = commands.add_parser('merge', help="combine finished shards into one index")
+    merge_parser.add_argument('--output-dir', help="where to write the merged stores (default: project directory)")
+
+    args = parser.parse_args()
+    if args.command == 'plan':
+        plan = plan_shards(args.csv, args.shards, args.work_dir, args.namespace)
+        print(f"Planned {plan['urls']} URLs into {plan['shards']} shards "
+              f"(sizes {min(plan['shard_sizes'])}-{max(plan['shard_sizes'])}) in {args.work_dir}")
+    elif args.command == 'run':
+        shards = _parse_ranges(args.only) if args.only else None
+        statuses = run_shards(args.work_dir, shards, args.workers, args.force)
+        sys.exit(1 if 'failed' in statuses.values() else 0)
+    elif args.command == 'status':
+        print_status(args.work_dir)
+    elif args.command == 'merge':
+        sys.exit(0 if merge_shards(args.work_dir, args.output_dir) else 1)
@@ -0,0 +1,87 @@
+"""
+Per-request timing of query stages (embed, search, hydrate, generate).
+
+Stages are recorded only inside collect_stages(), e.g. by the load tester
+or the API, so the instrumentation costs almost nothing in normal use.
+Records are kept per thread, matching how query_rag runs one query per
+thread; work fanned out to other threads collects its own records, which
+are merged back with add_parallel(). The API reports a record to clients
+as a Server-Timing header.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+
+_local = threading.local()
+
+class StageRecord:
+    """Seconds spent in each stage, and the stages that raised."""
+
+    def __init__(self):
+        self.durations = {}
+        self.failed = set()
+
+    def add_parallel(self, records):
+        """
+        Add the stages of records collected on other threads at the same
+        time. Each stage counts its slowest run, which is how long the
+        caller waited for it.
+        """
+        for name in dict.fromkeys(name for record in records for name in record.durations):
+            slowest = max(record.durations.get(name, 0.0) for record in records)
+            self.durations[name] = self.durations.get(name, 0.0) + slowest
+        for record in records:
+            self.failed |= record.failed
+
+    def server_timing(self):
+        """The record as a Server-Timing header value (durations in ms)."""
+        return ', '.join(f'{name};dur={seconds * 1000:.1f}' + (';desc="failed"' if name in self.failed else '')
+                         for name, seconds in self.durations.items())
+
+    @classmethod
+    def from_server_timing(cls, header):
+        """Parse a Server-Timing header written by server_timing()."""
+        record = cls()
+        for entry in (header or '').split(','):
+            name, *params = [part.strip() for part in entry.split(';')]
+            if not name:
+                continue
+            for param in params:
+                key, _, value = param.partition('=')
+                if key == 'dur':
+                    record.durations[name] = float(value) / 1000
+                elif key == 'desc' and value.strip('"') == 'failed':
+                    record.failed.add(name)
+        return record
+
+def current_record():
+    """The StageRecord being collected on this thread, or None."""
+    return getattr(_local, 'record', None)
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as `name`; repeated stages are summed."""
+    record = getattr(_local, 'record', None)
+    if record is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        record.failed.add(name)
+        raise
+    finally:
+        record.durations[name] = record.durations.get(name, 0.0) + time.perf_counter() - start
+
+@contextmanager
+def collect_stages():
+    """Collect a StageRecord for everything run in the block."""
+    record = StageRecord()
+    previous = getattr(_local, 'record', None)
+    _local.record = record
+    try:
+        yield record
+    finally:
+        _local.record = previous
@@ -0,0 +1,147 @@
+"""
+Sub-query decomposition for comparisons and multi-facet questions.
+
+"Compare the exit load and expense ratio of Groww Value Fund and Groww
+Liquid Fund" becomes one sub-query per scheme and fact ("What is the exit
+load of Groww Value Fund?", ...). Each sub-query searches only its scheme's
+partition for a couple of chunks. All of them run concurrently, and their
+embeddings are batched by the embedding dispatcher. The results are merged
+into one context grouped by scheme and fact, so a single, short completion
+can answer every part. Retrieval takes about as long as the slowest
+sub-query, and every scheme gets its own chunks.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from main import (
+    get_embedding, get_index, search_index, hydrate_matches, get_chunk_text, CHUNK_STORE_PATH
+)
+from corpus_store import open_store
+from conversation import detect_intents
+from index_versions import read_active_version
+from scheme_router import get_router, GENERAL_PARTITION
+from stage_timing import stage, collect_stages, current_record
+
+MAX_SUBQUERIES = 8
+# Chunks kept per sub-query, and the lowest score worth keeping
+SUBQUERY_TOP_K = 2
+SUBQUERY_MIN_SCORE = 0.5
+# Enough threads for every sub-query of every query the API runs at once
+# (RAG_API_MAX_INFLIGHT), so one comparison never queues behind another's
+SUBQUERY_WORKERS = int(os.getenv("RAG_API_MAX_INFLIGHT", "8")) * MAX_SUBQUERIES
+
+_pool = ThreadPoolExecutor(max_workers=SUBQUERY_WORKERS, thread_name_prefix='subquery')
+
+def plan_subqueries(query, router=None):
+    """
+    Split a question naming several schemes, or several facts of a scheme,
+    into sub-queries: [{'scheme', 'partition', 'intent', 'text'}]. Returns
+    [] for questions about one fact of one scheme, or naming no scheme,
+    which are searched as a whole.
+    """
+    if router is None:
+        router = get_router()
+    partitions = router.schemes(query)
+    intents = detect_intents(query)
+    if not partitions or (len(partitions) < 2 and len(intents) < 2):
+        return []
+
+    plan = []
+    for partition in partitions:
+        scheme = router.partitions[partition]['scheme']
+        for intent in intents or [None]:
+            plan.append({
+                'scheme': scheme,
+                'partition': partition,
+                'intent': intent,
+                # Without a known fact, the question itself is searched, but
+                # only within this scheme's partition
+                'text': f"What is the {intent} of {scheme}?" if intent else query
+            })
+    if len(plan) > MAX_SUBQUERIES:
+        print(f"[subqueries] Keeping {MAX_SUBQUERIES} of {len(plan)} sub-queries")
+    return plan[:MAX_SUBQUERIES]
+
+def run_subqueries(plan, deadline=None):
+    """
+    Retrieve chunks for every sub-query concurrently, all from the same
+    index version. Returns one list of RetrievedChunk per sub-query; a
+    sub-query that fails, or hasn't finished when the query's deadline
+    passes, gets an empty list.
+    """
+    version = read_active_version()
+    namespace = version['namespace'] if version else ""
+    chunk_store = open_store(version['chunk_store'] if version else CHUNK_STORE_PATH)
+    index = get_index()
+    router = get_router(version)
+    general = [GENERAL_PARTITION] if GENERAL_PARTITION in router.partitions else []
+
+    def timeout():
+        return deadline.remaining() if deadline else None
+
+    def retrieve(subquery):
+        try:
+            embedding = get_embedding(subquery['text'], timeout=timeout())
+            if not embedding:
+                return []
+            metadata_filter = router.search_filter([subquery['partition']] + general)
+            with stage('search'):
+                matches = search_index(index, namespace, embedding, SUBQUERY_TOP_K,
+                                       include_metadata=chunk_store is None, metadata_filter=metadata_filter,
+                                       timeout=timeout())
+            with stage('hydrate'):
+                return hydrate_matches([match for match in matches if match.score >= SUBQUERY_MIN_SCORE],
+                                       store=chunk_store)
+        except Exception as e:
+            print(f"Error in sub-query '{subquery['text']}': {e}")
+            return []
+
+    # Stage timings are per thread, so each sub-query collects its own and
+    # they are merged into the caller's record
+    def timed_retrieve(subquery):
+        with collect_stages() as record:
+            return retrieve(subquery), record
+
+    futures = [_pool.submit(timed_retrieve, subquery) for subquery in plan]
+    wait(futures, timeout=timeout())
+    # Sub-queries that haven't started yet are dropped instead of holding a
+    # worker after their query has given up on them
+    for future in futures:
+        future.cancel()
+    finished = [future.done() and not future.cancelled() for future in futures]
+    late = finished.count(False)
+    if late:
+        print(f"[deadline] {late} of {len(plan)} sub-queries didn't finish in time")
+    outputs = [future.result() if done else ([], None) for future, done in zip(futures, finished)]
+    parent = current_record()
+    if parent is not None:
+        parent.add_parallel([record for _, record in outputs if record is not None])
+    return [chunks for chunks, _ in outputs]
+
+def merge_results(plan, results):
+    """
+    One context grouped by scheme, then by fact, with each chunk included
+    once. Returns (context text, chunks in context order).
+    """
+    lines = []
+    chunks = []
+    seen = set()
+    for scheme in dict.fromkeys(subquery['scheme'] for subquery in plan):
+        lines.append(f"## {scheme}")
+        for subquery, found in zip(plan, results):
+            if subquery['scheme'] != scheme:
+                continue
+            label = subquery['intent'] or 'Details'
+            if not found:
+                lines.append(f"[{label}] No matching passage found.")
+                continue
+            new = [chunk for chunk in found if chunk.id not in seen]
+            if not new:
+                lines.append(f"[{label}] See the passages above.")
+            for chunk in new:
+                seen.add(chunk.id)
+                chunks.append(chunk)
+                lines.append(f"[{label}] (source: {chunk.metadata.get('url', 'unknown')})\n{get_chunk_text(chunk)}")
+        lines.append("")
+    return "\n".join(lines).strip(), chunks
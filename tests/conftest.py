@@ -0,0 +1,40 @@
+import sys
+import time
+import threading
+from pathlib import Path
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+FIXTURES = Path(__file__).resolve().parent / 'fixtures'
+
+# The project modules live at the repository root
+sys.path.insert(0, str(ROOT))
+
+# How long the /slow/ pages take to answer
+SLOW_PAGE_SECONDS = 2
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    """Serves tests/fixtures; paths under /slow/ answer after SLOW_PAGE_SECONDS."""
+
+    def do_GET(self):
+        if self.path.startswith('/slow/'):
+            time.sleep(SLOW_PAGE_SECONDS)
+            self.path = self.path[len('/slow'):]
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture(scope='session')
+def fixture_server():
+    """Base URL of a local HTTP server for the fixture pages, on an ephemeral port."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(FixtureHandler, directory=str(FIXTURES)))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,80 @@
+"""
+BuildCheckpoint: a build that dies partway is resumed from what was
+recorded, including after a crash in the middle of a write.
+"""
+
+import json
+
+import pytest
+
+from build_checkpoint import (
+    BuildCheckpoint, EXTRACTED_FILE, EMBEDDINGS_FILE, EMBEDDING_IDS_FILE, UPSERTED_FILE
+)
+
+SNAPSHOT = 'a' * 64
+
+@pytest.fixture
+def partial_build(tmp_path):
+    """A checkpoint left by a build that died during its upserts."""
+    path = tmp_path / 'build_checkpoint'
+    checkpoint = BuildCheckpoint(path)
+    checkpoint.record_extraction({'url': 'https://example.com/a', 'text': 'Exit load 1%'})
+    checkpoint.record_extraction({'url': 'https://example.com/b', 'text': 'Expense ratio 0.5%'})
+    checkpoint.bind_snapshot(SNAPSHOT)
+    checkpoint.record_embeddings(['a_chunk0', 'a_chunk1'], [[1.0, 2.0], [3.0, 4.0]])
+    checkpoint.record_embeddings(['b_chunk0'], [[5.0, 6.0]])
+    checkpoint.record_upserts(['a_chunk0', 'a_chunk1'])
+    return path
+
+def test_resume_keeps_the_recorded_progress(partial_build):
+    checkpoint = BuildCheckpoint(partial_build, resume=True)
+    checkpoint.bind_snapshot(SNAPSHOT)
+
+    assert [doc['url'] for doc in checkpoint.extracted_corpus()] == ['https://example.com/a', 'https://example.com/b']
+    assert checkpoint.embeddings() == {'a_chunk0': [1.0, 2.0], 'a_chunk1': [3.0, 4.0], 'b_chunk0': [5.0, 6.0]}
+    assert checkpoint.upserted_ids() == {'a_chunk0', 'a_chunk1'}
+
+def test_torn_writes_are_dropped_and_later_appends_line_up(partial_build):
+    # A crash in the middle of each append
+    with open(partial_build / EXTRACTED_FILE, 'ab') as f:
+        f.write(json.dumps({'url': 'https://example.com/c', 'text': 'NAV'}).encode()[:20])
+    with open(partial_build / EMBEDDINGS_FILE, 'ab') as f:
+        f.write(b'\x00' * 6)
+    with open(partial_build / EMBEDDING_IDS_FILE, 'ab') as f:
+        f.write(b'c_chu')
+    with open(partial_build / UPSERTED_FILE, 'ab') as f:
+        f.write(b'b_chu')
+
+    checkpoint = BuildCheckpoint(partial_build, resume=True)
+    checkpoint.bind_snapshot(SNAPSHOT)
+    assert len(checkpoint.extracted_corpus()) == 2
+    assert set(checkpoint.embeddings()) == {'a_chunk0', 'a_chunk1', 'b_chunk0'}
+    assert checkpoint.upserted_ids() == {'a_chunk0', 'a_chunk1'}
+
+    checkpoint.record_embeddings(['c_chunk0'], [[7.0, 8.0]])
+    checkpoint.record_upserts(['b_chunk0'])
+    resumed = BuildCheckpoint(partial_build, resume=True)
+    assert resumed.embeddings()['c_chunk0'] == [7.0, 8.0]
+    assert resumed.embeddings()['b_chunk0'] == [5.0, 6.0]
+    assert resumed.upserted_ids() == {'a_chunk0', 'a_chunk1', 'b_chunk0'}
+
+def test_changed_corpus_discards_embeddings_and_upserts(partial_build):
+    checkpoint = BuildCheckpoint(partial_build, resume=True)
+    checkpoint.bind_snapshot('b' * 64)
+
+    assert checkpoint.embeddings() == {}
+    assert checkpoint.upserted_ids() == set()
+    # Extraction doesn't depend on the snapshot
+    assert len(checkpoint.extracted_corpus()) == 2
+
+def test_new_build_without_resume_starts_over(partial_build):
+    checkpoint = BuildCheckpoint(partial_build)
+
+    assert not partial_build.exists()
+    assert checkpoint.extracted_corpus() == []
+    assert checkpoint.embeddings() == {}
+
+def test_clear_removes_the_checkpoint(partial_build):
+    BuildCheckpoint(partial_build, resume=True).clear()
+
+    assert not partial_build.exists()
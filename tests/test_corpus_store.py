@@ -0,0 +1,74 @@
+"""
+Corpus stores: reading records back, and swapping in a rebuilt store while
+readers of the old one are still running.
+"""
+
+import os
+import gc
+import weakref
+
+import pytest
+
+from corpus_store import CorpusStore, CorpusStoreWriter, open_store, write_chunk_store
+
+def chunks(text):
+    return [{'id': f'fund_chunk{i}', 'text': f'{text} {i}', 'metadata': {'url': 'https://example.com/fund'}}
+            for i in range(3)]
+
+def replace_store(path, documents):
+    """Rebuild the store at path, as a publish does, with a newer mtime."""
+    stat = os.stat(path)
+    write_chunk_store(documents, path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+def test_records_are_read_back(tmp_path):
+    path = tmp_path / 'chunks.mfcs'
+    write_chunk_store(chunks('Exit load'), path, meta={'snapshot_hash': 'abc'})
+
+    store = CorpusStore(path)
+    assert len(store) == 3
+    assert 'fund_chunk1' in store
+    assert store.get('fund_chunk1') == {'id': 'fund_chunk1', 'text': 'Exit load 1', 'url': 'https://example.com/fund'}
+    assert store.get('missing') is None
+    assert store.meta['snapshot_hash'] == 'abc'
+
+def test_writer_leaves_no_store_when_it_fails(tmp_path):
+    path = tmp_path / 'chunks.mfcs'
+
+    with pytest.raises(ValueError):
+        with CorpusStoreWriter(path) as writer:
+            writer.add('chunk0', {'text': 'a'})
+            writer.add('chunk0', {'text': 'b'})
+    assert not path.exists()
+    assert list(tmp_path.iterdir()) == []
+
+def test_open_store_is_shared_until_the_file_is_replaced(tmp_path):
+    path = tmp_path / 'chunks.mfcs'
+    write_chunk_store(chunks('Exit load'), path)
+
+    first = open_store(path)
+    assert open_store(path) is first
+
+    replace_store(path, chunks('Expense ratio'))
+    second = open_store(path)
+    assert second is not first
+    assert second.get('fund_chunk0')['text'] == 'Expense ratio 0'
+    assert open_store(path) is second
+
+def test_replaced_store_stays_readable_until_released(tmp_path):
+    path = tmp_path / 'chunks.mfcs'
+    write_chunk_store(chunks('Exit load'), path)
+    # A query that fetched the store before the swap
+    held = open_store(path)
+    held_file = weakref.ref(held._file)
+
+    replace_store(path, chunks('Expense ratio'))
+    open_store(path)
+    assert held.get('fund_chunk2')['text'] == 'Exit load 2'
+
+    del held
+    gc.collect()
+    assert held_file() is None or held_file().closed
+
+def test_open_store_of_a_missing_file_is_none(tmp_path):
+    assert open_store(tmp_path / 'chunks.mfcs') is None
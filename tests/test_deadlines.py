@@ -0,0 +1,123 @@
+"""
+hedged_call: hedged requests, replacement of failed ones, and the deadline
+cutoff, with calls that block on an event instead of a real model.
+"""
+
+import time
+import threading
+
+import pytest
+
+from deadlines import Deadline, DeadlineExceeded, hedged_call, MAX_ATTEMPTS
+
+HEDGE_AFTER = 0.05
+
+class FixedTracker:
+    """A LatencyTracker that hedges after HEDGE_AFTER seconds."""
+
+    def __init__(self):
+        self.recorded = []
+
+    def hedge_after(self):
+        return HEDGE_AFTER
+
+    def record(self, seconds):
+        self.recorded.append(seconds)
+
+class ScriptedCall:
+    """
+    call(timeout) for hedged_call. Request n follows behaviours[n]: 'hang'
+    blocks until released, an exception is raised, anything else is
+    returned. Requests past the script hang.
+    """
+
+    def __init__(self, *behaviours):
+        self.behaviours = behaviours
+        self.timeouts = []
+        self.released = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self, timeout):
+        with self._lock:
+            n = len(self.timeouts)
+            self.timeouts.append(timeout)
+        behaviour = self.behaviours[n] if n < len(self.behaviours) else 'hang'
+        if behaviour == 'hang':
+            self.released.wait(5)
+            return 'late'
+        if isinstance(behaviour, Exception):
+            raise behaviour
+        return behaviour
+
+    def release(self):
+        self.released.set()
+
+@pytest.fixture
+def scripted():
+    calls = []
+
+    def make(*behaviours):
+        call = ScriptedCall(*behaviours)
+        calls.append(call)
+        return call
+
+    yield make
+    # Let requests still running finish, so they don't outlive the test
+    for call in calls:
+        call.release()
+
+def test_fast_call_is_not_hedged(scripted):
+    call, tracker = scripted('answer'), FixedTracker()
+
+    assert hedged_call(call, Deadline(2000), tracker) == 'answer'
+    assert len(call.timeouts) == 1
+    assert len(tracker.recorded) == 1
+
+def test_slow_call_is_hedged_and_the_hedge_wins(scripted):
+    call, tracker = scripted('hang', 'hedged answer'), FixedTracker()
+
+    start = time.monotonic()
+    assert hedged_call(call, Deadline(2000), tracker) == 'hedged answer'
+    assert HEDGE_AFTER <= time.monotonic() - start < 1.0
+    assert len(call.timeouts) == 2
+
+def test_failed_request_is_replaced_at_once(scripted):
+    call = scripted(ConnectionError('reset'), 'answer')
+
+    assert hedged_call(call, Deadline(2000), FixedTracker()) == 'answer'
+    assert len(call.timeouts) == 2
+
+def test_error_that_retrying_cannot_fix_is_raised(scripted):
+    call = scripted(ValueError('bad request'), 'answer')
+
+    with pytest.raises(ValueError):
+        hedged_call(call, Deadline(2000), FixedTracker())
+    assert len(call.timeouts) == 1
+
+def test_deadline_cuts_off_requests_that_never_answer(scripted):
+    call, tracker = scripted(), FixedTracker()
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        hedged_call(call, Deadline(300), tracker, reserve=0.1)
+    # The reserve is left for the caller's fallback
+    assert time.monotonic() - start < 0.3
+    assert len(call.timeouts) <= MAX_ATTEMPTS
+    assert tracker.recorded == []
+
+def test_requests_get_only_the_time_left(scripted):
+    call = scripted('hang', 'answer')
+
+    hedged_call(call, Deadline(1000), FixedTracker(), reserve=0.2)
+    first, hedge = call.timeouts
+    assert first <= 0.8
+    assert hedge <= first - HEDGE_AFTER + 0.01
+
+def test_no_request_is_sent_once_the_deadline_has_passed(scripted):
+    call = scripted('answer')
+    deadline = Deadline(50)
+    time.sleep(0.1)
+
+    with pytest.raises(DeadlineExceeded):
+        hedged_call(call, deadline, FixedTracker())
+    assert call.timeouts == []
@@ -0,0 +1,92 @@
+"""
+EmbeddingDispatcher: requests arriving together are sent as one batch, and
+identical texts in flight are embedded once.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from embedding_dispatcher import EmbeddingDispatcher
+
+class RecordingEmbedder:
+    """embed_batch stand-in: records each batch and embeds a text as [len(text)]."""
+
+    def __init__(self, gate=None):
+        self.batches = []
+        self.gate = gate
+        self._lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self._lock:
+            self.batches.append(list(texts))
+        if self.gate is not None:
+            self.gate.wait(5)
+        return [[float(len(text))] for text in texts]
+
+def test_concurrent_requests_are_sent_as_one_batch():
+    embedder = RecordingEmbedder()
+    dispatcher = EmbeddingDispatcher(embedder, window_ms=100)
+    texts = [f"question {'?' * i}" for i in range(6)]
+
+    with ThreadPoolExecutor(max_workers=len(texts)) as pool:
+        vectors = list(pool.map(lambda text: dispatcher.embed(text, timeout=5), texts))
+
+    assert vectors == [[float(len(text))] for text in texts]
+    assert len(embedder.batches) == 1
+    assert sorted(embedder.batches[0]) == sorted(texts)
+    assert dispatcher.stats['batches'] == 1
+
+def test_batches_are_split_at_max_batch():
+    embedder = RecordingEmbedder()
+    dispatcher = EmbeddingDispatcher(embedder, window_ms=100, max_batch=2)
+
+    futures = [dispatcher.submit(f"text {i}") for i in range(5)]
+    results = [future.result(timeout=5) for future in futures]
+
+    assert len(results) == 5
+    assert sorted(len(batch) for batch in embedder.batches) == [1, 2, 2]
+    assert dispatcher.stats['texts_sent'] == 5
+
+def test_identical_texts_in_flight_are_embedded_once():
+    gate = threading.Event()
+    embedder = RecordingEmbedder(gate)
+    dispatcher = EmbeddingDispatcher(embedder, window_ms=20)
+
+    first = dispatcher.submit("What is the exit load?")
+    second = dispatcher.submit("What is the exit load?")
+    gate.set()
+
+    assert second is first
+    assert first.result(timeout=5) == [22.0]
+    assert embedder.batches == [["What is the exit load?"]]
+    assert dispatcher.stats == {'requests': 2, 'coalesced': 1, 'batches': 1, 'texts_sent': 1}
+
+def test_text_is_sent_again_once_its_batch_has_finished():
+    embedder = RecordingEmbedder()
+    dispatcher = EmbeddingDispatcher(embedder, window_ms=1)
+
+    dispatcher.embed("NAV", timeout=5)
+    dispatcher.embed("NAV", timeout=5)
+
+    assert embedder.batches == [["NAV"], ["NAV"]]
+
+def test_failed_batch_fails_every_request_in_it():
+    def embed_batch(texts):
+        raise ConnectionError("embeddings unavailable")
+
+    dispatcher = EmbeddingDispatcher(embed_batch, window_ms=50)
+    futures = [dispatcher.submit(text) for text in ("a", "b")]
+
+    for future in futures:
+        with pytest.raises(ConnectionError):
+            future.result(timeout=5)
+
+def test_wrong_number_of_vectors_is_an_error():
+    dispatcher = EmbeddingDispatcher(lambda texts: [[0.0]], window_ms=50)
+    futures = [dispatcher.submit(text) for text in ("a", "b")]
+
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result(timeout=5)
@@ -0,0 +1,152 @@
+"""
+Static extraction, the browser fallback and the browser pool, against pages
+served from tests/fixtures by a local HTTP server.
+"""
+
+import sys
+import json
+import subprocess
+
+import pytest
+import requests
+
+import extractor
+from browser_pool import BrowserPool
+from conftest import ROOT
+
+GROWW_URL = 'https://groww.in/mutual-funds/groww-value-fund-direct-growth'
+
+class StubDriver:
+    """Stands in for a Chrome webdriver; pages are fetched without running scripts."""
+
+    def __init__(self):
+        self.page_load_timeout = None
+        self.page_source = ''
+        self.visited = []
+        self.quit_called = False
+
+    def set_page_load_timeout(self, seconds):
+        self.page_load_timeout = seconds
+
+    def get(self, url):
+        from selenium.common.exceptions import TimeoutException
+
+        self.visited.append(url)
+        try:
+            response = requests.get(url, timeout=self.page_load_timeout)
+        except requests.Timeout:
+            raise TimeoutException(f"Timed out receiving message from renderer: {self.page_load_timeout}")
+        self.page_source = response.text
+
+    def quit(self):
+        self.quit_called = True
+
+class StubPool(BrowserPool):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.drivers = []
+
+    def _create_driver(self):
+        driver = StubDriver()
+        self.drivers.append(driver)
+        return driver
+
+def test_static_extraction_of_complete_page(fixture_server):
+    text = extractor.extract_text_from_url(f"{fixture_server}/complete_scheme.html")
+
+    assert extractor.missing_key_facts(text) == []
+    # Fact blocks come first, tables row by row, then the page text
+    blocks = text.split('\n\n')
+    assert blocks[0] == 'Expense ratio 0.85% Min. SIP amount Rs. 500 Benchmark NIFTY 500 Total Return Index'
+    assert 'Exit Load | 1% if redeemed within 1 year' in blocks[1].splitlines()
+    assert blocks[-1].startswith('Groww Value Fund Direct Growth')
+    assert blocks[-1].endswith('Mutual fund investments are subject to market risks.')
+    assert 'window.__APP__' not in text
+
+def test_fallback_only_for_groww_page_missing_key_facts(fixture_server):
+    complete = extractor.extract_text_from_html(requests.get(f"{fixture_server}/complete_scheme.html").text)
+    incomplete = extractor.extract_text_from_html(requests.get(f"{fixture_server}/js_scheme.html").text)
+
+    assert extractor.missing_key_facts(incomplete) == ['expense ratio', 'exit load']
+    assert extractor.needs_browser_fallback(GROWW_URL, incomplete)
+    assert not extractor.needs_browser_fallback(GROWW_URL, complete)
+    assert not extractor.needs_browser_fallback('https://www.sebi.gov.in/filings/mutual-funds', incomplete)
+    # A page that couldn't be fetched at all is rendered too
+    assert extractor.needs_browser_fallback(GROWW_URL, None)
+
+def test_browser_renders_only_pages_missing_facts(fixture_server, monkeypatch):
+    rendered = []
+
+    class RenderingPool:
+        def render(self, url, wait_for=(), wait_seconds=None):
+            rendered.append(url)
+            return requests.get(f"{fixture_server}/complete_scheme.html").text
+
+    monkeypatch.setattr(extractor, 'BROWSER_FALLBACK_DOMAINS', ('127.0.0.1',))
+    monkeypatch.setattr(extractor, 'get_browser_pool', lambda: RenderingPool())
+
+    extractor.extract_text_from_url(f"{fixture_server}/complete_scheme.html")
+    assert rendered == []
+
+    text = extractor.extract_text_from_url(f"{fixture_server}/js_scheme.html")
+    assert rendered == [f"{fixture_server}/js_scheme.html"]
+    assert extractor.missing_key_facts(text) == []
+
+def test_selenium_not_imported_until_fallback(fixture_server):
+    # A fresh interpreter, so modules imported by other tests don't count.
+    # webdriver_manager is replaced so no driver is downloaded or started.
+    script = f"""
+import sys, json, types
+import extractor
+
+loaded = lambda: any(name.split('.')[0] == 'selenium' for name in sys.modules)
+extractor.extract_text_from_url({fixture_server + '/complete_scheme.html'!r})
+after_static = loaded()
+
+class ChromeDriverManager:
+    def install(self):
+        raise RuntimeError('no driver in tests')
+chrome = types.ModuleType('webdriver_manager.chrome')
+chrome.ChromeDriverManager = ChromeDriverManager
+sys.modules['webdriver_manager'] = types.ModuleType('webdriver_manager')
+sys.modules['webdriver_manager.chrome'] = chrome
+
+extractor.BROWSER_FALLBACK_DOMAINS = ('127.0.0.1',)
+extractor.extract_text_from_url({fixture_server + '/js_scheme.html'!r})
+print(json.dumps({{'after_static': after_static, 'after_fallback': loaded()}}))
+"""
+    result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    imports = json.loads(result.stdout.strip().splitlines()[-1])
+    assert imports == {'after_static': False, 'after_fallback': True}
+
+def test_render_reuses_browser(fixture_server):
+    pool = StubPool(size=2, page_load_timeout=5)
+
+    first = pool.render(f"{fixture_server}/complete_scheme.html")
+    second = pool.render(f"{fixture_server}/js_scheme.html")
+
+    assert len(pool.drivers) == 1
+    driver = pool.drivers[0]
+    assert driver.page_load_timeout == 5
+    assert driver.visited == [f"{fixture_server}/complete_scheme.html", f"{fixture_server}/js_scheme.html"]
+    assert 'Exit Load' in first and 'Loading fund details' in second
+    assert not driver.quit_called
+
+    pool.close()
+    assert driver.quit_called
+
+def test_page_load_timeout_discards_browser(fixture_server):
+    from selenium.common.exceptions import TimeoutException
+
+    pool = StubPool(size=1, page_load_timeout=0.2)
+
+    with pytest.raises(TimeoutException):
+        pool.render(f"{fixture_server}/slow/complete_scheme.html")
+    assert pool.drivers[0].quit_called
+    assert pool._started == 0
+
+    # The next page gets a fresh browser
+    assert 'Exit Load' in pool.render(f"{fixture_server}/complete_scheme.html")
+    assert len(pool.drivers) == 2
+    assert not pool.drivers[1].quit_called
@@ -0,0 +1,133 @@
+"""
+Token buckets and RateLimiter.run's retries, with backoff sleeps recorded
+instead of slept.
+"""
+
+import time
+
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimiter, TokenBucket
+
+class APIError(Exception):
+    """An API error as the OpenAI SDK raises it: status_code and the response headers."""
+
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = type('Response', (), {'headers': headers or {}})()
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Backoff delays that RateLimiter.run asked to sleep for."""
+    recorded = []
+    monkeypatch.setattr(rate_limiter.time, 'sleep', recorded.append)
+    monkeypatch.setattr(rate_limiter, 'backoff_delay', lambda attempt: 0.1 * 2 ** attempt)
+    return recorded
+
+def failing(errors, result='ok'):
+    """A call that raises each of errors in turn, then returns result."""
+    calls = []
+
+    def call():
+        calls.append(time.monotonic())
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    return call, calls
+
+def test_bucket_refills_continuously_up_to_capacity():
+    bucket = TokenBucket(60, period=60)
+    now = bucket.updated
+    bucket.take(60)
+
+    assert bucket.wait_time(1, now) == pytest.approx(1.0)
+    assert bucket.wait_time(1, now + 0.5) == pytest.approx(0.5)
+    assert bucket.wait_time(30, now + 30) == 0.0
+    bucket.wait_time(1, now + 600)
+    assert bucket.level == 60
+
+def test_bucket_allows_a_request_larger_than_capacity_once_full():
+    bucket = TokenBucket(10, period=60)
+
+    assert bucket.wait_time(25, bucket.updated) == 0.0
+    bucket.take(25)
+    assert bucket.level == 0
+
+def test_pause_empties_the_bucket_for_the_given_time():
+    bucket = TokenBucket(60, period=60)
+    now = bucket.updated
+    bucket.pause(2.0, now)
+
+    assert bucket.wait_time(1, now) == pytest.approx(3.0)
+
+def test_429_is_retried_with_backoff_and_halves_concurrency(sleeps):
+    limiter = RateLimiter('test', rpm=6000, tpm=10 ** 9, max_concurrency=8)
+    call, calls = failing([APIError(429), APIError(429)])
+
+    assert limiter.run(call) == 'ok'
+    assert len(calls) == 3
+    assert sleeps == [0.1, 0.2]
+    assert limiter.stats['rate_limited'] == 2
+    # Halved twice, then grown back by one slot on success
+    assert limiter.concurrency == 3
+
+def test_retry_after_pauses_the_bucket_instead_of_sleeping(sleeps):
+    limiter = RateLimiter('test', rpm=6000, tpm=10 ** 9)
+    call, calls = failing([APIError(429, {'retry-after': '0.2'})])
+
+    assert limiter.run(call) == 'ok'
+    assert sleeps == []
+    assert calls[1] - calls[0] >= 0.15
+
+def test_429_is_raised_once_retries_are_exhausted(sleeps):
+    limiter = RateLimiter('test', rpm=6000, tpm=10 ** 9)
+    call, calls = failing([APIError(429, {'retry-after': '0.01'})] * 5)
+
+    with pytest.raises(APIError):
+        limiter.run(call, max_retries=2)
+    assert len(calls) == 3
+
+@pytest.mark.parametrize('error', [ConnectionError('reset'), TimeoutError('read timed out'),
+                                   APIError(408), APIError(409), APIError(503)])
+def test_transient_errors_are_retried(sleeps, error):
+    limiter = RateLimiter('test', rpm=6000, tpm=10 ** 9)
+    call, calls = failing([error])
+
+    assert limiter.run(call) == 'ok'
+    assert len(calls) == 2
+    assert limiter.stats['rate_limited'] == 0
+
+@pytest.mark.parametrize('error', [ValueError('bad input'), TypeError('bug'), APIError(400), APIError(401)])
+def test_other_errors_are_raised_at_once(sleeps, error):
+    limiter = RateLimiter('test', rpm=6000, tpm=10 ** 9)
+    call, calls = failing([error])
+
+    with pytest.raises(type(error)):
+        limiter.run(call)
+    assert len(calls) == 1
+    assert sleeps == []
+    assert limiter.active == 0
+
+def test_no_retry_is_started_past_stop_at(sleeps):
+    limiter = RateLimiter('test', rpm=6000, tpm=10 ** 9)
+    call, calls = failing([APIError(503)] * 5)
+
+    with pytest.raises(APIError):
+        # The second backoff (0.2 s) would end after stop_at
+        limiter.run(call, stop_at=time.monotonic() + 0.15)
+    assert len(calls) == 2
+    assert sleeps == [0.1]
+
+def test_acquire_gives_up_at_stop_at():
+    limiter = RateLimiter('test', rpm=1, tpm=10 ** 9)
+    limiter.acquire()
+    limiter.release()
+
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        limiter.acquire(stop_at=start + 0.2)
+    assert 0.15 <= time.monotonic() - start < 1.0
+    assert limiter.active == 0
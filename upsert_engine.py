@@ -0,0 +1,111 @@
+"""
+Parallel, size-aware vector upserts with retry and backoff.
+
+Batches are built by estimated request size rather than vector count, since
+the metadata attached to each vector varies widely. Batches are sent from a
+thread pool, and failed batches are retried with exponential backoff and
+full jitter before being reported in the returned summary.
+"""
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from retry_policy import BASE_DELAY, MAX_DELAY, is_retryable, backoff_delay
+
+# Pinecone rejects upsert requests over 2 MB or 1000 vectors; stay below both
+MAX_BATCH_BYTES = 1_500_000
+MAX_BATCH_VECTORS = 500
+MAX_WORKERS = 4
+MAX_RETRIES = 5
+
+def estimate_vector_bytes(vector):
+    """
+    Approximate the serialised size of one vector in an upsert request.
+    """
+    return len(json.dumps(vector, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+def make_batches(vectors, max_bytes=MAX_BATCH_BYTES, max_vectors=MAX_BATCH_VECTORS):
+    """
+    Group vectors into batches that stay under max_bytes and max_vectors.
+    A single vector larger than max_bytes is sent in a batch of its own.
+    """
+    batches = []
+    current, current_bytes = [], 0
+    for vector in vectors:
+        size = estimate_vector_bytes(vector)
+        if current and (current_bytes + size > max_bytes or len(current) >= max_vectors):
+            batches.append(current)
+            current, current_bytes = [], 0
+        current.append(vector)
+        current_bytes += size
+    if current:
+        batches.append(current)
+    return batches
+
+def _send_with_retry(send_batch, batch, max_retries, base_delay, max_delay):
+    """
+    Send one batch, retrying transient failures.
+    Returns (attempts, error) where error is None on success.
+    """
+    attempt = 0
+    while True:
+        try:
+            send_batch(batch)
+            return attempt + 1, None
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                return attempt + 1, e
+            time.sleep(backoff_delay(attempt, base_delay, max_delay))
+            attempt += 1
+
+def upsert_in_parallel(send_batch, vectors, max_bytes=MAX_BATCH_BYTES, max_vectors=MAX_BATCH_VECTORS,
+                       max_workers=MAX_WORKERS, max_retries=MAX_RETRIES,
+                       base_delay=BASE_DELAY, max_delay=MAX_DELAY, on_success=None):
+    """
+    Upsert vectors using send_batch(list_of_vectors) for each request.
+    on_success: called with the ids of each batch as soon as it is
+        acknowledged, from the calling thread
+    Returns a summary dict with counts, elapsed time and a 'failures' list
+    of {'batch', 'ids', 'attempts', 'error'} for batches that never succeeded.
+    """
+    start = time.perf_counter()
+    batches = make_batches(vectors, max_bytes=max_bytes, max_vectors=max_vectors)
+    summary = {
+        'batches': len(batches),
+        'vectors': len(vectors),
+        'upserted': 0,
+        'retries': 0,
+        'failures': []
+    }
+    if not batches:
+        summary['elapsed'] = 0.0
+        return summary
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as executor:
+        futures = {
+            executor.submit(_send_with_retry, send_batch, batch, max_retries, base_delay, max_delay): number
+            for number, batch in enumerate(batches, 1)
+        }
+        for future in as_completed(futures):
+            number = futures[future]
+            batch = batches[number - 1]
+            attempts, error = future.result()
+            summary['retries'] += attempts - 1
+            if error is None:
+                summary['upserted'] += len(batch)
+                if on_success:
+                    on_success([vector['id'] for vector in batch])
+                print(f"Upserted batch {number}/{len(batches)} ({len(batch)} vectors)")
+            else:
+                print(f"Error upserting batch {number}/{len(batches)} after {attempts} attempt(s): {error}")
+                summary['failures'].append({
+                    'batch': number,
+                    'ids': [vector['id'] for vector in batch],
+                    'attempts': attempts,
+                    'error': str(error)
+                })
+
+    summary['failures'].sort(key=lambda failure: failure['batch'])
+    summary['elapsed'] = time.perf_counter() - start
+    return summary